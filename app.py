@@ -1,15 +1,15 @@
-import streamlit as st
-from connectors.atlas_connection import AtlasConnection
-from processors.embeddings import EmbeddingModel
-from processors.user_query_processor import UserQueryProcessor
-from processors.llm_processor import LLMProcessor
-from baml_client import b
-from dotenv import load_dotenv
-import logging
-import os
-from flask import Flask
-from threading import Thread
-import time
+from utils.startup import timeline
+
+with timeline.phase("imports"):
+    import streamlit as st
+    from processors.job_queue import JobStatus, QueueFullError
+    from utils.health_server import start_health_server
+    from utils.metrics import track_stage
+    from utils.registry import REQUIRED_COMPONENTS, registry, register_default_components
+    from dotenv import load_dotenv
+    import logging
+    import os
+    import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -17,20 +17,14 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-# Flask app for health check
-health_app = Flask(__name__)
+# Start the health check server in a separate thread (once per process)
+with timeline.phase("health_server"):
+    start_health_server()
 
-@health_app.route('/_stcore/health')
-def health_check():
-    return "OK", 200
-
-def run_health_check_server():
-    health_app.run(host='0.0.0.0', port=8080)
-
-# Start the health check server in a separate thread
-health_thread = Thread(target=run_health_check_server)
-health_thread.daemon = True
-health_thread.start()
+# Register shared components and start building them in the background, once per process
+with timeline.phase("register_components"):
+    register_default_components()
+    registry.warmup(background=True)
 
 # Set layout
 st.set_page_config(page_title="Incident Insight Assistant", layout="centered")
@@ -86,39 +80,32 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Initialize components with error handling and timeout
-@st.cache_resource
 def initialize_components():
-    """Initialize all components with proper error handling and timeout"""
+    """Fetch the process-wide shared components, building them on first use"""
     try:
-        logger.info("Initializing components...")
-        
-        # Initialize embedding model with timeout
-        embedding_model = EmbeddingModel()
-        
-        # Initialize LLM processor
-        llm_processor = LLMProcessor()
-        
-        # Initialize Atlas connection
-        atlas_client = AtlasConnection()
-        atlas_client.ping()
-        collection = atlas_client.get_collection("incidents")
-        
+        embedding_model = registry.get("embedding_model")
+        llm_processor = registry.get("llm_processor")
+        atlas_client = registry.get("atlas_client")
+        collection = registry.get("collection")
         return embedding_model, llm_processor, atlas_client, collection, None
-        
+
     except Exception as e:
         logger.error(f"Initialization error: {e}")
         return None, None, None, None, str(e)
 
-# Load components with progress indicator
-with st.spinner("🔄 Initializing system components..."):
+# Load components with progress indicator (only blocks until the first build finishes)
+if registry.is_ready(REQUIRED_COMPONENTS):
     embedding_model, llm_processor, atlas_client, collection, init_error = initialize_components()
-
+else:
+    with st.spinner("🔄 Initializing system components..."):
+        embedding_model, llm_processor, atlas_client, collection, init_error = initialize_components()
 
 if init_error:
     st.error(f"❌ Failed to initialize system: {init_error}")
     st.info("Please check your API keys and database connection.")
     st.stop()
 else:
+    timeline.log_once()
     st.success("✅ System ready! Using HuggingFace API for embeddings.")
 
 # ---------- UI ----------
@@ -138,108 +125,130 @@ with col2:
     run_judge_eval = st.checkbox("Run LLM-as-Judge Evaluation", value=True)
 
 # ---------- Main Logic ----------
+STAGE_LABELS = {
+    "queued": "⏳ Waiting for a free analysis worker...",
+    "retrieval": "🔍 Finding similar incidents...",
+    "llm": "🤖 Generating insights with LLM...",
+    "judge": "📊 Evaluating response quality...",
+    "done": "✅ Analysis complete",
+}
+
 if analyze_button:
     if user_input.strip():
         # Clear any previous results
-        if "llm_response" in st.session_state:
-            del st.session_state["llm_response"]
-        if "user_input" in st.session_state:
-            del st.session_state["user_input"]
-            
+        for key in ("llm_response", "user_input", "judge_response", "judge_error", "judge_skipped", "similar_count", "job_id"):
+            if key in st.session_state:
+                del st.session_state[key]
+
         try:
             logger.info(f"User input received: {len(user_input)} characters")
-
-            # Step 1: Find similar incidents with timeout
-            similar_texts = []
-            try:
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-                
-                status_text.text("🔍 Finding similar incidents...")
-                progress_bar.progress(10)
-                
-                start_time = time.time()
-                query_processor = UserQueryProcessor(
-                    user_query=user_input, 
-                    embedding_model=embedding_model
-                )
-                
-                progress_bar.progress(30)
-                similar_texts = query_processor.process_query(collection)
-                
-                elapsed_time = time.time() - start_time
-                progress_bar.progress(60)
-                
-                logger.info(f"Found {len(similar_texts)} similar incidents in {elapsed_time:.2f} seconds")
-                status_text.text(f"✅ Found {len(similar_texts)} similar incidents")
-                
-                progress_bar.progress(100)
-                
-                # Clean up progress indicators
-                progress_bar.empty()
-                status_text.empty()
-                
-            except Exception as e:
-                logger.error(f"Error finding similar incidents: {e}", exc_info=True)
-                st.error(f"❌ Error finding similar incidents: {str(e)}")
-                st.info("💡 The system will attempt to continue with fallback embeddings...")
-                similar_texts = []
-
-            # Step 2: Generate LLM response
-            try:
-                with st.spinner("🤖 Generating insights with LLM..."):
-                    start_time = time.time()
-                    response = llm_processor.get_llm_response(user_input, similar_texts)
-                    elapsed_time = time.time() - start_time
-                    
-                logger.info(f"LLM response generated in {elapsed_time:.2f} seconds")
-                
-            except Exception as e:
-                logger.error(f"Error generating LLM response: {e}", exc_info=True)
-                st.error(f"❌ Error generating LLM response: {str(e)}")
-                st.stop()
-
-            # Store in session state for judge evaluation
-            st.session_state["llm_response"] = response
-            st.session_state["user_input"] = user_input
-            
-            # Display the formatted markdown response
-            st.markdown(response)
-
-            # Show number of similar incidents found
-            if similar_texts:
-                st.info(f"ℹ️ Analysis based on {len(similar_texts)} similar incidents")
-            else:
-                st.warning("⚠️ No similar incidents found - analysis based on general knowledge")
-
+            job_queue = registry.get("job_queue")
+            st.session_state["job_id"] = job_queue.submit(user_input, run_judge=run_judge_eval)
+        except QueueFullError as e:
+            st.warning(f"⏳ The system is busy analysing other incidents. Please retry in a moment. ({e})")
         except Exception as e:
             st.error(f"❌ Analysis failed: {str(e)}")
             logger.error(f"Analysis error: {e}", exc_info=True)
     else:
         st.warning("⚠️ Please enter an incident log to analyze.")
 
+# Seconds between progress polls, and how long past the job's deadline to keep waiting for its outcome
+JOB_POLL_INTERVAL_SECONDS = 0.5
+JOB_POLL_GRACE_SECONDS = 5.0
+
+
+def _job_in_flight(job) -> bool:
+    return (job is not None and job["status"] in (JobStatus.PENDING, JobStatus.RUNNING)
+            and job["deadline_in_s"] > -JOB_POLL_GRACE_SECONDS)
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL_SECONDS)
+def show_job_progress():
+    """Show the job's progress; only this fragment re-runs on the timer, and the whole app once the job is over."""
+    job = registry.get("job_queue").get(st.session_state["job_id"])
+    if not _job_in_flight(job):
+        st.rerun()
+    st.progress(job["progress"])
+    st.text(STAGE_LABELS.get(job["stage"], job["stage"]))
+
+
+# Poll the submitted job; the analysis itself runs on the worker pool, not in this script run
+if st.session_state.get("job_id") and "llm_response" not in st.session_state:
+    job_queue = registry.get("job_queue")
+    job = job_queue.get(st.session_state["job_id"])
+
+    if _job_in_flight(job):
+        show_job_progress()
+    elif job is None:
+        st.error("❌ Analysis result expired. Please run the analysis again.")
+        del st.session_state["job_id"]
+    elif job["status"] in (JobStatus.PENDING, JobStatus.RUNNING):
+        st.error("❌ Analysis did not finish within its time budget. Please run the analysis again.")
+        del st.session_state["job_id"]
+    elif job["status"] == JobStatus.REJECTED:
+        st.warning(f"⏳ The system is busy analysing other incidents. Please retry in a moment. ({job['error']})")
+        del st.session_state["job_id"]
+    elif job["status"] == JobStatus.FAILED:
+        st.error(f"❌ Error generating LLM response: {job['error']}")
+        del st.session_state["job_id"]
+    else:
+        result = job["result"]
+        if "retrieval" in result["skipped"]:
+            st.info("💡 Similar-incident search was skipped to stay within the time budget.")
+        if "judge" in result["skipped"]:
+            st.info("💡 Quality evaluation was skipped to stay within the time budget.")
+        if result["retrieval_error"]:
+            st.error(f"❌ Error finding similar incidents: {result['retrieval_error']}")
+            st.info("💡 The analysis continued without similar incidents.")
+
+        # Store in session state for judge evaluation
+        st.session_state["llm_response"] = result["response"]
+        st.session_state["user_input"] = user_input
+        st.session_state["similar_count"] = len(result["similar_texts"])
+        if result["judge"]:
+            st.session_state["judge_response"] = result["judge"]
+        if result["judge_error"]:
+            st.session_state["judge_error"] = result["judge_error"]
+        st.session_state["judge_skipped"] = "judge" in result["skipped"]
+
+if st.session_state.get("llm_response"):
+    # Display the formatted markdown response
+    st.markdown(st.session_state["llm_response"])
+
+    # Show number of similar incidents found
+    if st.session_state.get("similar_count"):
+        st.info(f"ℹ️ Analysis based on {st.session_state['similar_count']} similar incidents")
+    else:
+        st.warning("⚠️ No similar incidents found - analysis based on general knowledge")
+
 # ---------- Judge Evaluation ----------
-if st.session_state.get("llm_response") and run_judge_eval:
+if st.session_state.get("llm_response") and run_judge_eval and not st.session_state.get("judge_skipped"):
     try:
-        with st.spinner("📊 Evaluating response quality..."):
-            start_time = time.time()
-            judge_response = b.EvaluateResponse(
-                prompt=st.session_state["user_input"],
-                response=st.session_state["llm_response"]
-            )
-            elapsed_time = time.time() - start_time
-            
-        logger.info(f"Judge evaluation completed in {elapsed_time:.2f} seconds")
-        
+        if st.session_state.get("judge_error"):
+            raise RuntimeError(st.session_state["judge_error"])
+        judge_response = st.session_state.get("judge_response")
+        if judge_response is None:
+            from baml_client import b
+            with st.spinner("📊 Evaluating response quality..."):
+                start_time = time.time()
+                with track_stage("judge"):
+                    evaluation = b.EvaluateResponse(
+                        prompt=st.session_state["user_input"],
+                        response=st.session_state["llm_response"]
+                    )
+                elapsed_time = time.time() - start_time
+            logger.info(f"Judge evaluation completed in {elapsed_time:.2f} seconds")
+            judge_response = {"score": evaluation.score, "justification": evaluation.justification}
+            st.session_state["judge_response"] = judge_response
+
         st.subheader("📊 Quality Evaluation")
 
         # Simplified score display
-        st.markdown(f"#### Score: **{judge_response.score}/5**")
+        st.markdown(f"#### Score: **{judge_response['score']}/5**")
         
         # Display justification
-        st.markdown(f"#### Justification:\n\n{judge_response.justification}")
+        st.markdown(f"#### Justification:\n\n{judge_response['justification']}")
         
     except Exception as e:
         st.error(f"❌ Evaluation failed: {str(e)}")
-        logger.error(f"Judge evaluation error: {e}", exc_info=True)
-
+        logger.error(f"Judge evaluation error: {e}", exc_info=True)
\ No newline at end of file
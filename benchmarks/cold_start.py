@@ -0,0 +1,127 @@
+"""
+Cold-start benchmark: how long a fresh process takes to import the app modules
+and build its components, checked against COLD_START_BUDGET_MS.
+
+Each run spawns a new interpreter with `-X importtime`, so module caches from
+this process do not hide import costs. The child imports what app.py imports,
+then builds the embedding model (probe off) and the LLM processor through the
+registry. The Atlas client is left out: its cost is a network round trip, not
+process start-up.
+
+Usage:
+    python -m benchmarks.cold_start                 # report the median of 3 cold starts
+    python -m benchmarks.cold_start --check         # fail if the median exceeds the budget
+    python -m benchmarks.cold_start --top 20        # show the 20 slowest imports
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMPONENTS = ("embedding_model", "llm_processor")
+
+CHILD_SCRIPT = f"""
+import json, time
+start_time = time.perf_counter()
+from utils.startup import timeline
+with timeline.phase("imports"):
+    import streamlit
+    from processors.job_queue import JobStatus, QueueFullError
+    from utils.health_server import start_health_server
+    from utils.metrics import track_stage
+    from utils.registry import registry, register_default_components
+    from dotenv import load_dotenv
+register_default_components()
+for name in {COMPONENTS!r}:
+    with timeline.phase("init:" + name):
+        registry.get(name)
+report = timeline.report()
+report["total_ms"] = round((time.perf_counter() - start_time) * 1000, 1)
+print("COLD_START_REPORT " + json.dumps(report))
+"""
+
+
+def parse_importtime(stderr: str) -> dict[str, float]:
+    """
+    Cumulative milliseconds per top-level import from `-X importtime` output.
+
+    Lines look like "import time:  self [us] | cumulative | imported package";
+    nested imports are indented, so only unindented package names are kept.
+    """
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, _, fields = line.partition(":")
+        self_us, cumulative_us, package = fields.split("|", 2)
+        if package.startswith("  "):
+            continue
+        imports[package.strip()] = imports.get(package.strip(), 0.0) + int(cumulative_us) / 1000
+    return imports
+
+
+def measure_cold_start() -> dict:
+    """Run one cold start in a fresh interpreter and return its timeline plus per-import timings."""
+    env = dict(os.environ)
+    env.setdefault("HUGGINGFACE_API_TOKEN", "cold-start-token")
+    env["EMBEDDING_PROBE_MODE"] = "off"
+    env.setdefault("BAML_LOG", "warn")
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD_SCRIPT],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=False,
+    )
+    report_line = next((line for line in completed.stdout.splitlines() if line.startswith("COLD_START_REPORT ")), None)
+    if completed.returncode != 0 or report_line is None:
+        raise RuntimeError(f"Cold start child failed (exit {completed.returncode}):\n{completed.stderr[-2000:]}")
+    report = json.loads(report_line.split(" ", 1)[1])
+    report["imports"] = parse_importtime(completed.stderr)
+    return report
+
+
+def format_report(runs: list[dict], budget_ms: float, top: int) -> str:
+    totals = [run["total_ms"] for run in runs]
+    median_run = sorted(runs, key=lambda run: run["total_ms"])[len(runs) // 2]
+    lines = [
+        f"Cold start over {len(runs)} runs: median {statistics.median(totals):.0f} ms "
+        f"(min {min(totals):.0f}, max {max(totals):.0f}), budget {budget_ms:.0f} ms",
+        "",
+        "Phases (median run):",
+    ]
+    for phase in median_run["phases"]:
+        lines.append(f"  {phase['duration_ms']:>8.1f} ms  {phase['phase']}")
+    lines.append("")
+    lines.append("Slowest top-level imports (median run, cumulative):")
+    for package, import_ms in sorted(median_run["imports"].items(), key=lambda item: -item[1])[:top]:
+        lines.append(f"  {import_ms:>8.1f} ms  {package}")
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    from utils.config import COLD_START_BUDGET_MS
+
+    parser = argparse.ArgumentParser(description="Measure process cold start against a budget.")
+    parser.add_argument("--runs", type=int, default=3, help="Cold starts to measure (the median is checked)")
+    parser.add_argument("--budget-ms", type=float, default=COLD_START_BUDGET_MS, help="Cold-start budget in milliseconds")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest imports to list")
+    parser.add_argument("--check", action="store_true", help="Exit non-zero if the median exceeds the budget")
+    parser.add_argument("--json", help="Also write the raw runs as JSON to this path")
+    args = parser.parse_args(argv)
+
+    runs = [measure_cold_start() for _ in range(args.runs)]
+    print(format_report(runs, args.budget_ms, args.top))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(runs, f, indent=2)
+
+    median_ms = statistics.median(run["total_ms"] for run in runs)
+    if args.check and median_ms > args.budget_ms:
+        print(f"\nCold start {median_ms:.0f} ms exceeds the {args.budget_ms:.0f} ms budget")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
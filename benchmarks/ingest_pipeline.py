@@ -0,0 +1,66 @@
+"""
+Ingestion pipeline benchmark: sequential stages vs the concurrent StagePipeline.
+
+Stage latencies are simulated with sleeps (fetch a GitLab page, embed a batch,
+write it to Atlas, chunk and embed it), so the result shows how much of the
+run the pipeline overlaps, not how fast the real services are. Sequentially a
+run takes the sum of the stages; pipelined it should approach the slowest
+stage divided by its workers.
+
+Usage:
+    python -m benchmarks.ingest_pipeline
+    python -m benchmarks.ingest_pipeline --batches 40 --embed-ms 400 --embed-workers 4
+"""
+import argparse
+import json
+import sys
+import time
+from utils.config import INGEST_CHUNK_WORKERS, INGEST_EMBED_WORKERS, INGEST_WRITE_WORKERS
+from utils.stage_pipeline import Stage, StagePipeline
+
+
+def _sleeper(milliseconds: float):
+    def _stage(item):
+        time.sleep(milliseconds / 1000)
+        return item
+    return _stage
+
+
+def run_sequential(batches: int, latencies_ms: dict) -> float:
+    start_time = time.perf_counter()
+    for batch in range(batches):
+        for milliseconds in latencies_ms.values():
+            _sleeper(milliseconds)(batch)
+    return time.perf_counter() - start_time
+
+
+def run_pipelined(batches: int, latencies_ms: dict, workers: dict) -> dict:
+    stages = [Stage(name, _sleeper(milliseconds), workers=workers.get(name, 1))
+              for name, milliseconds in latencies_ms.items()]
+    return StagePipeline("bench_ingest", stages).run(range(batches))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare sequential and pipelined ingestion with simulated stage latencies.")
+    parser.add_argument("--batches", type=int, default=20)
+    parser.add_argument("--fetch-ms", type=float, default=150, help="One GitLab page (one batch of incidents)")
+    parser.add_argument("--embed-ms", type=float, default=300, help="Embedding one batch")
+    parser.add_argument("--write-ms", type=float, default=80, help="bulk_write of one batch")
+    parser.add_argument("--chunks-ms", type=float, default=200, help="Chunking and embedding one batch's chunks")
+    parser.add_argument("--embed-workers", type=int, default=INGEST_EMBED_WORKERS)
+    parser.add_argument("--write-workers", type=int, default=INGEST_WRITE_WORKERS)
+    parser.add_argument("--chunk-workers", type=int, default=INGEST_CHUNK_WORKERS)
+    args = parser.parse_args(argv)
+
+    latencies_ms = {"fetch": args.fetch_ms, "embed": args.embed_ms, "write": args.write_ms, "chunks": args.chunks_ms}
+    workers = {"embed": args.embed_workers, "write": args.write_workers, "chunks": args.chunk_workers}
+    sequential_s = run_sequential(args.batches, latencies_ms)
+    pipelined = run_pipelined(args.batches, latencies_ms, workers)
+    print(f"sequential {sequential_s:.2f}s, pipelined {pipelined['wall_time_s']:.2f}s "
+          f"({sequential_s / pipelined['wall_time_s']:.1f}x)")
+    print(json.dumps(pipelined["stages"], indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
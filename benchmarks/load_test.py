@@ -0,0 +1,311 @@
+"""
+End-to-end load test for the analysis pipeline against local stub services.
+
+Replays incident logs through UserQueryProcessor, LLMProcessor and the judge
+at a configurable concurrency and arrival rate, then reports throughput and
+p50/p95/p99 latency per stage.
+
+Usage:
+    python -m benchmarks.load_test --requests 200 --concurrency 16 --rate 20
+    python -m benchmarks.load_test --source test_cases.md --llm-latency-ms 1500 --llm-error-rate 0.05
+    python -m benchmarks.load_test --source incidents.jsonl --json report.json
+    python -m benchmarks.load_test --async --concurrency 200 --rate 50   # AsyncAnalysisPipeline on one event loop
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from benchmarks.stubs import (
+    AsyncStubVectorCollection, FaultProfile, StubServer, StubVectorCollection, synthetic_corpus, synthetic_incident,
+)
+
+PERCENTILES = (50, 95, 99)
+
+
+def load_logs(source: str, count: int, seed: int = 0) -> list[str]:
+    """
+    Load incident logs to replay.
+
+    :param source: "synthetic", a markdown file with fenced log blocks (e.g. test_cases.md),
+                   or a JSONL file whose lines carry a "log", "query", "body" or "text" field.
+    :param count: Number of logs to return; sources are cycled when shorter.
+    """
+    if source == "synthetic":
+        rng = random.Random(seed)
+        return [synthetic_incident(rng) for _ in range(count)]
+
+    with open(source, encoding="utf-8") as f:
+        content = f.read()
+
+    if source.endswith(".jsonl"):
+        logs = []
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            text = next((record[key] for key in ("log", "query", "body", "text") if record.get(key)), None)
+            if text:
+                logs.append(text)
+    else:
+        logs = [block.strip() for block in re.findall(r"```\n(.*?)```", content, flags=re.DOTALL)]
+
+    if not logs:
+        raise ValueError(f"No incident logs found in {source}")
+    return [logs[index % len(logs)] for index in range(count)]
+
+
+class StageRecorder:
+    """Collects raw per-stage latency samples from utils.metrics.track_stage."""
+
+    def __init__(self):
+        self.samples: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, stage: str, seconds: float, failed: bool) -> None:
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+            if failed:
+                self.errors[stage] = self.errors.get(stage, 0) + 1
+
+    def record(self, stage: str, seconds: float, failed: bool = False) -> None:
+        self(stage, seconds, failed)
+
+
+def summarize(samples: list[float]) -> dict:
+    values = np.asarray(samples) * 1000
+    summary = {"count": len(samples), "mean_ms": float(values.mean())}
+    for percentile in PERCENTILES:
+        summary[f"p{percentile}_ms"] = float(np.percentile(values, percentile))
+    return summary
+
+
+def build_pipeline(server: StubServer, collection: StubVectorCollection, use_async: bool = False):
+    """
+    Wire the real pipeline classes to the stub services.
+
+    :param use_async: Build an AsyncAnalysisPipeline (collection must then be an AsyncStubVectorCollection).
+    """
+    os.environ["HF_INFERENCE_BASE_URL"] = f"{server.url}/models"
+    os.environ.setdefault("HUGGINGFACE_API_TOKEN", "stub-token")
+
+    from baml_py import ClientRegistry
+    from baml_client import b
+    from baml_client.async_client import b as async_b
+    from processors.analysis_pipeline import AnalysisPipeline, AsyncAnalysisPipeline
+    from processors.embeddings import EmbeddingModel
+    from processors.llm_processor import LLMProcessor
+
+    client_registry = ClientRegistry()
+    client_registry.add_llm_client(
+        name="LoadTestStub",
+        provider="openai-generic",
+        options={"base_url": f"{server.url}/v1", "model": "stub", "api_key": "stub"},
+    )
+    client_registry.set_primary("LoadTestStub")
+    stub_client = b.with_options(client_registry=client_registry)
+
+    embedding_model = EmbeddingModel(probe="off")
+    embedding_model.api_url = f"{server.url}/models/{embedding_model.model_id}"
+    if use_async:
+        stub_async_client = async_b.with_options(client_registry=client_registry)
+        return AsyncAnalysisPipeline(
+            embedding_model=embedding_model,
+            llm_processor=LLMProcessor(baml_client=stub_client, baml_async_client=stub_async_client),
+            collection=collection,
+            judge_client=stub_async_client,
+        )
+    return AnalysisPipeline(
+        embedding_model=embedding_model,
+        llm_processor=LLMProcessor(baml_client=stub_client),
+        collection=collection,
+        judge_client=stub_client,
+    )
+
+
+def run_load_test(pipeline, logs: list[str], concurrency: int, rate: float, run_judge: bool = True, seed: int = 0) -> dict:
+    """
+    Replay logs through the pipeline.
+
+    :param concurrency: Worker threads processing requests.
+    :param rate: Mean arrival rate (requests/s, Poisson arrivals); 0 submits everything at once (closed loop).
+    """
+    from utils.admission import BusyError
+    from utils.metrics import add_stage_listener, remove_stage_listener
+
+    recorder = StageRecorder()
+    add_stage_listener(recorder)
+    rng = random.Random(seed)
+    failures = 0
+    shed = 0
+    failures_lock = threading.Lock()
+
+    def _run_one(log: str, arrived_at: float):
+        nonlocal failures, shed
+        recorder.record("queue_wait", time.perf_counter() - arrived_at)
+        try:
+            pipeline.run(log, run_judge=run_judge)
+            recorder.record("end_to_end", time.perf_counter() - arrived_at)
+        except BusyError:
+            recorder.record("end_to_end", time.perf_counter() - arrived_at, failed=True)
+            with failures_lock:
+                failures += 1
+                shed += 1
+        except Exception:
+            recorder.record("end_to_end", time.perf_counter() - arrived_at, failed=True)
+            with failures_lock:
+                failures += 1
+
+    start_time = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="load-test") as executor:
+            for log in logs:
+                if rate > 0:
+                    time.sleep(rng.expovariate(rate))
+                executor.submit(_run_one, log, time.perf_counter())
+    finally:
+        remove_stage_listener(recorder)
+    wall_time = time.perf_counter() - start_time
+    return _build_report(recorder, len(logs), failures, shed, concurrency, rate, wall_time)
+
+
+def run_async_load_test(pipeline, logs: list[str], concurrency: int, rate: float, run_judge: bool = True, seed: int = 0) -> dict:
+    """
+    run_load_test() for an AsyncAnalysisPipeline: one event loop, at most `concurrency` analyses in flight.
+    """
+    from utils.admission import BusyError
+    from utils.metrics import add_stage_listener, remove_stage_listener
+
+    recorder = StageRecorder()
+    rng = random.Random(seed)
+    failures = 0
+    shed = 0
+
+    async def _run_one(log: str, arrived_at: float, semaphore: asyncio.Semaphore):
+        nonlocal failures, shed
+        async with semaphore:
+            recorder.record("queue_wait", time.perf_counter() - arrived_at)
+            try:
+                await pipeline.run(log, run_judge=run_judge)
+                recorder.record("end_to_end", time.perf_counter() - arrived_at)
+            except BusyError:
+                recorder.record("end_to_end", time.perf_counter() - arrived_at, failed=True)
+                failures += 1
+                shed += 1
+            except Exception:
+                recorder.record("end_to_end", time.perf_counter() - arrived_at, failed=True)
+                failures += 1
+
+    async def _run_all():
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = []
+        for log in logs:
+            if rate > 0:
+                await asyncio.sleep(rng.expovariate(rate))
+            tasks.append(asyncio.create_task(_run_one(log, time.perf_counter(), semaphore)))
+        await asyncio.gather(*tasks)
+        await pipeline.aclose()
+
+    add_stage_listener(recorder)
+    start_time = time.perf_counter()
+    try:
+        asyncio.run(_run_all())
+    finally:
+        remove_stage_listener(recorder)
+    wall_time = time.perf_counter() - start_time
+    return _build_report(recorder, len(logs), failures, shed, concurrency, rate, wall_time)
+
+
+def _build_report(recorder: StageRecorder, requests: int, failures: int, shed: int, concurrency: int,
+                  rate: float, wall_time: float) -> dict:
+    return {
+        "requests": requests,
+        "failed": failures,
+        "shed": shed,
+        "concurrency": concurrency,
+        "arrival_rate": rate,
+        "wall_time_s": wall_time,
+        "throughput_rps": (requests - failures) / wall_time if wall_time > 0 else 0.0,
+        "stages": {stage: {**summarize(samples), "errors": recorder.errors.get(stage, 0)}
+                   for stage, samples in sorted(recorder.samples.items())},
+    }
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"Requests: {report['requests']} ({report['failed']} failed, {report['shed']} shed as busy), concurrency {report['concurrency']}, "
+        f"arrival rate {report['arrival_rate'] or 'closed loop'}",
+        f"Wall time: {report['wall_time_s']:.2f}s, throughput: {report['throughput_rps']:.2f} req/s",
+        "",
+        f"{'stage':<14}{'count':>8}{'errors':>8}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}  (ms)",
+    ]
+    for stage, summary in report["stages"].items():
+        lines.append(
+            f"{stage:<14}{summary['count']:>8}{summary['errors']:>8}{summary['mean_ms']:>10.1f}"
+            f"{summary['p50_ms']:>10.1f}{summary['p95_ms']:>10.1f}{summary['p99_ms']:>10.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the analysis pipeline against local stub services.")
+    parser.add_argument("--source", default="synthetic", help="synthetic, a markdown file of fenced logs, or a JSONL file")
+    parser.add_argument("--requests", type=int, default=100, help="Number of analyses to run")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent pipeline workers")
+    parser.add_argument("--rate", type=float, default=0.0, help="Poisson arrival rate in req/s (0 = closed loop)")
+    parser.add_argument("--corpus-size", type=int, default=1000, help="Incidents in the stub vector collection")
+    parser.add_argument("--no-judge", action="store_true", help="Skip the judge stage")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Run AsyncAnalysisPipeline on one event loop instead of a thread pool")
+    parser.add_argument("--seed", type=int, default=0)
+    for service, latency in (("embed", 80.0), ("atlas", 30.0), ("llm", 1500.0)):
+        parser.add_argument(f"--{service}-latency-ms", type=float, default=latency, help=f"Median {service} latency")
+        parser.add_argument(f"--{service}-jitter", type=float, default=0.3, help=f"Log-normal sigma of {service} latency")
+        parser.add_argument(f"--{service}-error-rate", type=float, default=0.0, help=f"Fraction of failing {service} calls")
+    parser.add_argument("--json", help="Also write the report as JSON to this path")
+    parser.add_argument("--verbose", action="store_true", help="Keep pipeline logging and prints")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    if not args.verbose:
+        os.environ.setdefault("BAML_LOG", "warn")
+
+    server = StubServer(
+        embedding_profile=FaultProfile(args.embed_latency_ms, args.embed_jitter, args.embed_error_rate),
+        llm_profile=FaultProfile(args.llm_latency_ms, args.llm_jitter, args.llm_error_rate, error_status=429),
+    ).start()
+    collection_class = AsyncStubVectorCollection if args.use_async else StubVectorCollection
+    collection = collection_class(
+        synthetic_corpus(args.corpus_size, seed=args.seed),
+        FaultProfile(args.atlas_latency_ms, args.atlas_jitter, args.atlas_error_rate),
+    )
+
+    try:
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with quiet:
+            pipeline = build_pipeline(server, collection, use_async=args.use_async)
+            logs = load_logs(args.source, args.requests, seed=args.seed)
+            run = run_async_load_test if args.use_async else run_load_test
+            report = run(pipeline, logs, args.concurrency, args.rate, run_judge=not args.no_judge, seed=args.seed)
+    finally:
+        server.stop()
+
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
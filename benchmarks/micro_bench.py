@@ -0,0 +1,326 @@
+"""
+Micro-benchmarks for the CPU hot paths of the pipeline, with stored baselines.
+
+Cases (each at several input sizes):
+- fallback_embeddings: EmbeddingModel._get_fallback_embeddings
+- prepare_data: EmbeddingModel.prepare_data
+- attach_embeddings: the doc['embedding'] = embeddings[index].tolist() loop in add_embeddings_to_documents
+- format_llm_response: the regex chain in LLMProcessor.format_llm_response (1 KB to 1 MB)
+- process_query_assembly: result assembly in UserQueryProcessor.process_query
+- mmr_select: MMR diversification over the over-fetched candidates
+- minhash_dedup: MinHash signatures + LSH grouping at ingestion
+- log_compression: Drain template mining + rendering of a pasted log (1k / 10k lines)
+
+Usage:
+    python -m benchmarks.micro_bench                    # run the quick sizes and print results
+    python -m benchmarks.micro_bench --full             # include the 100k-document sizes
+    python -m benchmarks.micro_bench --check            # fail if any case regressed past the threshold
+    python -m benchmarks.micro_bench --update-baselines # record the current timings as the new baselines
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Callable
+import numpy as np
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), "baselines.json")
+DEFAULT_THRESHOLD = 0.25
+EMBEDDING_DIM = 384
+
+WORDS = (
+    "pipeline deploy failed error timeout database connection pool exhausted redis cache latency apdex "
+    "gitaly sidekiq registry certificate expired token rotation disk space oom killed pod restart alert "
+    "canary rollback incident production gprd gstg queue saturation cpu memory network packet loss"
+).split()
+
+
+def synthetic_documents(count: int, description_bytes: int = 2048, seed: int = 0) -> list[dict]:
+    """Incident documents with GitLab-sized descriptions."""
+    rng = random.Random(seed)
+    documents = []
+    for index in range(count):
+        words = []
+        size = 0
+        while size < description_bytes:
+            word = rng.choice(WORDS)
+            words.append(word)
+            size += len(word) + 1
+        documents.append({"id": index, "title": " ".join(rng.sample(WORDS, 6)), "description": " ".join(words)})
+    return documents
+
+
+def synthetic_llm_response(size_bytes: int, seed: int = 0) -> str:
+    """A raw <root_cause_summary>/<troubleshooting_steps> response of roughly size_bytes."""
+    rng = random.Random(seed)
+    steps = []
+    size = 0
+    while size < size_bytes:
+        step = f"{len(steps) + 1}. " + " ".join(rng.choice(WORDS) for _ in range(12))
+        steps.append(step)
+        size += len(step) + 1
+    summary = " ".join(rng.choice(WORDS) for _ in range(60))
+    steps_str = "\n".join(steps)
+    return f"<response><root_cause_summary>\n{summary}\n</root_cause_summary>\n\n<troubleshooting_steps>\n{steps_str}\n</troubleshooting_steps></response>"
+
+
+def synthetic_log(lines: int, seed: int = 0) -> str:
+    """A noisy service log: a few templates repeated with varying timestamps, ids and counters."""
+    rng = random.Random(seed)
+    output = []
+    for index in range(lines):
+        timestamp = f"2024-05-01T10:{index // 3600 % 60:02d}:{index % 60:02d}.{index % 1000:03d}Z"
+        roll = rng.random()
+        if roll < 0.6:
+            output.append(f"{timestamp} INFO worker-{rng.randint(1, 40)} heartbeat ok latency={rng.randint(1, 90)}ms")
+        elif roll < 0.9:
+            output.append(f"{timestamp} DEBUG request {rng.getrandbits(64):016x} GET /api/v4/projects/{rng.randint(1, 99999)} "
+                          f"200 in {rng.random():.3f}s from 10.0.{rng.randint(0, 9)}.{rng.randint(1, 254)}")
+        elif roll < 0.99:
+            output.append(f"{timestamp} WARN pool db-primary connections={rng.randint(80, 100)}/100 near limit")
+        else:
+            output.append(f"{timestamp} ERROR {rng.choice(WORDS)} connection refused after {rng.randint(3, 5)} retries")
+    return "\n".join(output)
+
+
+class _FixedEmbeddings:
+    """Stands in for the HF API so only the local code under test is timed."""
+
+    def __init__(self, embeddings: np.ndarray):
+        self.embeddings = embeddings
+
+    def __call__(self, combined_content: list[str], **kwargs) -> np.ndarray:
+        return self.embeddings[:len(combined_content)]
+
+
+class _FixedCollection:
+    def __init__(self, results: list[dict]):
+        self.results = results
+
+    def aggregate(self, pipeline, **kwargs):
+        return iter(self.results)
+
+
+def _offline_embedding_model():
+    """An EmbeddingModel that never calls HuggingFace (probe off, API URL unreachable)."""
+    os.environ.setdefault("HUGGINGFACE_API_TOKEN", "bench-token")
+    os.environ["HF_INFERENCE_BASE_URL"] = "http://127.0.0.1:9"
+    from processors.embeddings import EmbeddingModel
+    return EmbeddingModel(probe="off")
+
+
+def build_cases(full: bool) -> dict[str, Callable[[], Callable[[], object]]]:
+    """
+    Map case name -> setup function. Setup builds the inputs (untimed) and
+    returns the zero-argument callable that is timed.
+    """
+    model = _offline_embedding_model()
+    query_model = _offline_embedding_model()
+    query_model.get_embeddings = _FixedEmbeddings(np.random.default_rng(0).random((1, EMBEDDING_DIM)))
+
+    from processors.llm_processor import LLMProcessor
+    from processors.user_query_processor import UserQueryProcessor
+
+    doc_sizes = [1, 1_000] + ([100_000] if full else [])
+    # The fallback embedder is super-linear in corpus vocabulary; 100k docs is full-only and slow
+    fallback_sizes = [1, 1_000] + ([10_000, 100_000] if full else [])
+    log_sizes = [("1kb", 1_024), ("100kb", 100 * 1_024), ("1mb", 1_024 * 1_024)]
+
+    llm_processor = LLMProcessor()
+    cases = {}
+
+    for size in fallback_sizes:
+        def _setup(size=size):
+            texts = model.prepare_data(synthetic_documents(size))
+            return lambda: model._get_fallback_embeddings(texts)
+        cases[f"fallback_embeddings[{size}]"] = _setup
+
+    for size in doc_sizes:
+        def _setup(size=size):
+            documents = synthetic_documents(size)
+            return lambda: model.prepare_data(documents)
+        cases[f"prepare_data[{size}]"] = _setup
+
+    for size in doc_sizes:
+        def _setup(size=size):
+            documents = synthetic_documents(size, description_bytes=256)
+            model.get_embeddings = _FixedEmbeddings(np.random.default_rng(0).random((size, EMBEDDING_DIM)))
+            # As if served by the API, so the content hashes are computed and stored as in production
+            model._path.value = "api"
+            return lambda: model.add_embeddings_to_documents(documents)
+        cases[f"attach_embeddings[{size}]"] = _setup
+
+    for label, size_bytes in log_sizes:
+        def _setup(size_bytes=size_bytes):
+            raw_response = synthetic_llm_response(size_bytes)
+            return lambda: llm_processor.format_llm_response(raw_response)
+        cases[f"format_llm_response[{label}]"] = _setup
+
+    for size in doc_sizes:
+        def _setup(size=size):
+            documents = synthetic_documents(size)
+            results = [{"id": doc["id"], "title": doc["title"], "description": doc["description"], "score": 0.9}
+                       for doc in documents]
+            processor = UserQueryProcessor(user_query="pipeline failed", embedding_model=query_model)
+            collection = _FixedCollection(results)
+            return lambda: processor.process_query(collection)
+        cases[f"process_query_assembly[{size}]"] = _setup
+
+    for size in doc_sizes:
+        def _setup(size=size):
+            from processors.dedup import find_duplicate_groups
+            documents = synthetic_documents(size, description_bytes=512)
+            return lambda: find_duplicate_groups(documents)
+        cases[f"minhash_dedup[{size}]"] = _setup
+
+    for size in (20, 100):
+        def _setup(size=size):
+            from processors.diversification import mmr_select
+            rng = np.random.default_rng(0)
+            query = rng.random(EMBEDDING_DIM)
+            candidates = rng.random((size, EMBEDDING_DIM))
+            return lambda: mmr_select(query, candidates, k=5)
+        cases[f"mmr_select[{size}]"] = _setup
+
+    for size in (1_000, 10_000):
+        def _setup(size=size):
+            from processors.log_compression import compress_log
+            log = synthetic_log(size)
+            return lambda: compress_log(log)
+        cases[f"log_compression[{size}]"] = _setup
+
+    return cases
+
+
+def time_case(func: Callable[[], object], min_repeats: int = 5, max_repeats: int = 50, budget_s: float = 2.0,
+              min_sample_s: float = 0.005) -> dict:
+    """
+    Run func repeatedly within a time budget and summarize the per-call timings.
+
+    Fast cases are looped `number` times per sample (like timeit.autorange) so
+    each sample lasts at least min_sample_s and timer noise stays negligible.
+    """
+    number = 1
+    while True:
+        call_start = time.perf_counter()
+        for _ in range(number):
+            func()
+        if time.perf_counter() - call_start >= min_sample_s or number >= 1_000_000:
+            break
+        number *= 2
+
+    timings = []
+    start_time = time.perf_counter()
+    while len(timings) < max_repeats:
+        call_start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - call_start) / number)
+        if len(timings) >= min_repeats and time.perf_counter() - start_time > budget_s:
+            break
+    return {"median_s": statistics.median(timings), "min_s": min(timings), "repeats": len(timings), "number": number}
+
+
+def run_benchmarks(full: bool = False, pattern: str = None, budget_s: float = 2.0) -> tuple[dict, dict]:
+    """
+    Time every selected case.
+
+    :return: (results, errors): case name -> timing summary, and case name -> the exception of each case
+             whose setup or call raised; an erroring case is reported, never timed.
+    """
+    results, errors = {}, {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        cases = build_cases(full)
+    for name, setup in cases.items():
+        if pattern and pattern not in name:
+            continue
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                func = setup()
+                results[name] = time_case(func, budget_s=budget_s)
+        except Exception as e:
+            errors[name] = e
+            print(f"{name:<36} ERROR {type(e).__name__}: {e}", flush=True)
+            continue
+        print(f"{name:<36} median {results[name]['median_s'] * 1000:>10.3f} ms  "
+              f"min {results[name]['min_s'] * 1000:>10.3f} ms  ({results[name]['repeats']} runs)", flush=True)
+    return results, errors
+
+
+def load_baselines(path: str = BASELINES_PATH) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def check_regressions(results: dict, baselines: dict, threshold: float) -> list[str]:
+    """
+    Return a message for every case whose best time exceeds its baseline by more than threshold.
+
+    The minimum is compared rather than the median: it is the least sensitive
+    to scheduler noise on a shared machine.
+    """
+    regressions = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            continue
+        limit = baseline["min_s"] * (1 + threshold)
+        if result["min_s"] > limit:
+            regressions.append(
+                f"{name}: {result['min_s'] * 1000:.3f} ms > baseline {baseline['min_s'] * 1000:.3f} ms "
+                f"(+{(result['min_s'] / baseline['min_s'] - 1) * 100:.0f}%, threshold {threshold * 100:.0f}%)"
+            )
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the pipeline's CPU hot paths.")
+    parser.add_argument("--full", action="store_true", help="Include the 100k-document sizes")
+    parser.add_argument("-k", dest="pattern", help="Only run cases whose name contains this substring")
+    parser.add_argument("--budget", type=float, default=2.0, help="Time budget per case in seconds")
+    parser.add_argument("--check", action="store_true", help="Exit non-zero if a case regressed past the threshold")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Allowed slowdown vs baseline (0.25 = 25%%)")
+    parser.add_argument("--update-baselines", action="store_true", help="Store the current results as baselines")
+    parser.add_argument("--baselines", default=BASELINES_PATH, help="Baselines JSON file")
+    args = parser.parse_args(argv)
+
+    # The offline embedding model logs its failed probe and fallback use on every call
+    logging.disable(logging.ERROR)
+    results, errors = run_benchmarks(full=args.full, pattern=args.pattern, budget_s=args.budget)
+    baselines = load_baselines(args.baselines)
+
+    if args.update_baselines:
+        baselines.update(results)
+        with open(args.baselines, "w", encoding="utf-8") as f:
+            json.dump(dict(sorted(baselines.items())), f, indent=2)
+            f.write("\n")
+        print(f"Baselines for {len(results)} cases written to {args.baselines}")
+
+    if errors:
+        # A case that raises measures nothing; fail whatever the mode, so a broken stub cannot pass --check
+        print(f"\n{len(errors)} case(s) failed:", file=sys.stderr)
+        for name, error in errors.items():
+            print(f"  {name}: {type(error).__name__}: {error}", file=sys.stderr)
+
+    if args.check:
+        regressions = check_regressions(results, baselines, args.threshold)
+        if regressions:
+            print("\nRegressions:")
+            for message in regressions:
+                print(f"  {message}")
+            return 1
+        if not errors:
+            print(f"\nNo regressions beyond {args.threshold * 100:.0f}% against {len(baselines)} baselines")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,132 @@
+"""
+Recall benchmark for compressed embeddings: memory per vector and recall@k of
+each LocalVectorIndex dtype, and of reduced-dimension (PCA or Matryoshka
+truncation) search, against exact float32 search. Use it to pick the
+LOCAL_INDEX_DTYPE / EMBEDDING_STORAGE_FORMAT and the projection dimension.
+
+Each projection is reported twice: searching the reduced vectors alone, and
+two-stage (reduced shortlist of TWO_STAGE_CANDIDATES reranked at full
+dimension), which is what EMBEDDING_PROJECTION_PATH enables.
+
+Runs on clustered synthetic vectors by default (mixed-sign, bge-small sized),
+or on real embeddings exported to a .npy file, e.g. from the collection with
+decode_embedding(). Queries are held-out rows perturbed with noise, so they
+resemble a new log that matches known incidents.
+
+Usage:
+    python -m benchmarks.recall                                  # 20k synthetic vectors
+    python -m benchmarks.recall --embeddings corpus.npy --queries 500
+    python -m benchmarks.recall --dims 32 64 128 --methods pca
+    python -m benchmarks.recall --json
+"""
+import argparse
+import json
+import sys
+import time
+import numpy as np
+from processors.local_index import INDEX_DTYPES, LocalVectorIndex
+from processors.projection import PROJECTION_METHODS, EmbeddingProjection
+
+RECALL_AT = (5, 10)
+DEFAULT_DIMS = (32, 64, 96, 128, 192)
+
+
+def synthetic_embeddings(count: int, dim: int = 384, clusters: int = 200, seed: int = 0) -> np.ndarray:
+    """
+    Gaussian clusters around random centres; incident corpora cluster by service and failure mode.
+
+    Variance decays across directions, like the spectrum of real sentence embeddings, so that
+    PCA has structure to find. The high-variance coordinates are spread out, as in a model
+    not trained for Matryoshka truncation, so prefix truncation has no such advantage.
+    """
+    rng = np.random.default_rng(seed)
+    spectrum = (1.0 / np.sqrt(1.0 + np.arange(dim) / 8.0)).astype(np.float32)
+    # Shuffled so the high-variance directions are not simply the leading coordinates
+    spectrum = spectrum[rng.permutation(dim)]
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32) * spectrum
+    assignments = rng.integers(0, clusters, size=count)
+    return centres[assignments] + 0.6 * rng.standard_normal((count, dim)).astype(np.float32) * spectrum
+
+
+def recall_at_k(exact: list[list[int]], approximate: list[list[int]], k: int) -> float:
+    """Mean fraction of the exact top-k that the approximate top-k also found."""
+    return float(np.mean([len(set(e[:k]) & set(a[:k])) / k for e, a in zip(exact, approximate)]))
+
+
+def measure_recall(embeddings: np.ndarray, num_queries: int = 200, dtypes=INDEX_DTYPES,
+                   dims=(), methods=PROJECTION_METHODS, rerank_dtype: str = "float32", seed: int = 1) -> dict:
+    """
+    Index the embeddings in each dtype and at each reduced dimension, and compare their
+    top-k ids with float32 search.
+
+    :param dims: Reduced dimensions to evaluate for each projection method.
+    :param rerank_dtype: dtype of the full-dimension vectors the two-stage index reranks with.
+    :return: {name: {"bytes_per_vector", "search_ms_per_query", "recall@5", "recall@10"}}, where name
+             is a dtype, "<method>-<dim>" (reduced vectors only) or "<method>-<dim>+rerank" (two-stage).
+    """
+    rng = np.random.default_rng(seed)
+    query_rows = rng.choice(len(embeddings), size=min(num_queries, len(embeddings)), replace=False)
+    queries = embeddings[query_rows] + 0.3 * rng.standard_normal((len(query_rows), embeddings.shape[1])).astype(np.float32)
+    documents = [{"id": str(position)} for position in range(len(embeddings))]
+    k = max(RECALL_AT)
+
+    def _top_ids(index: LocalVectorIndex, index_queries: np.ndarray) -> tuple[list[list[int]], float]:
+        start_time = time.perf_counter()
+        matches = index.search(index_queries, k=k)
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        return [[int(match["id"]) for match in results] for results in matches], elapsed_ms / len(queries)
+
+    exact_ids, _ = _top_ids(LocalVectorIndex(documents, embeddings, dtype="float32"), queries)
+    report = {}
+
+    def _report(name: str, index: LocalVectorIndex, index_queries: np.ndarray) -> None:
+        ids, ms_per_query = _top_ids(index, index_queries)
+        report[name] = {
+            "bytes_per_vector": round(index.nbytes / len(index), 1),
+            "search_ms_per_query": round(ms_per_query, 3),
+            **{f"recall@{at}": round(recall_at_k(exact_ids, ids, at), 4) for at in RECALL_AT},
+        }
+
+    for dtype in dtypes:
+        _report(dtype, LocalVectorIndex(documents, embeddings, dtype=dtype), queries)
+    for method in methods:
+        for dim in dims:
+            if method == "pca":
+                projection = EmbeddingProjection.fit_pca(embeddings, dim)
+            else:
+                projection = EmbeddingProjection.truncate(embeddings.shape[1], dim)
+            reduced = LocalVectorIndex(documents, projection.transform(embeddings), dtype="float32")
+            _report(f"{method}-{dim}", reduced, projection.transform(queries))
+            two_stage = LocalVectorIndex(documents, embeddings, dtype=rerank_dtype, projection=projection)
+            _report(f"{method}-{dim}+rerank", two_stage, queries)
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Memory and recall of compressed embedding formats.")
+    parser.add_argument("--embeddings", help=".npy file of shape (n, dim); default: synthetic clustered vectors")
+    parser.add_argument("--count", type=int, default=20_000, help="Synthetic corpus size")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dims", type=int, nargs="*", default=list(DEFAULT_DIMS), help="Reduced dimensions to evaluate")
+    parser.add_argument("--methods", nargs="*", choices=PROJECTION_METHODS, default=list(PROJECTION_METHODS))
+    parser.add_argument("--rerank-dtype", choices=INDEX_DTYPES, default="float32",
+                        help="Full-dimension vector format used by the two-stage rows")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    embeddings = np.load(args.embeddings).astype(np.float32) if args.embeddings else synthetic_embeddings(args.count)
+    report = measure_recall(embeddings, args.queries, dims=args.dims, methods=args.methods,
+                            rerank_dtype=args.rerank_dtype)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    print(f"{len(embeddings)} vectors x {embeddings.shape[1]} dims, {args.queries} queries")
+    print(f"{'index':<22}{'bytes/vec':>12}{'ms/query':>10}" + "".join(f"{f'recall@{at}':>11}" for at in RECALL_AT))
+    for name, row in report.items():
+        print(f"{name:<22}{row['bytes_per_vector']:>12}{row['search_ms_per_query']:>10}"
+              + "".join(f"{row[f'recall@{at}']:>11}" for at in RECALL_AT))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,249 @@
+"""
+Local stand-ins for the external services used by the analysis pipeline.
+
+- StubServer: one HTTP server serving the HuggingFace inference endpoint
+  (POST /models/<model_id>) and an OpenAI-compatible chat endpoint
+  (POST /v1/chat/completions) that BAML can be pointed at.
+- StubVectorCollection: an in-process replacement for the Atlas collection
+  that answers $vectorSearch aggregations over an in-memory corpus
+  (AsyncStubVectorCollection for the asyncio pipeline).
+
+Each stand-in takes a FaultProfile so latency and error distributions can be
+injected per service.
+"""
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+EMBEDDING_DIM = 384
+
+
+@dataclass
+class FaultProfile:
+    """
+    Latency and error injection for a stub service.
+
+    :param latency_ms: Median latency of a call.
+    :param jitter: Sigma of the log-normal latency distribution (0 = constant latency).
+    :param error_rate: Fraction of calls that fail.
+    :param error_status: HTTP status returned by failing HTTP calls.
+    """
+    latency_ms: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 503
+
+    def sample_latency(self) -> float:
+        if self.latency_ms <= 0:
+            return 0.0
+        if self.jitter <= 0:
+            return self.latency_ms / 1000
+        return random.lognormvariate(0, self.jitter) * self.latency_ms / 1000
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+def hash_embedding(text: str, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """Deterministic bag-of-words embedding, so that similar texts land near each other."""
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in text.lower().split():
+        digest = hashlib.md5(word.encode("utf-8")).digest()
+        vector[int.from_bytes(digest[:4], "little") % dim] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+STUB_ANALYSIS = {
+    "reasoning": "Stub reasoning: the new incident matches the retrieved incidents.",
+    "root_cause_summary": "Stub root cause: an expired credential broke the deployment pipeline.",
+    "troubleshooting_steps": [
+        "1. Check the credential expiry date.",
+        "2. Rotate the token and update the CI secret.",
+        "3. Re-run the failed pipeline.",
+    ],
+    # JudgeEvaluation fields, so the same stub answers EvaluateResponse too
+    "score": 4,
+    "justification": "Stub justification: the response follows the requested format.",
+}
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    server: "StubServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path.startswith("/models/"):
+            profile, handler = self.server.embedding_profile, self._embeddings
+        elif self.path.rstrip("/").endswith("/chat/completions"):
+            profile, handler = self.server.llm_profile, self._chat_completion
+        else:
+            self._send_json(404, {"error": f"Unknown stub route {self.path}"})
+            return
+
+        time.sleep(profile.sample_latency())
+        if profile.should_fail():
+            self._send_json(profile.error_status, {"error": "Injected stub failure"})
+            return
+        handler(payload)
+
+    def _embeddings(self, payload: dict) -> None:
+        inputs = payload.get("inputs", [])
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        self._send_json(200, [hash_embedding(text).tolist() for text in inputs])
+
+    def _chat_completion(self, payload: dict) -> None:
+        self._send_json(200, {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": json.dumps(STUB_ANALYSIS)},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+
+class StubServer(ThreadingHTTPServer):
+    """HTTP stub for the HuggingFace embedding endpoint and OpenAI-compatible LLM providers."""
+
+    daemon_threads = True
+
+    def __init__(self, embedding_profile: FaultProfile = None, llm_profile: FaultProfile = None,
+                 host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _StubHandler)
+        self.embedding_profile = embedding_profile or FaultProfile()
+        self.llm_profile = llm_profile or FaultProfile()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class StubVectorCollection:
+    """
+    In-process stand-in for the Atlas incidents collection.
+
+    Answers the $vectorSearch + $project aggregation used by UserQueryProcessor
+    with exact cosine search over the given documents. pymongo speaks the
+    MongoDB wire protocol, so this replaces the Collection object rather than
+    the server.
+    """
+
+    def __init__(self, documents: list[dict], profile: FaultProfile = None):
+        self.documents = documents
+        self.profile = profile or FaultProfile()
+        self.matrix = np.array([doc["embedding"] for doc in documents], dtype=np.float32)
+
+    def aggregate(self, pipeline: list[dict], **kwargs) -> list[dict]:
+        time.sleep(self.profile.sample_latency())
+        if self.profile.should_fail():
+            raise RuntimeError("Injected stub Atlas failure")
+        return self._search(pipeline)
+
+    def _search(self, pipeline: list[dict]) -> list[dict]:
+        search = pipeline[0]["$vectorSearch"]
+        query = np.asarray(search["queryVector"], dtype=np.float32)
+        scores = self.matrix @ query
+        top = np.argsort(-scores)[:search["limit"]]
+
+        projection = next((stage["$project"] for stage in pipeline[1:] if "$project" in stage), None)
+        results = []
+        for index in top:
+            doc = dict(self.documents[index], score=float(scores[index]))
+            if projection:
+                doc = {key: doc[key] for key, keep in projection.items() if keep and key in doc}
+                if "score" in projection:
+                    doc["score"] = float(scores[index])
+            results.append(doc)
+        return results
+
+
+class _StubAsyncCursor:
+    def __init__(self, results: list[dict]):
+        self.results = results
+
+    async def to_list(self, length=None) -> list[dict]:
+        return self.results if length is None else self.results[:length]
+
+
+class AsyncStubVectorCollection(StubVectorCollection):
+    """StubVectorCollection behind PyMongo's async API: awaitable aggregate() returning a cursor."""
+
+    async def aggregate(self, pipeline: list[dict], **kwargs) -> _StubAsyncCursor:
+        await asyncio.sleep(self.profile.sample_latency())
+        if self.profile.should_fail():
+            raise RuntimeError("Injected stub Atlas failure")
+        return _StubAsyncCursor(self._search(pipeline))
+
+
+SYNTHETIC_TEMPLATES = [
+    "{service} pipeline failed during deployment to {env}. Error: fatal: unable to access repository: returned error {status}",
+    "{service} experiencing intermittent 500 errors. Database connection pool exhausted after {seconds}s timeout",
+    "{service} pods crashing with OOMKilled in {env}. Memory usage increased over {hours} hours before crash",
+    "SSL certificate for {service}.example.com expired. Cert-manager renewal failed with ACME challenge timeout",
+    "Apdex dip for {service} in {env}: p95 latency increased from 50ms to {latency}ms",
+    "Disk usage on {service} reached 100%. No space left on device, log rotation failed",
+    "{service} Redis cache unavailable, connection refused on port 6379, cache hit ratio dropped to {ratio}%",
+    "{service} alert storm: {count} alerts fired in {seconds}s after config change in {env}",
+]
+SERVICES = ["api", "web", "ci-runner", "registry", "gitaly", "sidekiq", "redis", "postgres", "pages", "kas"]
+ENVIRONMENTS = ["gprd", "gstg", "production", "staging", "canary"]
+
+
+def synthetic_incident(rng: random.Random) -> str:
+    template = rng.choice(SYNTHETIC_TEMPLATES)
+    return template.format(
+        service=rng.choice(SERVICES), env=rng.choice(ENVIRONMENTS), status=rng.choice([403, 404, 500, 502]),
+        seconds=rng.randint(5, 120), hours=rng.randint(1, 12), latency=rng.randint(200, 5000),
+        ratio=rng.randint(0, 40), count=rng.randint(50, 5000),
+    )
+
+
+def synthetic_corpus(size: int, seed: int = 0) -> list[dict]:
+    """Embedded incident documents shaped like the Atlas `incidents` collection."""
+    rng = random.Random(seed)
+    documents = []
+    for index in range(size):
+        description = synthetic_incident(rng)
+        title = description.split(".")[0][:80]
+        documents.append({
+            "id": index + 1,
+            "title": title,
+            "description": description,
+            "embedding": hash_embedding(f"{title} {description}").tolist(),
+        })
+    return documents
@@ -41,4 +41,32 @@ class AtlasConnection:
         collection = self.database[collection_name]
         items = list(collection.find(filter=filter, limit=limit))
         return items
-            
\ No newline at end of file
+
+
+class AsyncAtlasConnection:
+    def __init__(self):
+        """
+        asyncio counterpart of AtlasConnection on PyMongo's AsyncMongoClient.
+
+        The client binds to the event loop it is first used on, so create one
+        connection per event loop (per worker), not one per process.
+        """
+        from pymongo import AsyncMongoClient
+        atlas_uri = get_secret("atlas-uri", "ATLAS_URI")
+        self.client = AsyncMongoClient(atlas_uri, server_api=ServerApi('1'))
+        self.database = self.client[DB_NAME]
+
+    async def ping(self):
+        """
+        Send a ping to confirm a successful connection.
+        """
+        try:
+            await self.client.admin.command('ping')
+        except Exception as e:
+            logging.error(f"Error pinging the server: {e}")
+
+    def get_collection(self, collection_name: str):
+        return self.database[collection_name]
+
+    async def close(self):
+        await self.client.close()
@@ -3,7 +3,7 @@ from tqdm import tqdm
 import pickle
 import logging
 from utils.secrets_helper import get_secret
-from utils.config import GITLAB_URL, GITLAB_PROJECT_URL
+from utils.config import GITLAB_URL, GITLAB_PROJECT_URL, GITLAB_PAGE_SIZE
 logging.basicConfig(level=logging.INFO)
 
 class GitlabConnection:
@@ -24,6 +24,23 @@ class GitlabConnection:
         
         logging.info(f"Total incidents retrieved: {len(incidents)}")
         return incidents
+
+    def get_incident_pages(self, project, start_page: int = 1, per_page: int = GITLAB_PAGE_SIZE):
+        """
+        Yield (page number, incidents) one API page at a time, oldest first, starting at start_page.
+
+        Oldest-first keeps earlier pages stable while new incidents are created, so a fetch can resume by page number.
+        """
+        page = start_page
+        while True:
+            incidents = project.issues.list(labels='incident', order_by='created_at', sort='asc',
+                                            page=page, per_page=per_page, get_all=False)
+            if not incidents:
+                return
+            yield page, incidents
+            if len(incidents) < per_page:
+                return
+            page += 1
     
     def save_incidents(self,incidents,filename):
         with open(filename,"wb") as f:
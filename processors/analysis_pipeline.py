@@ -0,0 +1,251 @@
+import logging
+import time
+from typing import Callable, Optional
+from processors.user_query_processor import UserQueryProcessor
+from utils.admission import BusyError, admission
+from utils.config import (
+    REQUEST_DEADLINE_SECONDS, LLM_MIN_BUDGET_SECONDS, JUDGE_MIN_BUDGET_SECONDS, RETRIEVAL_MIN_BUDGET_SECONDS,
+    LOCAL_INDEX_SYNC_ENABLED,
+)
+from utils.deadline import Deadline, await_with_deadline, call_with_deadline
+from utils.metrics import track_stage
+from utils.registry import registry, register_default_components
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[str, int], None]
+
+
+def _local_index():
+    """The change-stream-synced local index once loaded (LOCAL_INDEX_SYNC_ENABLED), otherwise None: search Atlas."""
+    if not LOCAL_INDEX_SYNC_ENABLED:
+        return None
+    return registry.get("local_index_sync").index
+
+
+def _new_result() -> dict:
+    return {
+        "response": None,
+        "similar_texts": [],
+        "retrieval_error": None,
+        "judge": None,
+        "judge_error": None,
+        "skipped": [],
+        "timings": {},
+        # When the response is a cluster's cached analysis, the full analysis once it finishes in the background
+        "refined_response": None,
+    }
+
+
+def _llm_options(result: dict, query_processor: Optional[UserQueryProcessor]) -> dict:
+    """Keyword arguments letting the LLM processor answer from a cluster's cached analysis and refine it later."""
+    if query_processor is None or query_processor.query_embedding is None:
+        return {}
+
+    def _on_refined(response: str) -> None:
+        result["refined_response"] = response
+
+    return {"query_embedding": query_processor.query_embedding, "embedding_field": query_processor.version.field,
+            "on_refined": _on_refined}
+
+
+class AnalysisPipeline:
+    """
+    The embed -> search -> LLM -> judge chain behind a single incident analysis.
+
+    Components come from the process-wide registry, so a pipeline is cheap to
+    create and safe to share between worker threads.
+    """
+
+    def __init__(self, embedding_model=None, llm_processor=None, collection=None, judge_client=None):
+        register_default_components()
+        self.embedding_model = embedding_model or registry.get("embedding_model")
+        self.llm_processor = llm_processor or registry.get("llm_processor")
+        self._collection = collection
+        self.judge_client = judge_client
+
+    @property
+    def collection(self):
+        # Resolved on first use so callers that never search (e.g. a batch on a local index) don't connect to Atlas
+        if self._collection is None:
+            self._collection = registry.get("collection")
+        return self._collection
+
+    def run(self, user_query: str, run_judge: bool = True, progress: Optional[ProgressCallback] = None,
+            deadline: Optional[Deadline] = None) -> dict:
+        """
+        Analyze an incident log end to end.
+
+        :param user_query: The pasted incident log.
+        :param run_judge: Also score the response with the LLM-as-judge.
+        :param progress: Optional callback receiving (stage, percent) updates.
+        :param deadline: End-to-end deadline shared by all stages (default: REQUEST_DEADLINE_SECONDS from now).
+                         Retrieval and the judge are skipped rather than letting the LLM call overrun it.
+        :return: dict with the formatted response, similar incidents, judge result, skipped stages and stage timings.
+        """
+        progress = progress or (lambda stage, percent: None)
+        deadline = deadline or Deadline(REQUEST_DEADLINE_SECONDS)
+        result = _new_result()
+
+        # Step 1: Find similar incidents (failures degrade to general-knowledge analysis)
+        progress("retrieval", 10)
+        start_time = time.time()
+        query_processor = None
+        try:
+            if not deadline.allows(RETRIEVAL_MIN_BUDGET_SECONDS + LLM_MIN_BUDGET_SECONDS):
+                logger.warning(f"Skipping retrieval to stay within the request deadline ({deadline.remaining():.1f}s left)")
+                result["skipped"].append("retrieval")
+            else:
+                # Retrieval must leave at least the LLM's minimum budget untouched
+                retrieval_deadline = deadline.child(reserve=LLM_MIN_BUDGET_SECONDS)
+                query_processor = UserQueryProcessor(user_query=user_query, embedding_model=self.embedding_model,
+                                                     local_index=_local_index())
+                result["similar_texts"] = query_processor.process_query(self.collection, deadline=retrieval_deadline)
+        except BusyError:
+            # Shed the whole analysis rather than answering without evidence
+            raise
+        except Exception as e:
+            logger.error(f"Error finding similar incidents: {e}", exc_info=True)
+            result["retrieval_error"] = str(e)
+        result["timings"]["retrieval"] = time.time() - start_time
+        logger.info(f"Found {len(result['similar_texts'])} similar incidents in {result['timings']['retrieval']:.2f} seconds")
+
+        # Step 2: Generate LLM response (failures, including BusyError, fail the analysis)
+        progress("llm", 40)
+        start_time = time.time()
+        result["response"] = self.llm_processor.get_llm_response(user_query, result["similar_texts"], deadline=deadline,
+                                                                 **_llm_options(result, query_processor))
+        result["timings"]["llm"] = time.time() - start_time
+        logger.info(f"LLM response generated in {result['timings']['llm']:.2f} seconds")
+
+        # Step 3: Judge evaluation
+        if run_judge and not deadline.allows(JUDGE_MIN_BUDGET_SECONDS):
+            logger.warning(f"Skipping judge evaluation to stay within the request deadline ({deadline.remaining():.1f}s left)")
+            result["skipped"].append("judge")
+        elif run_judge:
+            progress("judge", 80)
+            start_time = time.time()
+            try:
+                judge_response = self.judge(user_query, result["response"], deadline)
+                result["judge"] = {"score": judge_response.score, "justification": judge_response.justification}
+            except Exception as e:
+                logger.error(f"Judge evaluation error: {e}", exc_info=True)
+                result["judge_error"] = str(e)
+            result["timings"]["judge"] = time.time() - start_time
+            logger.info(f"Judge evaluation completed in {result['timings']['judge']:.2f} seconds")
+
+        progress("done", 100)
+        return result
+
+    def judge(self, prompt: str, response: str, deadline: Optional[Deadline] = None):
+        judge_client = self.judge_client
+        if judge_client is None:
+            from baml_client import b
+            judge_client = b
+        queue_timeout = deadline.timeout() if deadline is not None else None
+        with admission.limit("llm", timeout=queue_timeout), track_stage("judge"):
+            return call_with_deadline(
+                lambda: judge_client.EvaluateResponse(prompt=prompt, response=response),
+                deadline,
+                "judge",
+            )
+
+
+class AsyncAnalysisPipeline:
+    """
+    asyncio variant of AnalysisPipeline: httpx for embeddings, PyMongo's async
+    API for Atlas and BamlAsyncClient for the LLM and judge.
+
+    One event loop can keep hundreds of analyses in flight instead of one
+    thread per request. The embedding model and LLM processor are shared with
+    the threaded pipeline; the Atlas collection is per event loop, so create
+    one AsyncAnalysisPipeline per loop.
+    """
+
+    def __init__(self, embedding_model=None, llm_processor=None, collection=None, judge_client=None):
+        register_default_components()
+        self.embedding_model = embedding_model or registry.get("embedding_model")
+        self.llm_processor = llm_processor or registry.get("llm_processor")
+        self.collection = collection
+        self.judge_client = judge_client
+        self._atlas_connection = None
+
+    def _get_collection(self):
+        if self.collection is None:
+            from connectors.atlas_connection import AsyncAtlasConnection
+            from utils.config import COLLECTION_NAME
+            self._atlas_connection = AsyncAtlasConnection()
+            self.collection = self._atlas_connection.get_collection(COLLECTION_NAME)
+        return self.collection
+
+    async def run(self, user_query: str, run_judge: bool = True, progress: Optional[ProgressCallback] = None,
+                  deadline: Optional[Deadline] = None) -> dict:
+        """
+        Analyze an incident log end to end; same stages, skipping rules and result as AnalysisPipeline.run.
+        """
+        progress = progress or (lambda stage, percent: None)
+        deadline = deadline or Deadline(REQUEST_DEADLINE_SECONDS)
+        result = _new_result()
+
+        progress("retrieval", 10)
+        start_time = time.time()
+        query_processor = None
+        try:
+            if not deadline.allows(RETRIEVAL_MIN_BUDGET_SECONDS + LLM_MIN_BUDGET_SECONDS):
+                logger.warning(f"Skipping retrieval to stay within the request deadline ({deadline.remaining():.1f}s left)")
+                result["skipped"].append("retrieval")
+            else:
+                retrieval_deadline = deadline.child(reserve=LLM_MIN_BUDGET_SECONDS)
+                query_processor = UserQueryProcessor(user_query=user_query, embedding_model=self.embedding_model,
+                                                     local_index=_local_index())
+                result["similar_texts"] = await query_processor.aprocess_query(self._get_collection(), deadline=retrieval_deadline)
+        except BusyError:
+            raise
+        except Exception as e:
+            logger.error(f"Error finding similar incidents: {e}", exc_info=True)
+            result["retrieval_error"] = str(e)
+        result["timings"]["retrieval"] = time.time() - start_time
+
+        progress("llm", 40)
+        start_time = time.time()
+        result["response"] = await self.llm_processor.aget_llm_response(user_query, result["similar_texts"],
+                                                                        deadline=deadline,
+                                                                        **_llm_options(result, query_processor))
+        result["timings"]["llm"] = time.time() - start_time
+
+        if run_judge and not deadline.allows(JUDGE_MIN_BUDGET_SECONDS):
+            logger.warning(f"Skipping judge evaluation to stay within the request deadline ({deadline.remaining():.1f}s left)")
+            result["skipped"].append("judge")
+        elif run_judge:
+            progress("judge", 80)
+            start_time = time.time()
+            try:
+                judge_response = await self.judge(user_query, result["response"], deadline)
+                result["judge"] = {"score": judge_response.score, "justification": judge_response.justification}
+            except Exception as e:
+                logger.error(f"Judge evaluation error: {e}", exc_info=True)
+                result["judge_error"] = str(e)
+            result["timings"]["judge"] = time.time() - start_time
+
+        progress("done", 100)
+        return result
+
+    async def judge(self, prompt: str, response: str, deadline: Optional[Deadline] = None):
+        judge_client = self.judge_client
+        if judge_client is None:
+            from baml_client.async_client import b as async_b
+            judge_client = async_b
+        queue_timeout = deadline.timeout() if deadline is not None else None
+        async with admission.alimit("llm", timeout=queue_timeout):
+            with track_stage("judge"):
+                return await await_with_deadline(
+                    judge_client.EvaluateResponse(prompt=prompt, response=response),
+                    deadline,
+                    "judge",
+                )
+
+    async def aclose(self) -> None:
+        """Release this event loop's HTTP and MongoDB connections."""
+        await self.embedding_model.aclose()
+        if self._atlas_connection is not None:
+            await self._atlas_connection.close()
@@ -0,0 +1,268 @@
+"""
+Batch analysis of many incident logs (postmortem reviews, alert replays).
+
+Logs are embedded in batched API calls and matched against the corpus either
+with concurrent Atlas $vectorSearch queries or with one matrix multiply
+against a LocalVectorIndex. The LLM (and optional judge) calls then run under
+a concurrency limit. Each result is appended to an output JSONL as soon as it
+finishes, so an interrupted run resumes where it stopped.
+
+Usage:
+    python -m processors.batch_analysis logs.jsonl --output results.jsonl
+    python -m processors.batch_analysis alerts.csv --local-index --llm-concurrency 16 --judge
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+from processors.analysis_pipeline import AnalysisPipeline
+from processors.embedding_versions import LEGACY_VERSION, EmbeddingVersion, active_version
+from processors.local_index import LocalVectorIndex
+from processors.log_compression import compress_for_model
+from processors.snapshot import load_snapshot
+from processors.user_query_processor import UserQueryProcessor
+from utils.config import (
+    BATCH_EMBED_SIZE, BATCH_LLM_CONCURRENCY, BATCH_SEARCH_CONCURRENCY, CORPUS_SNAPSHOT_VERIFY, MMR_ENABLED, REQUEST_DEADLINE_SECONDS,
+    RETRIEVAL_CANDIDATES, RETRIEVAL_TOP_K,
+)
+from utils.deadline import Deadline
+from utils.metrics import track_stage
+
+logger = logging.getLogger(__name__)
+
+# Fields that may hold the log text in a JSONL record or CSV row, in order of preference
+TEXT_FIELDS = ("log", "query", "body", "text", "description")
+
+
+def load_incident_logs(path: str) -> list[dict]:
+    """
+    Read incident logs from a JSONL or CSV file.
+
+    :param path: JSONL with one object per line, or CSV with a header row. The log text is
+                 taken from the first non-empty field in TEXT_FIELDS; "id" is kept if present,
+                 otherwise the line/row number is used.
+    :return: Records of the form {"id": ..., "log": ...}.
+    """
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    records = []
+    for index, row in enumerate(rows):
+        text = next((row[field] for field in TEXT_FIELDS if row.get(field)), None)
+        if not text:
+            logger.warning(f"Skipping record {index} in {path}: no log text")
+            continue
+        record_id = row.get("id")
+        records.append({"id": str(record_id) if record_id not in (None, "") else str(index), "log": text})
+    return records
+
+
+def completed_ids(output_path: str) -> set[str]:
+    """Ids whose latest result in the output file succeeded; failed records are retried on resume."""
+    latest = {}
+    if os.path.exists(output_path):
+        with open(output_path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    # A run killed mid-write leaves a truncated last line
+                    continue
+                latest[result["id"]] = result["status"]
+    return {record_id for record_id, status in latest.items() if status == "done"}
+
+
+class BatchAnalyzer:
+    """
+    Analyze many incident logs with batched embeddings, batched search and bounded LLM concurrency.
+
+    :param local_index: Search this in-memory index (one matrix multiply per batch) instead of Atlas.
+    :param embed_batch_size: Logs per embedding API call.
+    :param search_concurrency: Concurrent Atlas $vectorSearch queries (ignored with a local index).
+    :param llm_concurrency: Concurrent LLM analyses; the shared admission limits still apply.
+    :param version: Embedding version to embed and search with (default: v1 for a local index,
+                    otherwise the collection's active version).
+    """
+
+    def __init__(self, embedding_model=None, llm_processor=None, collection=None,
+                 local_index: Optional[LocalVectorIndex] = None, judge_client=None,
+                 embed_batch_size: int = BATCH_EMBED_SIZE, search_concurrency: int = BATCH_SEARCH_CONCURRENCY,
+                 llm_concurrency: int = BATCH_LLM_CONCURRENCY, version: Optional[EmbeddingVersion] = None):
+        self.pipeline = AnalysisPipeline(embedding_model=embedding_model, llm_processor=llm_processor,
+                                         collection=collection, judge_client=judge_client)
+        self.local_index = local_index
+        self.embed_batch_size = embed_batch_size
+        self.search_concurrency = search_concurrency
+        self.llm_concurrency = llm_concurrency
+        self.version = version
+
+    def embedding_version(self) -> EmbeddingVersion:
+        if self.version is None:
+            self.version = LEGACY_VERSION if self.local_index is not None else active_version(self.pipeline.collection)
+        return self.version
+
+    def search(self, query_embeddings) -> list[list[str]]:
+        """Similar-incident texts for each query embedding, diversified like the single-query path."""
+        with track_stage("batch_search"):
+            if self.local_index is not None:
+                # The local index already ranks by full-precision similarity
+                candidates = RETRIEVAL_CANDIDATES if MMR_ENABLED else RETRIEVAL_TOP_K
+                matches = self.local_index.search(query_embeddings, k=candidates, return_embeddings=MMR_ENABLED)
+                rescore = False
+            else:
+                version = self.embedding_version()
+                coarse_embeddings = self.pipeline.embedding_model.for_version(version).reduce(query_embeddings)
+                if coarse_embeddings is None:
+                    coarse_embeddings = [None] * len(query_embeddings)
+
+                def _search_one(query_embedding, coarse_embedding):
+                    pipeline = UserQueryProcessor.build_search_pipeline(query_embedding, coarse_embedding=coarse_embedding,
+                                                                        version=version)
+                    return list(self.pipeline.collection.aggregate(pipeline))
+
+                with ThreadPoolExecutor(max_workers=self.search_concurrency, thread_name_prefix="batch-search") as executor:
+                    matches = list(executor.map(_search_one, query_embeddings, coarse_embeddings))
+                rescore = UserQueryProcessor.needs_rescore(coarse_embeddings[0])
+            matches = [UserQueryProcessor.select_results(query_embedding, results, rescore=rescore)
+                       for query_embedding, results in zip(query_embeddings, matches)]
+        return [[f"{r['title']}\n{r['description']}" for r in results] for results in matches]
+
+    def run(self, records: list[dict], output_path: str, run_judge: bool = False,
+            progress: Optional[Callable[[int, int], None]] = None) -> dict:
+        """
+        Analyze records and append one JSON result per record to output_path.
+
+        Records already completed in output_path are skipped, so re-running the
+        same command after an interruption resumes the batch.
+
+        :param records: {"id", "log"} records, e.g. from load_incident_logs().
+        :param progress: Optional callback receiving (finished, total) after each record.
+        :return: Summary counts and wall time.
+        """
+        done = completed_ids(output_path)
+        pending = [record for record in records if record["id"] not in done]
+        summary = {"total": len(records), "skipped": len(records) - len(pending), "done": 0, "failed": 0}
+        logger.info(f"BatchAnalyzer: {len(pending)} to analyze, {summary['skipped']} already done")
+        if not pending:
+            summary["wall_time_s"] = 0.0
+            return summary
+
+        write_lock = threading.Lock()
+        start_time = time.perf_counter()
+
+        with open(output_path, "a", encoding="utf-8") as output, \
+                ThreadPoolExecutor(max_workers=self.llm_concurrency, thread_name_prefix="batch-llm") as llm_executor:
+
+            def _write(result: dict) -> None:
+                with write_lock:
+                    output.write(json.dumps(result) + "\n")
+                    output.flush()
+                    summary[result["status"]] += 1
+                    if progress:
+                        progress(summary["done"] + summary["failed"], len(pending))
+
+            def _analyze(record: dict, similar_texts: list[str], query_embedding) -> None:
+                deadline = Deadline(REQUEST_DEADLINE_SECONDS)
+                result = {"id": record["id"], "status": "done", "similar_count": len(similar_texts),
+                          "response": None, "judge": None, "error": None}
+                try:
+                    # A record in an analysed cluster is answered from its cached analysis, without refinement
+                    result["response"] = self.pipeline.llm_processor.get_llm_response(
+                        record["log"], similar_texts, deadline=deadline, query_embedding=query_embedding,
+                        embedding_field=self.embedding_version().field)
+                    if run_judge:
+                        judge_response = self.pipeline.judge(record["log"], result["response"], deadline)
+                        result["judge"] = {"score": judge_response.score, "justification": judge_response.justification}
+                except Exception as e:
+                    logger.error(f"BatchAnalyzer: Record {record['id']} failed: {e}")
+                    result["status"], result["error"] = "failed", str(e)
+                _write(result)
+
+            # Embedding and search run batch by batch on this thread while earlier batches are analysed
+            for batch_start in range(0, len(pending), self.embed_batch_size):
+                batch = pending[batch_start:batch_start + self.embed_batch_size]
+                texts = [compress_for_model(record["log"]) for record in batch]
+                embeddings = [None] * len(batch)
+                try:
+                    embedding_model = self.pipeline.embedding_model.for_version(self.embedding_version())
+                    embeddings = embedding_model.get_embeddings(texts)
+                    similar = self.search(embeddings)
+                    if embedding_model.last_path == "fallback":
+                        # Not comparable with the cluster centroids
+                        embeddings = [None] * len(batch)
+                except Exception as e:
+                    # Without retrieval the analyses fall back to general knowledge, as in the single-query path
+                    logger.error(f"BatchAnalyzer: Retrieval failed for batch at {batch_start}: {e}")
+                    similar = [[] for _ in batch]
+                for record, similar_texts, query_embedding in zip(batch, similar, embeddings):
+                    llm_executor.submit(_analyze, record, similar_texts, query_embedding)
+
+        summary["wall_time_s"] = time.perf_counter() - start_time
+        return summary
+
+
+def analyze_batch(input_path: str, output_path: Optional[str] = None, use_local_index: bool = False,
+                  run_judge: bool = False, **analyzer_options) -> dict:
+    """
+    Analyze every incident log in a JSONL or CSV file; the programmatic counterpart of the CLI.
+
+    :param output_path: Results JSONL (default: <input>.results.jsonl); also the resume checkpoint.
+    :param use_local_index: Search a LocalVectorIndex in memory: the corpus snapshot if there is one for the
+                            active version (see processors.snapshot), otherwise a copy of the collection.
+    :param analyzer_options: Passed to BatchAnalyzer (concurrency, batch size, injected components).
+    """
+    output_path = output_path or f"{os.path.splitext(input_path)[0]}.results.jsonl"
+    if use_local_index and "local_index" not in analyzer_options:
+        from utils.registry import registry, register_default_components
+        register_default_components()
+        collection = analyzer_options.get("collection") or registry.get("collection")
+        embedding_model = analyzer_options.get("embedding_model") or registry.get("embedding_model")
+        version = analyzer_options.setdefault("version", active_version(collection))
+        projection = embedding_model.for_version(version).projection
+        snapshot = load_snapshot(field=version.field, verify=CORPUS_SNAPSHOT_VERIFY)
+        if snapshot is not None:
+            analyzer_options["local_index"] = LocalVectorIndex.from_snapshot(snapshot, projection=projection)
+        else:
+            analyzer_options["local_index"] = LocalVectorIndex.from_collection(
+                collection, projection=projection, field=version.field)
+    records = load_incident_logs(input_path)
+    summary = BatchAnalyzer(**analyzer_options).run(records, output_path, run_judge=run_judge)
+    summary["output_path"] = output_path
+    return summary
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Analyze a JSONL or CSV file of incident logs.")
+    parser.add_argument("input", help="JSONL or CSV file of incident logs")
+    parser.add_argument("--output", help="Results JSONL (default: <input>.results.jsonl); re-run to resume")
+    parser.add_argument("--local-index", action="store_true", help="Search an in-memory copy of the collection")
+    parser.add_argument("--judge", action="store_true", help="Also score each response with the LLM-as-judge")
+    parser.add_argument("--embed-batch-size", type=int, default=BATCH_EMBED_SIZE)
+    parser.add_argument("--search-concurrency", type=int, default=BATCH_SEARCH_CONCURRENCY)
+    parser.add_argument("--llm-concurrency", type=int, default=BATCH_LLM_CONCURRENCY)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    summary = analyze_batch(
+        args.input, args.output, use_local_index=args.local_index, run_judge=args.judge,
+        embed_batch_size=args.embed_batch_size, search_concurrency=args.search_concurrency,
+        llm_concurrency=args.llm_concurrency,
+    )
+    print(f"Analyzed {summary['done']} logs ({summary['failed']} failed, {summary['skipped']} already done) "
+          f"in {summary['wall_time_s']:.1f}s -> {summary['output_path']}")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
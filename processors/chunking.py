@@ -0,0 +1,128 @@
+"""
+Chunking of long incident descriptions into embeddable spans, and pooling of chunk hits back to incidents.
+
+bge-small-en-v1.5 reads at most 512 word pieces, so embedding "title description"
+as one string drops most of a long GitLab incident body. Descriptions are split
+at their section headings, small sections are packed together, and long ones
+are cut into overlapping word windows. Each chunk is embedded with its
+incident's title and stored in CHUNK_COLLECTION_NAME.
+
+At query time the chunk hits are pooled per incident (best chunk, or the mean
+of the incident's hits), and only the best-matching spans are passed on as the
+incident's context.
+"""
+import re
+from utils.config import CHUNK_CONTEXT_SPANS, CHUNK_MAX_WORDS, CHUNK_OVERLAP_WORDS, CHUNK_POOLING
+
+POOLING_METHODS = ("max", "mean")
+CHUNK_INDEX_NAME = "chunk_vector_index"
+# Markdown headings ("## Timeline") and bold section labels ("**Impact**") as GitLab incident templates use them
+_HEADING = re.compile(r"^\s*(?:#{1,6}\s+(?P<markdown>.+?)|\*\*(?P<bold>[^*\n]{1,80})\*\*:?)\s*#*\s*$", re.MULTILINE)
+_WORD = re.compile(r"\S+")
+
+
+def split_sections(text: str) -> list[tuple[str, str]]:
+    """(heading, body) pairs in document order; text before the first heading has an empty heading."""
+    sections = []
+    heading, start = "", 0
+    for match in _HEADING.finditer(text):
+        sections.append((heading, text[start:match.start()]))
+        heading, start = (match.group("markdown") or match.group("bold")).strip(), match.end()
+    sections.append((heading, text[start:]))
+    return [(heading, body.strip()) for heading, body in sections if body.strip()]
+
+
+def word_windows(text: str, max_words: int = CHUNK_MAX_WORDS, overlap: int = CHUNK_OVERLAP_WORDS) -> list[str]:
+    """Windows of at most max_words words, consecutive windows sharing overlap words."""
+    words = _WORD.findall(text)
+    if len(words) <= max_words:
+        return [" ".join(words)] if words else []
+    step = max(1, max_words - overlap)
+    return [" ".join(words[start:start + max_words]) for start in range(0, len(words) - overlap, step)]
+
+
+def chunk_text(text: str, max_words: int = CHUNK_MAX_WORDS, overlap: int = CHUNK_OVERLAP_WORDS) -> list[dict]:
+    """
+    Split a description into chunks of at most max_words words.
+
+    Consecutive sections are packed into one chunk while they fit; a section longer than
+    max_words becomes overlapping windows of its own.
+
+    :return: [{"section": heading(s) covered, "text": chunk text}] in document order.
+    """
+    chunks, headings, parts, size = [], [], [], 0
+
+    def _flush():
+        nonlocal headings, parts, size
+        if parts:
+            chunks.append({"section": " / ".join(h for h in headings if h), "text": "\n\n".join(parts)})
+        headings, parts, size = [], [], 0
+
+    for heading, body in split_sections(text or ""):
+        section_text = f"{heading}\n{body}" if heading else body
+        section_words = len(_WORD.findall(section_text))
+        if section_words > max_words:
+            _flush()
+            chunks.extend({"section": heading, "text": window} for window in word_windows(section_text, max_words, overlap))
+            continue
+        if size + section_words > max_words:
+            _flush()
+        headings.append(heading)
+        parts.append(section_text)
+        size += section_words
+    _flush()
+    return chunks
+
+
+def chunk_incident(incident: dict, max_words: int = CHUNK_MAX_WORDS, overlap: int = CHUNK_OVERLAP_WORDS) -> list[dict]:
+    """
+    Chunk documents for one incident; an incident without a description gets one title-only chunk.
+
+    :return: [{"incident_id", "chunk_index", "title", "section", "text"}].
+    """
+    chunks = chunk_text(incident.get("description") or "", max_words, overlap) or [{"section": "", "text": ""}]
+    return [
+        {"incident_id": incident["id"], "chunk_index": index, "title": incident.get("title") or "", **chunk}
+        for index, chunk in enumerate(chunks)
+    ]
+
+
+def chunk_embedding_text(chunk: dict) -> str:
+    """What is embedded for a chunk: the incident title for context, then the span (as prepare_data does)."""
+    return f"{chunk['title']} {chunk['text']}"
+
+
+def pool_chunk_hits(hits: list[dict], method: str = CHUNK_POOLING, spans: int = CHUNK_CONTEXT_SPANS) -> list[dict]:
+    """
+    Roll chunk search hits up to their incidents.
+
+    :param hits: Chunk documents with "incident_id", "chunk_index", "title", "text", "score"
+                 and optionally a decoded "embedding".
+    :param method: "max" scores an incident by its best chunk, "mean" by the mean of its hits.
+    :param spans: Best chunks per incident kept as its "description", in document order.
+    :return: Incident results ({"id", "title", "description", "score"} plus the best chunk's
+             "embedding" when present), best first.
+    """
+    if method not in POOLING_METHODS:
+        raise ValueError(f"Unknown chunk pooling method: {method} (expected one of {POOLING_METHODS})")
+    by_incident: dict = {}
+    for hit in hits:
+        by_incident.setdefault(hit["incident_id"], []).append(hit)
+
+    incidents = []
+    for incident_id, incident_hits in by_incident.items():
+        incident_hits.sort(key=lambda hit: -hit["score"])
+        scores = [hit["score"] for hit in incident_hits]
+        best = incident_hits[0]
+        context = sorted(incident_hits[:spans], key=lambda hit: hit["chunk_index"])
+        incident = {
+            "id": incident_id,
+            "title": best["title"],
+            "description": "\n...\n".join(hit["text"] for hit in context),
+            "score": max(scores) if method == "max" else sum(scores) / len(scores),
+        }
+        if best.get("embedding") is not None:
+            incident["embedding"] = best["embedding"]
+        incidents.append(incident)
+    incidents.sort(key=lambda incident: -incident["score"])
+    return incidents
@@ -0,0 +1,324 @@
+"""
+Offline incident clustering with a precomputed root-cause analysis per cluster.
+
+Most new incidents are another instance of a handful of recurring failure
+modes (expired tokens, exhausted connection pools, expired certificates). A
+batch job clusters the active version's incident embeddings with spherical
+k-means (cosine similarity; assignments in blocked matrix multiplies) and,
+for every cluster of at least CLUSTER_MIN_SIZE incidents, runs the same
+AnalyzeIncident call the app makes, with the member closest to the centroid
+as the query and the next closest members as its similar incidents. Clusters
+and analyses are stored in a side collection.
+
+At query time LLMProcessor checks the query embedding against the centroids
+(IncidentClusters.match) and, when the query is confidently inside a cluster,
+answers with the cached analysis instead of a multi-second LLM call. A query
+is confident when its similarity to the best centroid is at least
+CLUSTER_MATCH_MIN_SIMILARITY, at least as high as CLUSTER_MATCH_PERCENTILE
+percent of that cluster's own members, and CLUSTER_MATCH_MIN_MARGIN above the
+next best centroid.
+
+A build becomes visible once all of its clusters are written; the app loads
+the clusters at startup (the "incident_clusters" registry component).
+
+Usage:
+    python -m processors.clustering build
+    python -m processors.clustering build --clusters 40 --min-size 8
+    python -m processors.clustering show
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Optional
+import numpy as np
+from processors.local_index import stored_embedding
+from processors.quantization import embedding_fields
+from utils.config import (
+    CLUSTER_ANALYSIS_CONCURRENCY, CLUSTER_ANALYSIS_INCIDENTS, CLUSTER_COLLECTION_NAME, CLUSTER_COUNT,
+    CLUSTER_KMEANS_ITERATIONS, CLUSTER_KMEANS_RESTARTS, CLUSTER_MATCH_MIN_MARGIN, CLUSTER_MATCH_MIN_SIMILARITY,
+    CLUSTER_MATCH_PERCENTILE, CLUSTER_MIN_SIZE, SIMILARITY_GRAPH_BLOCK_ROWS,
+)
+from utils.metrics import track_stage
+
+if TYPE_CHECKING:
+    from pymongo.collection import Collection
+    from processors.llm_processor import LLMProcessor
+
+logger = logging.getLogger(__name__)
+
+# _id of the document naming the build that readers load
+ACTIVE_BUILD_ID = "active_build"
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray,
+            block_rows: int = SIMILARITY_GRAPH_BLOCK_ROWS) -> tuple[np.ndarray, np.ndarray]:
+    """(nearest centroid, its similarity) of every unit vector, block_rows vectors per matrix multiply."""
+    labels = np.empty(len(vectors), dtype=np.int64)
+    similarities = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), block_rows):
+        scores = vectors[start:start + block_rows] @ centroids.T
+        labels[start:start + block_rows] = scores.argmax(axis=1)
+        similarities[start:start + block_rows] = scores.max(axis=1)
+    return labels, similarities
+
+
+def spherical_kmeans(embeddings: np.ndarray, k: int, iterations: int = CLUSTER_KMEANS_ITERATIONS, seed: int = 0,
+                     restarts: int = CLUSTER_KMEANS_RESTARTS,
+                     block_rows: int = SIMILARITY_GRAPH_BLOCK_ROWS) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    k-means on the unit sphere (cosine similarity), seeded with k-means++.
+
+    :param embeddings: (n, dim) vectors; they need not be normalized.
+    :param k: Clusters; capped at n.
+    :param restarts: Runs from different seeds; the one with the highest total similarity is kept.
+    :return: (centroids (k, dim) unit length, label of every row, similarity of every row to its centroid).
+    """
+    vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+    k = min(k, len(vectors))
+    if k == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return np.zeros((0, vectors.shape[1]), dtype=np.float32), empty, empty.astype(np.float32)
+    runs = [_kmeans_run(vectors, k, iterations, np.random.default_rng(seed + run), block_rows)
+            for run in range(max(1, restarts))]
+    return max(runs, key=lambda result: float(result[2].sum()))
+
+
+def _kmeans_run(vectors: np.ndarray, k: int, iterations: int, rng: np.random.Generator,
+                block_rows: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    count = len(vectors)
+
+    # k-means++: each next seed is drawn with probability proportional to its squared distance to the seeds so far
+    chosen = [int(rng.integers(count))]
+    closest = vectors @ vectors[chosen[0]]
+    for _ in range(1, k):
+        weights = np.square(np.clip(1.0 - closest, 0.0, None)).astype(np.float64)
+        total = weights.sum()
+        candidate = int(rng.choice(count, p=weights / total)) if total > 0 else int(rng.integers(count))
+        chosen.append(candidate)
+        closest = np.maximum(closest, vectors @ vectors[candidate])
+    centroids = vectors[chosen].copy()
+
+    labels = None
+    for _ in range(iterations):
+        new_labels, similarities = _assign(vectors, centroids, block_rows)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        order = np.argsort(labels, kind="stable")
+        members = np.bincount(labels, minlength=k)
+        starts = np.concatenate([[0], np.cumsum(members)[:-1]])
+        sums = np.zeros_like(centroids)
+        occupied = members > 0
+        sums[occupied] = np.add.reduceat(vectors[order], starts[occupied], axis=0)
+        # An empty cluster is re-seeded with the vectors furthest from their centroids
+        empty = np.flatnonzero(~occupied)
+        if empty.size:
+            sums[empty] = vectors[np.argsort(similarities)[:empty.size]]
+        centroids = _normalize(sums)
+    labels, similarities = _assign(vectors, centroids, block_rows)
+    return centroids, labels, similarities
+
+
+class IncidentClusters:
+    """
+    The clusters of the active build, matched against query embeddings in memory.
+
+    :param clusters: Cluster documents as stored by ClusterAnalysisJob.
+    :param field: Embedding field the clusters were built from; queries embedded for another field never match.
+    """
+
+    def __init__(self, clusters: list[dict], field: str = "embedding",
+                 min_similarity: float = CLUSTER_MATCH_MIN_SIMILARITY, min_margin: float = CLUSTER_MATCH_MIN_MARGIN):
+        self.clusters = clusters
+        self.field = field
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self._centroids = (_normalize(np.array([cluster["centroid"] for cluster in clusters], dtype=np.float32))
+                           if clusters else None)
+        # Clusters without an analysis (too small, or the LLM call failed) still count for the margin
+        self._thresholds = np.array([max(cluster["threshold"], min_similarity) if cluster.get("analysis") else np.inf
+                                     for cluster in clusters], dtype=np.float32)
+
+    @classmethod
+    def load(cls, collection: "Collection") -> "IncidentClusters":
+        """The clusters of the last completed build in collection (none if there is no build yet)."""
+        active = collection.find_one({"_id": ACTIVE_BUILD_ID})
+        if active is None:
+            logger.info("IncidentClusters: No cluster build yet")
+            return cls([])
+        clusters = list(collection.find({"build": active["build"], "cluster": {"$exists": True}}))
+        clusters.sort(key=lambda cluster: cluster["cluster"])
+        logger.info(f"IncidentClusters: Loaded {len(clusters)} clusters "
+                    f"({sum(1 for cluster in clusters if cluster.get('analysis'))} analysed) of {active['field']}")
+        return cls(clusters, field=active["field"])
+
+    def __len__(self) -> int:
+        return len(self.clusters)
+
+    def match(self, query_embedding, field: str = "embedding") -> Optional[dict]:
+        """
+        The cluster the query is confidently inside, or None.
+
+        :return: {"cluster", "similarity", "size", "label", "analysis", "incident_ids"}.
+        """
+        if self._centroids is None or field != self.field:
+            return None
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        if query.shape[0] != self._centroids.shape[1]:
+            return None
+        similarities = self._centroids @ (query / (np.linalg.norm(query) or 1.0))
+        best = int(similarities.argmax())
+        runner_up = np.partition(similarities, -2)[-2] if len(similarities) > 1 else -1.0
+        if similarities[best] < self._thresholds[best] or similarities[best] - runner_up < self.min_margin:
+            return None
+        cluster = self.clusters[best]
+        return {"cluster": cluster["cluster"], "similarity": float(similarities[best]), "size": cluster["size"],
+                "label": cluster.get("label"), "analysis": cluster["analysis"],
+                "incident_ids": cluster.get("incident_ids", [])}
+
+
+class ClusterAnalysisJob:
+    """
+    Cluster the embedded incidents and store every cluster with its precomputed analysis.
+
+    :param incidents: PyMongo Collection of the incidents.
+    :param clusters_collection: PyMongo Collection the clusters are written to.
+    :param llm_processor: LLMProcessor whose AnalyzeIncident call produces the analyses.
+    :param field: Embedding field to cluster, e.g. the active EmbeddingVersion's field.
+    :param num_clusters: k of k-means; 0 picks sqrt(n / 2).
+    :param min_size: Smaller clusters are stored without an analysis and never answer queries.
+    """
+
+    def __init__(self, incidents: "Collection", clusters_collection: "Collection", llm_processor: "LLMProcessor",
+                 field: str = "embedding", num_clusters: int = CLUSTER_COUNT, min_size: int = CLUSTER_MIN_SIZE,
+                 analysis_incidents: int = CLUSTER_ANALYSIS_INCIDENTS, concurrency: int = CLUSTER_ANALYSIS_CONCURRENCY,
+                 match_percentile: float = CLUSTER_MATCH_PERCENTILE):
+        self.incidents = incidents
+        self.collection = clusters_collection
+        self.llm_processor = llm_processor
+        self.field = field
+        self.num_clusters = num_clusters
+        self.min_size = min_size
+        self.analysis_incidents = analysis_incidents
+        self.concurrency = concurrency
+        self.match_percentile = match_percentile
+
+    def _load(self) -> tuple[list[dict], np.ndarray]:
+        fields = {name: 1 for name in ("id", "title", "description") + embedding_fields(self.field)}
+        documents, embeddings = [], []
+        for document in self.incidents.find({self.field: {"$exists": True}}, {"_id": 0, **fields}):
+            embedding = stored_embedding(document, self.field)
+            if embedding is not None:
+                documents.append(document)
+                embeddings.append(embedding)
+        matrix = (np.array(embeddings, dtype=np.float32).reshape(len(embeddings), -1) if embeddings
+                  else np.zeros((0, 0), dtype=np.float32))
+        return documents, matrix
+
+    def analyze(self, member_texts: list[str]) -> Optional[dict]:
+        """AnalyzeIncident for a cluster: its most central member as the query, the next ones as similar incidents."""
+        try:
+            response = self.llm_processor.analyze_incident(member_texts[0], member_texts[1:self.analysis_incidents])
+        except Exception as e:
+            logger.error(f"ClusterAnalysisJob: Analysis failed, storing the cluster without one: {e}")
+            return None
+        return {"root_cause_summary": response.root_cause_summary,
+                "troubleshooting_steps": list(response.troubleshooting_steps), "reasoning": response.reasoning}
+
+    def run(self) -> dict:
+        """
+        Build, analyse and store the clusters, then make them the active build.
+
+        :return: {"incidents", "clusters", "analysed", "build", "seconds"}.
+        """
+        started = time.monotonic()
+        documents, embeddings = self._load()
+        num_clusters = self.num_clusters or max(1, round((len(documents) / 2) ** 0.5))
+        with track_stage("clustering"):
+            centroids, labels, similarities = spherical_kmeans(embeddings, num_clusters)
+
+        clusters = []
+        for cluster in range(len(centroids)):
+            rows = np.flatnonzero(labels == cluster)
+            if rows.size == 0:
+                continue
+            rows = rows[np.argsort(-similarities[rows], kind="stable")]
+            clusters.append({
+                "cluster": cluster, "centroid": centroids[cluster].tolist(), "size": int(rows.size),
+                # A query is inside the cluster when it is at least as close as this share of the members
+                "threshold": float(np.percentile(similarities[rows], self.match_percentile)),
+                "incident_ids": [documents[row].get("id") for row in rows],
+                "label": documents[rows[0]].get("title"), "analysis": None,
+                "_texts": [f"{documents[row].get('title')}\n{documents[row].get('description')}"
+                           for row in rows[:self.analysis_incidents]],
+            })
+
+        recurring = [cluster for cluster in clusters if cluster["size"] >= self.min_size]
+        logger.info(f"ClusterAnalysisJob: {len(documents)} incidents in {len(clusters)} clusters, "
+                    f"analysing the {len(recurring)} with at least {self.min_size} incidents")
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="cluster-analysis") as executor:
+            for cluster, analysis in zip(recurring, executor.map(lambda c: self.analyze(c["_texts"]), recurring)):
+                cluster["analysis"] = analysis
+
+        build_id = uuid.uuid4().hex
+        built_at = time.time()
+        if clusters:
+            self.collection.insert_many([
+                {**{key: value for key, value in cluster.items() if key != "_texts"},
+                 "field": self.field, "build": build_id, "built_at": built_at}
+                for cluster in clusters
+            ])
+        # Readers switch to the new build only now that all of it is written
+        self.collection.replace_one({"_id": ACTIVE_BUILD_ID}, {
+            "build": build_id, "field": self.field, "built_at": built_at, "clusters": len(clusters),
+        }, upsert=True)
+        self.collection.delete_many({"build": {"$ne": build_id}})
+
+        summary = {"incidents": len(documents), "clusters": len(clusters),
+                   "analysed": sum(1 for cluster in clusters if cluster["analysis"]), "build": build_id,
+                   "seconds": round(time.monotonic() - started, 2)}
+        logger.info(f"ClusterAnalysisJob: Built {summary}")
+        return summary
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Cluster incidents and precompute an analysis per recurring cluster.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Cluster the active version's embeddings and analyse each cluster")
+    build.add_argument("--clusters", type=int, default=CLUSTER_COUNT, help="k of k-means (0: sqrt(n / 2))")
+    build.add_argument("--min-size", type=int, default=CLUSTER_MIN_SIZE)
+    build.add_argument("--concurrency", type=int, default=CLUSTER_ANALYSIS_CONCURRENCY)
+    commands.add_parser("show", help="List the clusters of the active build")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from utils.registry import registry, register_default_components
+    register_default_components()
+    incidents = registry.get("collection")
+    clusters_collection = registry.get("atlas_client").get_collection(CLUSTER_COLLECTION_NAME)
+
+    if args.command == "build":
+        from processors.embedding_versions import active_version
+        job = ClusterAnalysisJob(incidents, clusters_collection, registry.get("llm_processor"),
+                                 field=active_version(incidents).field, num_clusters=args.clusters,
+                                 min_size=args.min_size, concurrency=args.concurrency)
+        print(json.dumps(job.run(), indent=2))
+    else:
+        clusters = IncidentClusters.load(clusters_collection)
+        for cluster in sorted(clusters.clusters, key=lambda cluster: -cluster["size"]):
+            print(f"{cluster['cluster']:>4}  {cluster['size']:>5} incidents  threshold {cluster['threshold']:.3f}  "
+                  f"{'analysed' if cluster.get('analysis') else '-':<9} {cluster.get('label')}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
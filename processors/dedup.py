@@ -0,0 +1,146 @@
+import logging
+import re
+import zlib
+from typing import Optional
+import numpy as np
+from utils.config import DEDUP_JACCARD_THRESHOLD, LSH_BANDS, MINHASH_NUM_PERM, SHINGLE_SIZE
+
+logger = logging.getLogger(__name__)
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class MinHasher:
+    """
+    MinHash signatures over word shingles, vectorized with NumPy.
+
+    The fraction of equal signature slots between two documents estimates the
+    Jaccard similarity of their shingle sets.
+
+    :param num_perm: Signature length (number of hash permutations).
+    :param shingle_size: Words per shingle.
+    :param seed: Seed for the permutation parameters; signatures are only comparable with the same seed.
+    """
+
+    def __init__(self, num_perm: int = MINHASH_NUM_PERM, shingle_size: int = SHINGLE_SIZE, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # Universal hashing (a * x + b) mod p; a, b < 2**32 keep a * x + b inside uint64 for 32-bit x
+        self._a = rng.integers(1, 1 << 32, size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, size=(num_perm, 1), dtype=np.uint64)
+
+    def shingles(self, text: str) -> np.ndarray:
+        """CRC32 hashes of the text's lowercase word shingles (stable across processes, unlike hash())."""
+        tokens = _TOKEN_PATTERN.findall(text.lower())
+        if len(tokens) < self.shingle_size:
+            grams = [" ".join(tokens)] if tokens else []
+        else:
+            grams = [" ".join(tokens[i:i + self.shingle_size]) for i in range(len(tokens) - self.shingle_size + 1)]
+        return np.fromiter({zlib.crc32(gram.encode("utf-8")) for gram in grams}, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = self.shingles(text)
+        if hashes.size == 0:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        permuted = ((self._a * hashes[np.newaxis, :] + self._b) % _MERSENNE_PRIME) & _MAX_HASH
+        return permuted.min(axis=1)
+
+    def signatures(self, texts: list[str]) -> np.ndarray:
+        """Signatures for many texts, shape (len(texts), num_perm)."""
+        return np.array([self.signature(text) for text in texts], dtype=np.uint64).reshape(len(texts), self.num_perm)
+
+
+class LSHIndex:
+    """
+    Banded LSH over MinHash signatures: documents sharing any band bucket are candidate duplicates.
+
+    With b bands of r rows, a pair with Jaccard similarity s becomes a candidate
+    with probability 1 - (1 - s**r)**b; the curve is steepest near (1/b)**(1/r).
+
+    :param num_bands: Bands per signature; must divide the signature length.
+    """
+
+    def __init__(self, num_bands: int = LSH_BANDS):
+        self.num_bands = num_bands
+        self._buckets: dict[tuple[int, bytes], list[int]] = {}
+
+    def add(self, key: int, signature: np.ndarray) -> None:
+        if len(signature) % self.num_bands:
+            raise ValueError(f"Signature length {len(signature)} is not divisible into {self.num_bands} bands")
+        for band, rows in enumerate(np.split(signature, self.num_bands)):
+            self._buckets.setdefault((band, rows.tobytes()), []).append(key)
+
+    def candidate_buckets(self) -> list[list[int]]:
+        """Buckets holding more than one key."""
+        return [keys for keys in self._buckets.values() if len(keys) > 1]
+
+
+def _text(document: dict) -> str:
+    return f"{document.get('title') or ''} {document.get('description') or ''}"
+
+
+def find_duplicate_groups(documents: list[dict], threshold: float = DEDUP_JACCARD_THRESHOLD,
+                          hasher: Optional[MinHasher] = None, num_bands: int = LSH_BANDS) -> list[list[int]]:
+    """
+    Group near-duplicate documents by their title + description.
+
+    Members of each LSH bucket are confirmed against the bucket's first member
+    with the signatures' Jaccard estimate before being merged (union-find), so
+    a bucket of n templated incidents costs n comparisons, not n**2.
+
+    :return: Groups of document positions, singletons included, in input order.
+    """
+    hasher = hasher or MinHasher()
+    signatures = hasher.signatures([_text(doc) for doc in documents])
+    index = LSHIndex(num_bands)
+    for position, signature in enumerate(signatures):
+        index.add(position, signature)
+
+    parent = list(range(len(documents)))
+
+    def _find(position: int) -> int:
+        while parent[position] != position:
+            parent[position] = parent[parent[position]]
+            position = parent[position]
+        return position
+
+    for keys in index.candidate_buckets():
+        anchor, others = keys[0], np.array(keys[1:])
+        similarity = (signatures[others] == signatures[anchor]).mean(axis=1)
+        for other in others[similarity >= threshold]:
+            root_anchor, root_other = _find(anchor), _find(int(other))
+            if root_anchor != root_other:
+                parent[max(root_anchor, root_other)] = min(root_anchor, root_other)
+
+    groups: dict[int, list[int]] = {}
+    for position in range(len(documents)):
+        groups.setdefault(_find(position), []).append(position)
+    return list(groups.values())
+
+
+def deduplicate(documents: list[dict], threshold: float = DEDUP_JACCARD_THRESHOLD,
+                hasher: Optional[MinHasher] = None) -> tuple[list[dict], dict[int, int]]:
+    """
+    Keep one representative per near-duplicate group for embedding and indexing.
+
+    The representative is the member with the longest description (ties: first
+    seen); it gets a "duplicate_ids" list with the ids of the other members.
+
+    :return: (representatives, mapping of duplicate id -> representative id).
+    """
+    representatives = []
+    duplicate_of = {}
+    for group in find_duplicate_groups(documents, threshold, hasher):
+        members = [documents[position] for position in group]
+        representative = max(members, key=lambda doc: len(doc.get("description") or ""))
+        duplicate_ids = [doc["id"] for doc in members if doc is not representative]
+        representatives.append(dict(representative, duplicate_ids=duplicate_ids))
+        for duplicate_id in duplicate_ids:
+            duplicate_of[duplicate_id] = representative["id"]
+
+    logger.info(f"Deduplicated {len(documents)} incidents into {len(representatives)} representatives "
+                f"({len(duplicate_of)} near-duplicates at Jaccard >= {threshold})")
+    return representatives, duplicate_of
@@ -0,0 +1,71 @@
+import numpy as np
+from utils.config import DUPLICATE_SIMILARITY_THRESHOLD, MMR_LAMBDA
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+def mmr_select(query_embedding: np.ndarray, candidate_embeddings: np.ndarray, k: int,
+               lambda_mult: float = MMR_LAMBDA,
+               duplicate_threshold: float = DUPLICATE_SIMILARITY_THRESHOLD) -> list[int]:
+    """
+    Pick up to k diverse candidates with Maximal Marginal Relevance.
+
+    Each step takes the candidate maximizing
+    lambda * sim(query, c) - (1 - lambda) * max(sim(c, selected)),
+    over a precomputed candidate similarity matrix, so one step is a few
+    vector operations rather than a Python loop over the candidates.
+    Candidates more similar than duplicate_threshold to an already selected
+    one are dropped, so fewer than k may be returned.
+
+    :param query_embedding: Shape (dim,).
+    :param candidate_embeddings: Shape (n_candidates, dim), in retrieval order.
+    :param lambda_mult: 1.0 ranks by relevance only; lower values favour diversity.
+    :param duplicate_threshold: Cosine similarity above which a candidate counts as a near-duplicate (>= 1 disables).
+    :return: Indices into candidate_embeddings, in selection order.
+    """
+    candidates = _normalize(np.asarray(candidate_embeddings, dtype=np.float32))
+    if len(candidates) == 0 or k <= 0:
+        return []
+    query = _normalize(np.asarray(query_embedding, dtype=np.float32).reshape(-1))
+    relevance = candidates @ query
+    similarity = candidates @ candidates.T
+
+    selected: list[int] = []
+    available = np.ones(len(candidates), dtype=bool)
+    # Highest similarity of each candidate to anything selected so far
+    redundancy = np.full(len(candidates), -np.inf, dtype=np.float32)
+
+    while len(selected) < k and available.any():
+        if selected:
+            scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        else:
+            scores = relevance.copy()
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+        available &= redundancy < duplicate_threshold
+    return selected
+
+
+def diversify(query_embedding: np.ndarray, results: list[dict], k: int,
+              lambda_mult: float = MMR_LAMBDA,
+              duplicate_threshold: float = DUPLICATE_SIMILARITY_THRESHOLD) -> list[dict]:
+    """
+    MMR over retrieved documents that carry their "embedding"; the embedding is dropped from the output.
+
+    Documents without an embedding are kept in their original order after the selected ones
+    (up to k in total), so a search that did not project vectors still returns results.
+    """
+    with_vectors = [doc for doc in results if doc.get("embedding") is not None]
+    without_vectors = [doc for doc in results if doc.get("embedding") is None]
+    chosen = []
+    if with_vectors:
+        embeddings = np.array([doc["embedding"] for doc in with_vectors], dtype=np.float32)
+        chosen = [with_vectors[index] for index in mmr_select(query_embedding, embeddings, k, lambda_mult, duplicate_threshold)]
+    chosen += without_vectors[:max(0, k - len(chosen))]
+    return [{key: value for key, value in doc.items() if key != "embedding"} for doc in chosen]
@@ -0,0 +1,269 @@
+"""
+Versioned embedding fields, so the embedding model can change without an outage.
+
+Each version is one embedding model (and dimension) stored in its own field
+of the incident and chunk documents, with its own Atlas vector indexes. The
+original vectors in "embedding" are version "v1". A new version starts out
+"building": ingestion dual-writes it next to the active version, and
+processors/reembed.py back-fills the existing documents. Once it covers every
+document the active version does, cutover() switches a single pointer
+document, which is atomic. Queries read the version the pointer names
+(cached for EMBEDDING_VERSION_CACHE_SECONDS) and embed with that version's
+model. The old field stays in place until it is dropped by hand; switching
+back is another cutover, possible while the old version still covers the corpus.
+"""
+import logging
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+from processors.chunking import CHUNK_INDEX_NAME
+from processors.projection import REDUCED_INDEX_NAME
+from processors.quantization import embedding_fields
+from utils.config import (
+    CHUNK_COLLECTION_NAME, COLLECTION_NAME, EMBEDDING_MODEL_ID, EMBEDDING_VERSION_CACHE_SECONDS,
+    EMBEDDING_VERSIONS_COLLECTION,
+)
+
+logger = logging.getLogger(__name__)
+
+BUILDING = "building"
+ACTIVE = "active"
+RETIRED = "retired"
+# _id of the document naming the active version
+ACTIVE_POINTER_ID = "__active__"
+
+
+@dataclass
+class EmbeddingVersion:
+    """
+    One embedding model's vectors: where they are stored and which indexes search them.
+
+    :param projection_path: Projection (.npz) for this model's two-stage search; v1 uses EMBEDDING_PROJECTION_PATH.
+    :param checkpoints: Re-embedding progress per collection: the last _id processed.
+    """
+    name: str
+    model_id: str
+    dimensions: int
+    field: str
+    index_name: str
+    chunk_index_name: str
+    status: str = BUILDING
+    projection_path: str = ""
+    created_at: float = field(default_factory=time.time)
+    activated_at: Optional[float] = None
+    checkpoints: dict = field(default_factory=dict)
+
+    @property
+    def is_legacy(self) -> bool:
+        return self.field == "embedding"
+
+    @property
+    def fields(self) -> tuple[str, ...]:
+        return embedding_fields(self.field)
+
+    @property
+    def reduced_field(self) -> str:
+        return f"{self.field}_reduced"
+
+    @property
+    def hash_field(self) -> str:
+        """Content hash of the text embedded in field (see EmbeddingModel.content_hash)."""
+        return f"{self.field}_hash"
+
+    @property
+    def reduced_index_name(self) -> str:
+        return REDUCED_INDEX_NAME if self.is_legacy else f"{self.field}_reduced_vector_index"
+
+    def to_document(self) -> dict:
+        document = asdict(self)
+        document["_id"] = document.pop("name")
+        return document
+
+    @classmethod
+    def from_document(cls, document: dict) -> "EmbeddingVersion":
+        document = dict(document)
+        document["name"] = document.pop("_id")
+        return cls(**document)
+
+
+LEGACY_VERSION = EmbeddingVersion(
+    name="v1", model_id=EMBEDDING_MODEL_ID, dimensions=384, field="embedding",
+    index_name="embedding_vector_index", chunk_index_name=CHUNK_INDEX_NAME, status=ACTIVE, created_at=0.0,
+)
+
+
+class CutoverError(RuntimeError):
+    """Raised when a version cannot become active yet (incomplete coverage, missing index, concurrent cutover)."""
+
+
+class EmbeddingVersionStore:
+    """
+    Version documents in EMBEDDING_VERSIONS_COLLECTION, plus the pointer to the active one.
+
+    Without any version documents the store behaves as if only v1 existed and was active.
+
+    :param database: PyMongo Database (or AsyncDatabase, for aactive()).
+    """
+
+    def __init__(self, database, cache_seconds: float = EMBEDDING_VERSION_CACHE_SECONDS):
+        self.database = database
+        self.versions = database[EMBEDDING_VERSIONS_COLLECTION]
+        self.cache_seconds = cache_seconds
+        self._active: Optional[EmbeddingVersion] = None
+        self._active_at = 0.0
+        self._lock = threading.Lock()
+
+    def _cached_active(self) -> Optional[EmbeddingVersion]:
+        with self._lock:
+            if self._active is not None and time.monotonic() - self._active_at < self.cache_seconds:
+                return self._active
+        return None
+
+    def _cache_active(self, version: EmbeddingVersion) -> EmbeddingVersion:
+        with self._lock:
+            self._active, self._active_at = version, time.monotonic()
+        return version
+
+    def active(self, fresh: bool = False) -> EmbeddingVersion:
+        """The version queries should read; cached for cache_seconds unless fresh."""
+        cached = None if fresh else self._cached_active()
+        if cached is not None:
+            return cached
+        pointer = self.versions.find_one({"_id": ACTIVE_POINTER_ID})
+        version = self.get(pointer["version"]) if pointer else LEGACY_VERSION
+        return self._cache_active(version)
+
+    async def aactive(self) -> EmbeddingVersion:
+        """active() for an AsyncDatabase."""
+        cached = self._cached_active()
+        if cached is not None:
+            return cached
+        pointer = await self.versions.find_one({"_id": ACTIVE_POINTER_ID})
+        version = LEGACY_VERSION
+        if pointer:
+            name = pointer["version"]
+            version = self._version(name, await self.versions.find_one({"_id": name}))
+        return self._cache_active(version)
+
+    def get(self, name: str) -> EmbeddingVersion:
+        return self._version(name, self.versions.find_one({"_id": name}))
+
+    @staticmethod
+    def _version(name: str, document: Optional[dict]) -> EmbeddingVersion:
+        """The version named name from its stored document (v1 needs none; any other must exist)."""
+        if document is None:
+            if name == LEGACY_VERSION.name:
+                return LEGACY_VERSION
+            raise KeyError(f"Unknown embedding version: {name}")
+        return EmbeddingVersion.from_document(document)
+
+    def list_versions(self) -> list[EmbeddingVersion]:
+        versions = [EmbeddingVersion.from_document(document)
+                    for document in self.versions.find({"_id": {"$ne": ACTIVE_POINTER_ID}}).sort("created_at", 1)]
+        if not any(version.name == LEGACY_VERSION.name for version in versions):
+            versions.insert(0, LEGACY_VERSION)
+        return versions
+
+    def write_targets(self) -> list[EmbeddingVersion]:
+        """Versions ingestion must write: the active one and every version still building (dual-write)."""
+        active = self.active(fresh=True)
+        return [active] + [version for version in self.list_versions() if version.status == BUILDING and version.name != active.name]
+
+    def create(self, name: str, model_id: str, dimensions: int, projection_path: str = "") -> EmbeddingVersion:
+        """Register a new building version; its field and index names are derived from its name."""
+        if name == LEGACY_VERSION.name:
+            raise ValueError(f"{name} is reserved for the original embedding field")
+        # Record v1 and the pointer first, so every later cutover is a compare-and-set on an existing pointer
+        self.versions.update_one({"_id": LEGACY_VERSION.name}, {"$setOnInsert": LEGACY_VERSION.to_document()}, upsert=True)
+        self.versions.update_one({"_id": ACTIVE_POINTER_ID}, {"$setOnInsert": {"version": LEGACY_VERSION.name}}, upsert=True)
+        field_name = f"embedding_{name}"
+        version = EmbeddingVersion(
+            name=name, model_id=model_id, dimensions=dimensions, field=field_name,
+            index_name=f"{field_name}_vector_index", chunk_index_name=f"chunk_{field_name}_vector_index",
+            projection_path=projection_path,
+        )
+        self.versions.insert_one(version.to_document())
+        logger.info(f"Created embedding version {name} ({model_id}, {dimensions} dims) in field {field_name}")
+        return version
+
+    def save_checkpoint(self, name: str, collection_name: str, last_id, processed: int) -> None:
+        self.versions.update_one(
+            {"_id": name},
+            {"$set": {f"checkpoints.{collection_name}.last_id": last_id},
+             "$inc": {f"checkpoints.{collection_name}.processed": processed}},
+        )
+
+    def coverage(self, version: EmbeddingVersion, active: Optional[EmbeddingVersion] = None) -> dict[str, tuple[int, int]]:
+        """
+        Per collection: (documents with this version's vector, documents the active version serves).
+        """
+        active = active or self.active(fresh=True)
+        coverage = {}
+        for collection_name in (COLLECTION_NAME, CHUNK_COLLECTION_NAME):
+            collection = self.database[collection_name]
+            served = {active.field: {"$exists": True}}
+            total = collection.count_documents(served)
+            covered = collection.count_documents({**served, version.field: {"$exists": True}}) if total else 0
+            coverage[collection_name] = (covered, total)
+        return coverage
+
+    def cutover(self, name: str, check_indexes: bool = True) -> EmbeddingVersion:
+        """
+        Make a fully back-filled version active with one compare-and-set on the pointer document.
+
+        :param check_indexes: Also require its Atlas vector index to be queryable.
+        :raises CutoverError: If coverage is below 100%, the index is not ready, or another cutover won.
+        """
+        version = self.get(name)
+        active = self.active(fresh=True)
+        if version.name == active.name:
+            return version
+        for collection_name, (covered, total) in self.coverage(version, active).items():
+            if covered < total:
+                raise CutoverError(f"{name} covers {covered}/{total} documents in {collection_name}")
+        if check_indexes:
+            self._check_index(self.database[COLLECTION_NAME], version.index_name)
+
+        result = self.versions.update_one({"_id": ACTIVE_POINTER_ID, "version": active.name},
+                                          {"$set": {"version": version.name, "switched_at": time.time()}})
+        if result.modified_count != 1:
+            raise CutoverError(f"The active version changed from {active.name} during cutover")
+        now = time.time()
+        self.versions.update_one({"_id": version.name}, {"$set": {"status": ACTIVE, "activated_at": now}})
+        self.versions.update_one({"_id": active.name}, {"$set": {"status": RETIRED}})
+        version.status, version.activated_at = ACTIVE, now
+        logger.info(f"Embedding version cutover: {active.name} -> {version.name}")
+        return self._cache_active(version)
+
+    @staticmethod
+    def _check_index(collection, index_name: str) -> None:
+        indexes = list(collection.list_search_indexes(index_name))
+        if not indexes or not indexes[0].get("queryable"):
+            raise CutoverError(f"Vector index {index_name} does not exist or is not queryable yet")
+
+
+_stores: dict = {}
+_stores_lock = threading.Lock()
+
+
+def version_store(database) -> EmbeddingVersionStore:
+    """The shared store for a database, so its active-version cache is shared across requests."""
+    key = (id(database.client), database.name)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = EmbeddingVersionStore(database)
+        return store
+
+
+def active_version(collection) -> EmbeddingVersion:
+    """The active version for a collection's database; v1 for collections without one (test doubles)."""
+    database = getattr(collection, "database", None)
+    return LEGACY_VERSION if database is None else version_store(database).active()
+
+
+async def aactive_version(collection) -> EmbeddingVersion:
+    """active_version() for a PyMongo AsyncCollection."""
+    database = getattr(collection, "database", None)
+    return LEGACY_VERSION if database is None else await version_store(database).aactive()
@@ -1,3 +1,5 @@
+import asyncio
+import hashlib
 import os
 import logging
 import numpy as np
@@ -7,12 +9,35 @@ from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import time
 import random
+from typing import Optional
+import threading
+import weakref
+from collections import OrderedDict
+from utils.config import (
+    BATCH_EMBED_SIZE, EMBEDDING_CACHE_SIZE, EMBEDDING_MODEL_ID, EMBEDDING_PROBE_MODE, EMBEDDING_STORAGE_FORMAT,
+    HF_INFERENCE_BASE_URL,
+)
+from utils.admission import admission
+from utils.deadline import Deadline
+from utils.metrics import track_stage, record_cache_lookup, EMBEDDING_PATH
+from utils.startup import timeline
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Don't start an API attempt with less budget than this; use fallback embeddings instead
+MIN_ATTEMPT_SECONDS = 1.0
+
 class EmbeddingModel:
-    def __init__(self):
+    def __init__(self, probe: str = EMBEDDING_PROBE_MODE, projection=None, model_id: str = EMBEDDING_MODEL_ID):
+        """
+        :param probe: "background" tests the API connection on a daemon thread, "sync" blocks
+                      on it (the original behaviour), "off" skips it. The probe only logs, so
+                      it does not need to hold up startup.
+        :param projection: EmbeddingProjection for the reduced-dimension search stage
+                           (default: loaded from EMBEDDING_PROJECTION_PATH, if set).
+        :param model_id: HuggingFace model served by the inference API.
+        """
         print("EmbeddingModel: Initializing...")
         logger.info("EmbeddingModel: Initializing...")
         
@@ -24,17 +49,40 @@ class EmbeddingModel:
             print("EmbeddingModel: HuggingFace API token NOT found!")
             logger.error("EmbeddingModel: HuggingFace API token NOT found!")
             
-        self.model_id = "BAAI/bge-small-en-v1.5"
-        self.api_url = f"https://api-inference.huggingface.co/models/{self.model_id}"
+        self.model_id = model_id
+        self.api_url = f"{HF_INFERENCE_BASE_URL}/{self.model_id}"
         self.headers = {"Authorization": f"Bearer {self.api_token}"}
         print(f"EmbeddingModel: API URL set to {self.api_url}")
         logger.info(f"EmbeddingModel: API URL set to {self.api_url}")
+
+        # Small LRU cache of single-text (query) embeddings served by the API
+        self._cache: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._path = threading.local()
+        self._async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        # Models of other embedding versions, created on first use (see for_version)
+        self._version_models: dict[str, "EmbeddingModel"] = {}
+        self._version_lock = threading.Lock()
+
+        if projection is None:
+            from processors.projection import load_projection
+            projection = load_projection()
+        self.projection = projection
         
-        # Test API connection immediately
-        self._test_api_connection()
+        # Test API connection without blocking startup unless asked to
+        if probe == "sync":
+            self._test_api_connection()
+        elif probe == "background":
+            threading.Thread(target=self._test_api_connection, name="embedding-probe", daemon=True).start()
+        elif probe != "off":
+            raise ValueError(f"Unknown embedding probe mode: {probe}")
 
     def _test_api_connection(self):
         """Test if the API is accessible"""
+        with timeline.phase("embedding_probe"):
+            self._probe_api()
+
+    def _probe_api(self):
         try:
             print("EmbeddingModel: Testing API connection...")
             logger.info("EmbeddingModel: Testing API connection...")
@@ -69,9 +117,185 @@ class EmbeddingModel:
         logger.info(f"EmbeddingModel: Prepared {len(combined_content)} texts for embedding")
         return combined_content
 
-    def get_embeddings(self, combined_content: list[str]) -> np.ndarray:
+    def get_embeddings(self, combined_content: list[str], deadline: Optional[Deadline] = None) -> np.ndarray:
         """
         Get embeddings from HuggingFace API with aggressive timeout handling.
+        Single-text requests (user queries) are served from an LRU cache when possible.
+
+        :param deadline: Optional request deadline; per-attempt timeouts and retries are sized
+                         from its remaining budget, falling back to local embeddings when it runs out.
+        """
+        with track_stage("embedding") as span:
+            cached = self._cache_get(combined_content)
+            if cached is not None:
+                self._path.value = "cache"
+                span.set_attribute("embedding.path", "cache")
+                return cached
+
+            self._path.value = "api"
+            queue_timeout = deadline.timeout() if deadline is not None else None
+            with admission.limit("embedding", timeout=queue_timeout):
+                embeddings = self._request_embeddings(combined_content, deadline)
+            EMBEDDING_PATH.inc(path=self._path.value)
+            span.set_attribute("embedding.path", self._path.value)
+            span.set_attribute("embedding.count", len(combined_content))
+
+            if self._path.value == "api":
+                self._cache_put(combined_content, embeddings)
+            return embeddings
+
+    @property
+    def last_path(self) -> Optional[str]:
+        """How this thread's last get_embeddings (or aget_embeddings) call was served: "api", "fallback" or "cache"."""
+        return getattr(self._path, "value", None)
+
+    def for_version(self, version) -> "EmbeddingModel":
+        """
+        The model that embeds queries and documents for an EmbeddingVersion: this one for the
+        original field, otherwise a model for the version's model_id and projection (created once).
+        """
+        if version.is_legacy:
+            return self
+        with self._version_lock:
+            model = self._version_models.get(version.name)
+            if model is None:
+                model = EmbeddingModel(probe="off", model_id=version.model_id)
+                # Not the default EMBEDDING_PROJECTION_PATH: that projection was fitted to v1's vectors
+                from processors.projection import load_projection
+                model.projection = load_projection(version.projection_path)
+                self._version_models[version.name] = model
+            return model
+
+    def reduce(self, embeddings: np.ndarray) -> Optional[np.ndarray]:
+        """Embeddings mapped through the configured projection, or None when there is none."""
+        if self.projection is None:
+            return None
+        return self.projection.transform(embeddings)
+
+    def _cache_get(self, combined_content: list[str]) -> Optional[np.ndarray]:
+        """Cached embedding for a single-text request, or None."""
+        if len(combined_content) != 1 or EMBEDDING_CACHE_SIZE <= 0:
+            return None
+        with self._cache_lock:
+            cached = self._cache.get(combined_content[0])
+            if cached is not None:
+                self._cache.move_to_end(combined_content[0])
+        record_cache_lookup("query_embedding", cached is not None)
+        if cached is None:
+            return None
+        EMBEDDING_PATH.inc(path="cache")
+        return cached[np.newaxis, :]
+
+    def _cache_put(self, combined_content: list[str], embeddings: np.ndarray) -> None:
+        # Fallback embeddings depend on the batch vocabulary, so callers only cache API results
+        if len(combined_content) != 1 or EMBEDDING_CACHE_SIZE <= 0 or len(embeddings) != 1:
+            return
+        with self._cache_lock:
+            self._cache[combined_content[0]] = embeddings[0]
+            while len(self._cache) > EMBEDDING_CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    async def aget_embeddings(self, combined_content: list[str], deadline: Optional[Deadline] = None) -> np.ndarray:
+        """
+        Async get_embeddings() on httpx: same cache, admission limit, deadline handling and fallback,
+        without holding a thread while the API call is in flight.
+        """
+        with track_stage("embedding") as span:
+            cached = self._cache_get(combined_content)
+            if cached is not None:
+                self._path.value = "cache"
+                span.set_attribute("embedding.path", "cache")
+                return cached
+
+            queue_timeout = deadline.timeout() if deadline is not None else None
+            async with admission.alimit("embedding", timeout=queue_timeout):
+                embeddings, path = await self._arequest_embeddings(combined_content, deadline)
+            # No await follows, so the caller reads last_path before another coroutine on this thread can change it
+            self._path.value = path
+            EMBEDDING_PATH.inc(path=path)
+            span.set_attribute("embedding.path", path)
+            span.set_attribute("embedding.count", len(combined_content))
+
+            if path == "api":
+                self._cache_put(combined_content, embeddings)
+            return embeddings
+
+    def _get_async_client(self):
+        """One httpx.AsyncClient per event loop: its connection pool is bound to the loop that created it."""
+        import httpx
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(headers=self.headers)
+            self._async_clients[loop] = client
+        return client
+
+    async def aclose(self) -> None:
+        """Close the httpx client of the running event loop."""
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    async def _arequest_embeddings(self, combined_content: list[str], deadline: Optional[Deadline] = None) -> tuple[np.ndarray, str]:
+        """
+        Async _request_embeddings(): retries with backoff, then local fallback embeddings.
+
+        :return: The embeddings and the path that produced them ("api" or "fallback").
+        """
+        import httpx
+
+        async def _fallback():
+            # The fallback embedder is CPU-bound; keep it off the event loop
+            return await asyncio.to_thread(self._get_fallback_embeddings, combined_content), "fallback"
+
+        if not self.api_token:
+            logger.warning("EmbeddingModel: No API token, using fallback embeddings")
+            return await _fallback()
+
+        max_retries = 3
+        base_delay = 2
+        timeout = 45
+        client = self._get_async_client()
+
+        for attempt in range(max_retries):
+            if deadline is not None and not deadline.allows(MIN_ATTEMPT_SECONDS):
+                logger.warning(f"Request deadline nearly exhausted ({deadline.remaining():.2f}s left), using fallback")
+                return await _fallback()
+            attempt_timeout = deadline.timeout(cap=timeout) if deadline is not None else timeout
+
+            try:
+                logger.info(f"Requesting embeddings for {len(combined_content)} items (attempt {attempt + 1}/{max_retries})...")
+                start_time = time.time()
+                response = await client.post(
+                    self.api_url,
+                    json={"inputs": combined_content, "options": {"wait_for_model": True}},
+                    timeout=attempt_timeout,
+                )
+                logger.info(f"Request completed in {time.time() - start_time:.2f} seconds")
+
+                if response.status_code == 200:
+                    logger.info("Successfully received embeddings from HuggingFace API")
+                    return np.array(response.json()), "api"
+                logger.warning(f"HTTP {response.status_code} on attempt {attempt + 1}/{max_retries}: {response.text[:200]}")
+                jitter = random.uniform(0, 1) if response.status_code == 503 else 0.0
+            except httpx.TimeoutException as e:
+                logger.warning(f"Timeout on attempt {attempt + 1}/{max_retries}: {e}")
+                jitter = random.uniform(0, 1)
+            except httpx.HTTPError as e:
+                logger.error(f"Request failed on attempt {attempt + 1}: {e}")
+                jitter = 0.0
+
+            if attempt < max_retries - 1:
+                delay = base_delay * (2 ** attempt) + jitter
+                logger.info(f"Retrying in {delay:.2f} seconds...")
+                await asyncio.sleep(delay if deadline is None else min(delay, deadline.remaining()))
+
+        logger.error("All embedding attempts failed, using fallback")
+        return await _fallback()
+
+    def _request_embeddings(self, combined_content: list[str], deadline: Optional[Deadline] = None) -> np.ndarray:
+        """
+        Call the HuggingFace API with retries, falling back to local embeddings on failure.
         """
         if not self.api_token:
             print("EmbeddingModel: No API token, using fallback embeddings")
@@ -84,6 +308,12 @@ class EmbeddingModel:
         timeout = 45  # Reduced from 300 to 45 seconds
         
         for attempt in range(max_retries):
+            if deadline is not None and not deadline.allows(MIN_ATTEMPT_SECONDS):
+                print(f"EmbeddingModel: Request deadline nearly exhausted ({deadline.remaining():.2f}s left), using fallback")
+                logger.warning(f"Request deadline nearly exhausted ({deadline.remaining():.2f}s left), using fallback")
+                return self._get_fallback_embeddings(combined_content)
+            attempt_timeout = deadline.timeout(cap=timeout) if deadline is not None else timeout
+
             try:
                 print(f"EmbeddingModel: Requesting embeddings for {len(combined_content)} items (attempt {attempt + 1}/{max_retries})...")
                 logger.info(f"Requesting embeddings for {len(combined_content)} items (attempt {attempt + 1}/{max_retries})...")
@@ -93,7 +323,7 @@ class EmbeddingModel:
                 
                 # More aggressive retry strategy
                 retry_strategy = Retry(
-                    total=1,  # Reduced from 2
+                    total=1 if deadline is None else 0,  # Reduced from 2; no hidden retries under a deadline
                     backoff_factor=0.5,  # Reduced from 1
                     status_forcelist=[429, 500, 502, 503, 504],
                     raise_on_status=False
@@ -107,7 +337,7 @@ class EmbeddingModel:
                     self.api_url,
                     headers=self.headers,
                     json={"inputs": combined_content, "options": {"wait_for_model": True}},
-                    timeout=timeout
+                    timeout=attempt_timeout
                 )
                 elapsed_time = time.time() - start_time
                 
@@ -130,7 +360,7 @@ class EmbeddingModel:
                         delay = base_delay * (2 ** attempt) + random.uniform(0, 1)
                         print(f"EmbeddingModel: Waiting {delay:.2f} seconds before retry...")
                         logger.info(f"Waiting {delay:.2f} seconds before retry...")
-                        time.sleep(delay)
+                        self._sleep_within(delay, deadline)
                         continue
                     else:
                         print("EmbeddingModel: Model still loading after all retries, using fallback")
@@ -145,7 +375,7 @@ class EmbeddingModel:
                     if attempt < max_retries - 1:
                         delay = base_delay * (2 ** attempt)
                         print(f"EmbeddingModel: Retrying in {delay:.2f} seconds...")
-                        time.sleep(delay)
+                        self._sleep_within(delay, deadline)
                         continue
                     else:
                         print("EmbeddingModel: All API attempts failed, using fallback")
@@ -163,7 +393,7 @@ class EmbeddingModel:
                     delay = base_delay * (2 ** attempt) + random.uniform(0, 1)
                     print(f"EmbeddingModel: Retrying in {delay:.2f} seconds...")
                     logger.info(f"Retrying in {delay:.2f} seconds...")
-                    time.sleep(delay)
+                    self._sleep_within(delay, deadline)
                     continue
                 else:
                     print("EmbeddingModel: All attempts timed out, using fallback embeddings")
@@ -179,7 +409,7 @@ class EmbeddingModel:
                     
                 if attempt < max_retries - 1:
                     delay = base_delay * (2 ** attempt)
-                    time.sleep(delay)
+                    self._sleep_within(delay, deadline)
                     continue
                 else:
                     print("EmbeddingModel: All requests failed, using fallback embeddings")
@@ -205,11 +435,17 @@ class EmbeddingModel:
         logger.error("All embedding attempts failed, using fallback")
         return self._get_fallback_embeddings(combined_content)
     
+    @staticmethod
+    def _sleep_within(delay: float, deadline: Optional[Deadline]) -> None:
+        """Back off between retries without sleeping past the request deadline."""
+        time.sleep(delay if deadline is None else min(delay, deadline.remaining()))
+
     def _get_fallback_embeddings(self, combined_content: list[str]) -> np.ndarray:
         """
         Generate simple fallback embeddings when API fails.
         This uses a basic TF-IDF-like approach.
         """
+        self._path.value = "fallback"
         print(f"EmbeddingModel: Generating fallback embeddings for {len(combined_content)} items")
         logger.warning(f"Using fallback embeddings for {len(combined_content)} items")
         
@@ -246,22 +482,74 @@ class EmbeddingModel:
         logger.info(f"Generated fallback embeddings with shape {len(embeddings)}x384")
         return np.array(embeddings)
 
-    def add_embeddings_to_documents(self, data: list[dict]) -> tuple[tuple[int,int], list[dict]]:
+    def content_hash(self, text: str, storage_format: str = EMBEDDING_STORAGE_FORMAT) -> str:
+        """
+        Hash of a text as this model embeds and stores it; kept next to the embedding so that
+        unchanged content is not embedded again.
+        """
+        return self.content_hashes([text], storage_format)[0]
+
+    def content_hashes(self, texts: list[str], storage_format: str = EMBEDDING_STORAGE_FORMAT) -> list[str]:
+        """content_hash() of every text; the model/format prefix is hashed once and the state copied per text."""
+        prefix = hashlib.sha256(f"{self.model_id}\n{storage_format}\n".encode("utf-8"))
+        hashes = []
+        for text in texts:
+            digest = prefix.copy()
+            digest.update(text.encode("utf-8"))
+            hashes.append(digest.hexdigest())
+        return hashes
+
+    def add_embeddings_to_documents(self, data: list[dict], storage_format: str = EMBEDDING_STORAGE_FORMAT,
+                                    field: str = "embedding",
+                                    stored_hashes: Optional[dict] = None) -> tuple[tuple[int,int], list[dict]]:
         """
         Add embeddings to the documents.
+
+        Each embedded document also gets "<field>_hash", the content_hash of its prepare_data text
+        (not for fallback embeddings, so they are replaced once the API is back).
+
+        :param storage_format: How the embedding fields are encoded (see processors.quantization).
+                               With a projection, the reduced vector is also stored in "<field>_reduced".
+        :param field: Field the embedding is stored in; an EmbeddingVersion's field for versions other than v1.
+        :param stored_hashes: Incident id -> stored "<field>_hash"; documents whose text is unchanged are
+                              not embedded and get no embedding fields.
         """
+        from processors.quantization import encode_embeddings, iter_encoded_embeddings
+
         print(f"EmbeddingModel: Starting embedding process for {len(data)} documents")
         logger.info(f"Starting embedding process for {len(data)} documents")
         
         try:
             combined_content = self.prepare_data(data)
-            embeddings = self.get_embeddings(combined_content)
+            # Hashed up front only when there are stored hashes to compare with
+            hashes = self.content_hashes(combined_content, storage_format) if stored_hashes else None
+            changed = ([index for index, doc in enumerate(data) if stored_hashes.get(doc.get('id')) != hashes[index]]
+                       if stored_hashes else list(range(len(data))))
+            if len(changed) < len(data):
+                print(f"EmbeddingModel: Skipping {len(data) - len(changed)} documents with unchanged content")
+                logger.info(f"Skipping {len(data) - len(changed)} documents with unchanged content")
+            if not changed:
+                return (0, 0), data
+            embeddings = self.get_embeddings([combined_content[index] for index in changed])
+            store_hashes = self.last_path != "fallback"
+            if store_hashes and hashes is None:
+                hashes = self.content_hashes(combined_content, storage_format)
             
             print(f"EmbeddingModel: Generated embeddings with shape: {embeddings.shape}")
             logger.info(f"Model embedding size/dimensionality: {embeddings.shape}")
 
-            for index, doc in enumerate(data):
-                doc['embedding'] = embeddings[index].tolist()
+            encoded = iter_encoded_embeddings(embeddings, storage_format, field)
+            reduced = self.reduce(embeddings)
+            if reduced is not None:
+                # Float32 regardless of storage_format: it is the small, coarse-stage vector
+                encoded_reduced = encode_embeddings(reduced, "list" if storage_format == "list" else "float32")
+            for position, (index, fields) in enumerate(zip(changed, encoded)):
+                doc = data[index]
+                doc.update(fields)
+                if reduced is not None:
+                    doc[f'{field}_reduced'] = encoded_reduced[position]['embedding']
+                if store_hashes:
+                    doc[f'{field}_hash'] = hashes[index]
             
             print("EmbeddingModel: Embedding process completed successfully")
             logger.info("Embedding process completed successfully")
@@ -270,4 +558,24 @@ class EmbeddingModel:
         except Exception as e:
             print(f"EmbeddingModel: Critical error in embedding process: {e}")
             logger.error(f"Critical error in embedding process: {e}")
-            raise
\ No newline at end of file
+            raise
+
+    def add_embeddings_to_chunks(self, chunks: list[dict], storage_format: str = EMBEDDING_STORAGE_FORMAT,
+                                 batch_size: int = BATCH_EMBED_SIZE, field: str = "embedding") -> list[dict]:
+        """
+        Embed chunk documents (see processors.chunking) in batches of batch_size texts per API call.
+
+        :param storage_format: How the embedding fields are encoded (see processors.quantization).
+        :param field: Field the embedding is stored in, as for add_embeddings_to_documents.
+        """
+        from processors.chunking import chunk_embedding_text
+        from processors.quantization import iter_encoded_embeddings
+
+        print(f"EmbeddingModel: Embedding {len(chunks)} chunks in batches of {batch_size}")
+        logger.info(f"Embedding {len(chunks)} chunks in batches of {batch_size}")
+        for start in range(0, len(chunks), batch_size):
+            batch = chunks[start:start + batch_size]
+            embeddings = self.get_embeddings([chunk_embedding_text(chunk) for chunk in batch])
+            for chunk, fields in zip(batch, iter_encoded_embeddings(embeddings, storage_format, field)):
+                chunk.update(fields)
+        return chunks
@@ -0,0 +1,271 @@
+"""
+Keep a LocalVectorIndex in step with the incident collection through a MongoDB change stream.
+
+A background thread watches the collection and applies inserts, updates and
+deletes to the in-memory index in small batches: changed incidents are
+appended and their old rows tombstoned, deleted ones are only tombstoned, and
+the index is compacted once tombstones pile up (or periodically). Searches
+therefore see ingestion's writes within seconds, without reloading the corpus.
+
+The stream is opened before the corpus is loaded, so nothing written during
+the load is missed; applying a change twice is harmless. The resume token is
+persisted after each applied batch, and a restarted process resumes the
+stream from it. If the oplog has moved past the saved token, the index is
+reloaded from the collection instead.
+
+When the image carries a corpus snapshot (processors/snapshot.py) of the same
+field, the index starts from it instead, serving searches immediately, and
+the stream replays the writes made since the snapshot was taken.
+
+Enabled with LOCAL_INDEX_SYNC_ENABLED (the "local_index_sync" registry component).
+"""
+import logging
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Optional
+import numpy as np
+from bson import json_util
+from pymongo.errors import OperationFailure, PyMongoError
+from processors.local_index import DOCUMENT_FIELDS, LocalVectorIndex, stored_embedding
+from processors.projection import EmbeddingProjection
+from processors.quantization import embedding_fields
+from processors.snapshot import load_snapshot
+from utils.config import (
+    CORPUS_SNAPSHOT_PATH, CORPUS_SNAPSHOT_VERIFY, LOCAL_INDEX_COMPACT_FRACTION, LOCAL_INDEX_COMPACT_INTERVAL_SECONDS,
+    LOCAL_INDEX_DTYPE, LOCAL_INDEX_RESUME_TOKEN_PATH, LOCAL_INDEX_SYNC_BATCH,
+)
+from utils.metrics import metrics
+
+if TYPE_CHECKING:
+    from pymongo.collection import Collection
+
+logger = logging.getLogger(__name__)
+
+LOCAL_INDEX_CHANGES = metrics.counter(
+    "devops_gpt_local_index_changes_total", "Change-stream events seen by the local vector index sync.", ("operation",))
+LOCAL_INDEX_LAG = metrics.gauge(
+    "devops_gpt_local_index_lag_seconds", "Age of the newest change applied to the local vector index.")
+LOCAL_INDEX_ROWS = metrics.gauge(
+    "devops_gpt_local_index_rows", "Rows of the local vector index.", ("state",))
+
+WATCH_PIPELINE = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+# The collection was dropped or renamed: the stream ends and cannot be resumed
+INVALIDATING_OPERATIONS = ("invalidate", "drop", "rename", "dropDatabase")
+# Server errors meaning the saved token is no longer in the oplog (CappedPositionLost, ChangeStreamFatalError,
+# ChangeStreamHistoryLost)
+HISTORY_LOST_CODES = (136, 280, 286)
+# How long one poll waits for new changes, so stop() is noticed promptly
+MAX_AWAIT_MS = 1000
+TOKEN_SAVE_INTERVAL_SECONDS = 5.0
+MAX_BACKOFF_SECONDS = 60.0
+
+
+class LocalIndexSync:
+    """
+    Load a LocalVectorIndex from the collection and follow its change stream on a daemon thread.
+
+    :param collection: PyMongo Collection of the incidents.
+    :param field: Embedding field to index, e.g. the active EmbeddingVersion's field.
+    :param token_path: Where the change stream's resume token is persisted.
+    :param compact_fraction: Compact once this fraction of the rows are tombstones.
+    :param compact_interval: Also compact when any rows are tombstones and this many seconds have passed.
+    :param snapshot_path: Corpus snapshot to start from when it holds field (empty: always load the collection).
+    """
+
+    def __init__(self, collection: "Collection", field: str = "embedding", dtype: str = LOCAL_INDEX_DTYPE,
+                 projection: Optional[EmbeddingProjection] = None, token_path: str = LOCAL_INDEX_RESUME_TOKEN_PATH,
+                 batch_size: int = LOCAL_INDEX_SYNC_BATCH, compact_fraction: float = LOCAL_INDEX_COMPACT_FRACTION,
+                 compact_interval: float = LOCAL_INDEX_COMPACT_INTERVAL_SECONDS,
+                 snapshot_path: str = CORPUS_SNAPSHOT_PATH):
+        self.collection = collection
+        self.field = field
+        self.dtype = dtype
+        self.projection = projection
+        self.token_path = token_path
+        self.batch_size = batch_size
+        self.compact_fraction = compact_fraction
+        self.compact_interval = compact_interval
+        self.snapshot_path = snapshot_path
+        # None until the first load has finished; replaced as a whole when the index is reloaded
+        self.index: Optional[LocalVectorIndex] = None
+        self.ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._token = self._load_token()
+        self._token_saved_at = 0.0
+        self._reload = False
+        self._compacted_at = time.monotonic()
+        # Updates that touch none of these fields leave the index unchanged
+        self._indexed_fields = set(embedding_fields(field) + DOCUMENT_FIELDS)
+
+    def start(self) -> threading.Thread:
+        """Load the index and follow the change stream on a daemon thread; stop() ends it."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name="local-index-sync", daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> Optional[LocalVectorIndex]:
+        """The index once loaded, or None if it is not loaded within timeout seconds."""
+        self.ready.wait(timeout)
+        return self.index
+
+    def run(self) -> None:
+        """Follow the change stream until stop(), reconnecting with backoff after errors."""
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                self._follow()
+                backoff = 1.0
+            except OperationFailure as e:
+                if e.code in HISTORY_LOST_CODES:
+                    logger.warning(f"LocalIndexSync: Resume token expired ({e}), reloading the index")
+                    self._reset_stream()
+                    continue
+                logger.error(f"LocalIndexSync: Change stream failed, retrying in {backoff:.0f}s: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+            except PyMongoError as e:
+                logger.error(f"LocalIndexSync: Change stream failed, retrying in {backoff:.0f}s: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+            except Exception as e:
+                # The index may be half updated; start again from a fresh load rather than serve it
+                logger.error(f"LocalIndexSync: Failed to apply changes, reloading in {backoff:.0f}s: {e}", exc_info=True)
+                self._reset_stream()
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+        self._save_token()
+
+    def _follow(self) -> None:
+        if self.index is None and not self._reload:
+            self._start_from_snapshot()
+        with self.collection.watch(WATCH_PIPELINE, full_document="updateLookup", resume_after=self._token,
+                                   max_await_time_ms=MAX_AWAIT_MS) as stream:
+            if self.index is None or self._reload:
+                # Opened before the load, so changes made during it are applied afterwards
+                self.index = LocalVectorIndex.from_collection(self.collection, dtype=self.dtype,
+                                                              projection=self.projection, field=self.field)
+                self._reload = False
+                self.ready.set()
+                self._update_row_gauges()
+            while stream.alive and not self._stop.is_set():
+                changes = []
+                while len(changes) < self.batch_size:
+                    change = stream.try_next()
+                    if change is None:
+                        break
+                    if change["operationType"] in INVALIDATING_OPERATIONS:
+                        logger.warning(f"LocalIndexSync: Collection {change['operationType']}, reloading the index")
+                        self._reset_stream()
+                        return
+                    changes.append(change)
+                if changes:
+                    self.apply(changes)
+                else:
+                    LOCAL_INDEX_LAG.set(0.0)
+                self._maybe_compact()
+                self._checkpoint(stream.resume_token, force=bool(changes))
+
+    def _start_from_snapshot(self) -> None:
+        """Serve the snapshot at once; the stream then resumes from the token taken when it was built."""
+        snapshot = load_snapshot(self.snapshot_path, field=self.field, verify=CORPUS_SNAPSHOT_VERIFY)
+        if snapshot is None:
+            return
+        self.index = LocalVectorIndex.from_snapshot(snapshot, projection=self.projection)
+        self.ready.set()
+        self._update_row_gauges()
+        if snapshot.resume_token is None or not snapshot.has_object_ids:
+            # Changes since the snapshot cannot be replayed onto it; replace it with a full load
+            self._reload = True
+        else:
+            self._token = snapshot.resume_token
+
+    def _reset_stream(self) -> None:
+        """Start a new stream from now and reload the index (the saved token cannot be resumed)."""
+        self._token = None
+        self._reload = True
+        if os.path.exists(self.token_path):
+            os.remove(self.token_path)
+
+    def apply(self, changes: list[dict]) -> None:
+        """Apply change-stream events to the index; only the last event per document matters."""
+        latest = {}
+        for change in changes:
+            operation = change["operationType"]
+            if operation == "update" and not self._touches_index(change.get("updateDescription", {})):
+                LOCAL_INDEX_CHANGES.inc(operation="skipped")
+                continue
+            LOCAL_INDEX_CHANGES.inc(operation=operation)
+            latest[change["documentKey"]["_id"]] = change
+
+        deleted, documents, embeddings, keys = [], [], [], []
+        for key, change in latest.items():
+            document = change.get("fullDocument") if change["operationType"] != "delete" else None
+            embedding = stored_embedding(document, self.field) if document is not None else None
+            if embedding is None:
+                # Deleted, or its embedding was removed (e.g. marked as a near-duplicate)
+                deleted.append(key)
+            else:
+                documents.append(document)
+                embeddings.append(embedding)
+                keys.append(key)
+        self.index.delete(deleted)
+        if documents:
+            self.index.upsert(documents, np.array(embeddings, dtype=np.float32), keys)
+        cluster_time = changes[-1].get("clusterTime")
+        if cluster_time is not None:
+            LOCAL_INDEX_LAG.set(max(0.0, time.time() - cluster_time.time))
+        self._update_row_gauges()
+        logger.debug(f"LocalIndexSync: Applied {len(changes)} changes ({len(keys)} upserted, {len(deleted)} deleted)")
+
+    def _touches_index(self, update_description: dict) -> bool:
+        changed = list(update_description.get("updatedFields", {})) + list(update_description.get("removedFields", []))
+        return any(name.split(".")[0] in self._indexed_fields for name in changed)
+
+    def _maybe_compact(self) -> None:
+        tombstones = self.index.tombstones
+        if not tombstones:
+            return
+        rows = len(self.index) + tombstones
+        if tombstones >= self.compact_fraction * rows or time.monotonic() - self._compacted_at >= self.compact_interval:
+            self.index.compact()
+            self._compacted_at = time.monotonic()
+            self._update_row_gauges()
+
+    def _update_row_gauges(self) -> None:
+        LOCAL_INDEX_ROWS.set(len(self.index), state="live")
+        LOCAL_INDEX_ROWS.set(self.index.tombstones, state="tombstone")
+
+    def _checkpoint(self, token: Optional[dict], force: bool = False) -> None:
+        if token is None:
+            return
+        self._token = token
+        if force or time.monotonic() - self._token_saved_at >= TOKEN_SAVE_INTERVAL_SECONDS:
+            self._save_token()
+
+    def _load_token(self) -> Optional[dict]:
+        if not os.path.exists(self.token_path):
+            return None
+        try:
+            with open(self.token_path, encoding="utf-8") as f:
+                return json_util.loads(f.read())["resume_token"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"LocalIndexSync: Ignoring unreadable resume token {self.token_path}: {e}")
+            return None
+
+    def _save_token(self) -> None:
+        """Persist the resume token atomically (write, then rename)."""
+        if self._token is None:
+            return
+        os.makedirs(os.path.dirname(self.token_path) or ".", exist_ok=True)
+        temporary_path = f"{self.token_path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            f.write(json_util.dumps({"resume_token": self._token, "field": self.field, "saved_at": time.time()}))
+        os.replace(temporary_path, self.token_path)
+        self._token_saved_at = time.monotonic()
@@ -0,0 +1,499 @@
+"""
+Checkpointed, resumable ingestion of GitLab incidents into Atlas.
+
+A run goes through fixed stages: fetch (GitLab pages), transform (convert and
+spool), embed (batches of INGEST_BATCH_SIZE incidents), write (the same
+batches into the collection), chunks (chunk documents per batch) and
+duplicates (near-duplicate markers). The stages run concurrently, connected
+by bounded queues (utils/stage_pipeline.py), with INGEST_*_WORKERS workers
+each, so the run takes about as long as its slowest stage. Near-duplicate
+detection needs the whole corpus, so with DEDUP_ENABLED the embedding stages
+start once fetching has finished.
+
+Progress is recorded in a local JSON manifest after every page and batch:
+fetched pages are appended to a spool file, and embedded batches are spooled
+until they are written. A run that dies part way (API timeout, network drop,
+pod eviction) is resumed by running it again; completed pages and batches are
+skipped. Every write is an upsert keyed by incident id, so repeating a batch
+after a crash is harmless. A fresh run fetches the current incidents again
+unless the INCIDENTS_PATH export exists.
+
+A manifest is only resumed while the settings that shape its batches and
+fields (collection, storage format, embedding versions, dedup, chunking,
+batch size) are unchanged; otherwise the run starts over.
+
+Usage:
+    python -m processors.populate_incidents              # resumes an interrupted run
+    python -m processors.populate_incidents --restart    # discard the manifest and start over
+"""
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+from dataclasses import dataclass
+from typing import Iterator, Optional
+from pymongo import UpdateOne
+from processors.chunking import chunk_incident
+from processors.dedup import deduplicate
+from processors.embedding_versions import EmbeddingVersion, version_store
+from utils.config import (
+    CHUNK_COLLECTION_NAME, CHUNKING_ENABLED, COLLECTION_NAME, DEDUP_ENABLED, EMBEDDING_STORAGE_FORMAT,
+    INCIDENTS_PATH, INGEST_BATCH_SIZE, INGEST_CHUNK_WORKERS, INGEST_EMBED_WORKERS, INGEST_MANIFEST_PATH,
+    INGEST_WORK_DIR, INGEST_WRITE_WORKERS,
+)
+from utils.stage_pipeline import Stage, StagePipeline
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("fetch", "embed", "write", "chunks", "duplicates")
+MANIFEST_FORMAT = 1
+
+
+class IngestionManifest:
+    """
+    Progress of one ingestion run, saved atomically (write, then rename) after every step.
+
+    Batches can finish out of order; a stage's "last_batch" is the end of its contiguous
+    run of finished batches and "completed" lists the finished batches after it.
+
+    :param fingerprint: Settings the run depends on; a saved manifest with another fingerprint is not resumed.
+    """
+
+    def __init__(self, path: str = INGEST_MANIFEST_PATH, fingerprint: Optional[dict] = None):
+        self.path = path
+        self.fingerprint = fingerprint or {}
+        self.data = self._new()
+        self._lock = threading.RLock()
+
+    def _new(self) -> dict:
+        now = time.time()
+        return {"format": MANIFEST_FORMAT, "fingerprint": self.fingerprint, "started_at": now, "updated_at": now,
+                "completed_at": None, "stages": {stage: {"done": False} for stage in STAGES}}
+
+    def load(self) -> bool:
+        """Load a saved, unfinished run with the same fingerprint. False (fresh manifest) otherwise."""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved.get("completed_at"):
+            logger.info("IngestionManifest: Previous run finished, starting a new one")
+            return False
+        if saved.get("format") != MANIFEST_FORMAT or saved.get("fingerprint") != self.fingerprint:
+            logger.warning("IngestionManifest: Settings changed since the interrupted run, starting over")
+            return False
+        self.data = saved
+        return True
+
+    def reset(self) -> None:
+        self.data = self._new()
+        self.save()
+
+    def save(self) -> None:
+        with self._lock:
+            self.data["updated_at"] = time.time()
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            temporary_path = f"{self.path}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary_path, self.path)
+
+    def stage(self, name: str) -> dict:
+        return self.data["stages"][name]
+
+    def update(self, name: str, **progress) -> None:
+        """Record progress of a stage (e.g. last_page, done) and save."""
+        with self._lock:
+            self.data["stages"][name].update(progress)
+            self.save()
+
+    def batch_done(self, name: str, index: int) -> bool:
+        with self._lock:
+            stage = self.data["stages"][name]
+            return index <= stage.get("last_batch", -1) or index in stage.get("completed", ())
+
+    def complete_batch(self, name: str, index: int, items: int = 0) -> None:
+        """Record that a stage finished a batch (adding items to its "count") and save."""
+        with self._lock:
+            stage = self.data["stages"][name]
+            completed = set(stage.get("completed", ())) | {index}
+            last_batch = stage.get("last_batch", -1)
+            while last_batch + 1 in completed:
+                last_batch += 1
+                completed.discard(last_batch)
+            stage.update(last_batch=last_batch, completed=sorted(completed), count=stage.get("count", 0) + items)
+            self.save()
+
+    def complete(self) -> None:
+        self.data["completed_at"] = time.time()
+        self.save()
+
+    def summary(self) -> str:
+        return ", ".join(
+            f"{name}: {'done' if stage['done'] else {k: v for k, v in stage.items() if k != 'done'} or 'pending'}"
+            for name, stage in self.data["stages"].items())
+
+
+@dataclass
+class _Page:
+    number: Optional[int]
+    incidents: list[dict]
+    # Already in the spool (replayed on resume) or read from the INCIDENTS_PATH export
+    spooled: bool = False
+
+
+@dataclass
+class _Batch:
+    index: int
+    incidents: list[dict]
+    # The batch with its embedding fields; None once the batch has been written
+    embedded: Optional[list[dict]] = None
+    # Incidents embedded for at least one version (new or changed content); None when unknown
+    changed_ids: Optional[set] = None
+
+
+# Sent by the fetch source after its last page, so the fetch is only marked done once every page is spooled
+_FETCH_DONE = _Page(None, [], spooled=True)
+
+
+class IngestionRunner:
+    """
+    Fetch, embed and store the incident corpus, resuming from the manifest of an interrupted run.
+
+    :param database: PyMongo Database the incident (and chunk) collections live in.
+    :param embedding_model: EmbeddingModel; each write-target version embeds with for_version().
+    :param gitlab: GitlabConnection (created on first use when a fetch is needed).
+    :param embed_workers: Concurrent embedding batches; the embedding admission limit still applies.
+    :param reembed_all: Embed every incident, not only those whose content hash changed (e.g. after
+                        changing the chunking settings or a version's projection).
+    """
+
+    def __init__(self, database, embedding_model, gitlab=None, batch_size: int = INGEST_BATCH_SIZE,
+                 manifest_path: str = INGEST_MANIFEST_PATH, work_dir: str = INGEST_WORK_DIR,
+                 storage_format: str = EMBEDDING_STORAGE_FORMAT, embed_workers: int = INGEST_EMBED_WORKERS,
+                 write_workers: int = INGEST_WRITE_WORKERS, chunk_workers: int = INGEST_CHUNK_WORKERS,
+                 reembed_all: bool = False):
+        self.database = database
+        self.collection = database[COLLECTION_NAME]
+        self.embedding_model = embedding_model
+        self.gitlab = gitlab
+        self.batch_size = batch_size
+        self.work_dir = work_dir
+        self.storage_format = storage_format
+        self.embed_workers = embed_workers
+        self.write_workers = write_workers
+        self.chunk_workers = chunk_workers
+        self.reembed_all = reembed_all
+        self.versions: list[EmbeddingVersion] = version_store(database).write_targets()
+        self.embedding_fields = tuple(
+            name for version in self.versions for name in version.fields + (version.hash_field,))
+        # Version name -> {incident id: stored content hash}, read once per run
+        self._stored_hashes: dict[str, dict] = {}
+        self.manifest = IngestionManifest(manifest_path, {
+            "collection": COLLECTION_NAME, "storage_format": storage_format, "batch_size": batch_size,
+            "versions": [version.name for version in self.versions], "dedup": DEDUP_ENABLED, "chunking": CHUNKING_ENABLED,
+        })
+        self._stopping = threading.Event()
+        self._pipeline: Optional[StagePipeline] = None
+        # Filled by the transform stage
+        self._incidents: list[dict] = []
+        self._seen_ids: set = set()
+        self._pending: list[dict] = []
+        self._next_batch = 0
+        self._fetch_complete = False
+
+    @property
+    def spool_path(self) -> str:
+        return os.path.join(self.work_dir, "incidents.jsonl")
+
+    def _batch_path(self, index: int) -> str:
+        return os.path.join(self.work_dir, f"embedded_{index:05d}.pkl")
+
+    def stop(self) -> None:
+        """Graceful shutdown: stop fetching and starting batches, finish the ones in flight (resumable)."""
+        self._stopping.set()
+        if self._pipeline is not None:
+            self._pipeline.stop()
+
+    def run(self, restart: bool = False) -> dict:
+        """
+        Run every stage not yet completed.
+
+        :param restart: Ignore the manifest of an interrupted run.
+        :return: Counts (incidents, representatives, duplicates, batches, chunks), "stopped", and
+                 per-pipeline stage statistics under "stages".
+        """
+        if not restart and self.manifest.load():
+            logger.info(f"IngestionRunner: Resuming run ({self.manifest.summary()})")
+        else:
+            self.manifest.reset()
+        os.makedirs(self.work_dir, exist_ok=True)
+        self.collection.create_index("id", unique=True)
+        if CHUNKING_ENABLED:
+            self.database[CHUNK_COLLECTION_NAME].create_index([("incident_id", 1), ("chunk_index", 1)], unique=True)
+        if not self.reembed_all:
+            self._stored_hashes = self.stored_hashes()
+
+        summary = {"incidents": 0, "representatives": 0, "duplicates": 0, "embedded": 0, "batches": 0, "chunks": 0,
+                   "stopped": False, "stages": {}}
+        if DEDUP_ENABLED:
+            # Grouping needs every incident, so embedding starts once the fetch is complete
+            summary["stages"]["fetch"] = self._run_pipeline("ingest_fetch", self._transform_stages(), self._pages())
+            if not self._fetch_complete:
+                return self._stopped(summary)
+            representatives, duplicate_of = deduplicate(self._incidents)
+            batches = [_Batch(index, representatives[start:start + self.batch_size])
+                       for index, start in enumerate(range(0, len(representatives), self.batch_size))]
+            summary["stages"]["embed"] = self._run_pipeline("ingest_embed", self._batch_stages(), batches)
+            summary["batches"] = len(batches)
+        else:
+            representatives, duplicate_of = None, {}
+            summary["stages"]["ingest"] = self._run_pipeline(
+                "ingest", self._transform_stages() + self._batch_stages(), self._pages())
+            summary["batches"] = self._next_batch
+        if self._stopping.is_set() or not self._fetch_complete:
+            return self._stopped(summary)
+        for stage in ("embed", "write", "chunks"):
+            self.manifest.update(stage, done=True)
+        self.mark_duplicates(self._incidents, duplicate_of)
+
+        self.manifest.complete()
+        summary.update(incidents=len(self._incidents), duplicates=len(duplicate_of),
+                       representatives=len(representatives) if representatives is not None else len(self._incidents),
+                       embedded=self.manifest.stage("embed").get("count", 0),
+                       chunks=self.manifest.stage("chunks").get("count", 0))
+        logger.info(f"IngestionRunner: Finished {summary}")
+        return summary
+
+    def stored_hashes(self) -> dict[str, dict]:
+        """The content hashes stored for every write-target version, in one projected query."""
+        hash_fields = {version.hash_field: 1 for version in self.versions}
+        stored = {version.name: {} for version in self.versions}
+        for document in self.collection.find({}, {"_id": 0, "id": 1, **hash_fields}):
+            for version in self.versions:
+                if version.hash_field in document:
+                    stored[version.name][document["id"]] = document[version.hash_field]
+        logger.info("IngestionRunner: Stored content hashes: "
+                    + ", ".join(f"{name} {len(hashes)}" for name, hashes in stored.items()))
+        return stored
+
+    def _run_pipeline(self, name: str, stages: list[Stage], source) -> dict:
+        self._pipeline = StagePipeline(name, stages)
+        if self._stopping.is_set():
+            self._pipeline.stop()
+        try:
+            return self._pipeline.run(source)
+        finally:
+            self._pipeline = None
+
+    def _stopped(self, summary: dict) -> dict:
+        logger.warning(f"IngestionRunner: Stopped; run again to resume ({self.manifest.summary()})")
+        summary["stopped"] = True
+        return summary
+
+    def _transform_stages(self) -> list[Stage]:
+        # One worker: pages are spooled and batched in order, so a resumed run rebuilds the same batches
+        return [Stage("transform", self.transform, workers=1, fan_out=True, flush=self._flush_batches)]
+
+    def _batch_stages(self) -> list[Stage]:
+        stages = [Stage("embed", self.embed, workers=self.embed_workers),
+                  Stage("write", self.write, workers=self.write_workers)]
+        if CHUNKING_ENABLED:
+            stages.append(Stage("chunks", self.write_chunks, workers=self.chunk_workers))
+        return stages
+
+    def _pages(self) -> Iterator[_Page]:
+        """
+        The fetch stage: the INCIDENTS_PATH export when it exists; otherwise the pages already
+        spooled by an interrupted run, then the remaining GitLab pages.
+        """
+        if os.path.exists(INCIDENTS_PATH):
+            with open(INCIDENTS_PATH, "rb") as f:
+                yield _Page(None, [incident.attributes for incident in pickle.load(f)], spooled=True)
+            self.manifest.update("fetch", source=INCIDENTS_PATH)
+            yield _FETCH_DONE
+            return
+
+        stage = self.manifest.stage("fetch")
+        count = stage.get("count", 0)
+        # Lines after the recorded count belong to a page that was not checkpointed; drop them
+        self._truncate_spool(count)
+        if count:
+            yield _Page(stage.get("last_page"), self._read_spool(count), spooled=True)
+        if not stage["done"]:
+            if self.gitlab is None:
+                from connectors.gitlab_connection import GitlabConnection
+                self.gitlab = GitlabConnection()
+            project = self.gitlab.get_project()
+            for page, issues in self.gitlab.get_incident_pages(project, start_page=stage.get("last_page", 0) + 1):
+                yield _Page(page, [issue.attributes for issue in issues])
+        yield _FETCH_DONE
+
+    def transform(self, page: _Page) -> list[_Batch]:
+        """
+        The transform stage: spool and checkpoint a fetched page, collect its incidents (first
+        occurrence of each id) and, without dedup, cut them into batches for the embed stage.
+        """
+        if page is _FETCH_DONE:
+            self.manifest.update("fetch", done=True, count=self.manifest.stage("fetch").get("count", 0))
+            self._fetch_complete = True
+            return []
+        if not page.spooled:
+            with open(self.spool_path, "a", encoding="utf-8") as spool:
+                for incident in page.incidents:
+                    spool.write(json.dumps(incident, default=str) + "\n")
+                spool.flush()
+                os.fsync(spool.fileno())
+            count = self.manifest.stage("fetch").get("count", 0) + len(page.incidents)
+            self.manifest.update("fetch", last_page=page.number, count=count)
+            logger.info(f"IngestionRunner: Fetched page {page.number} ({count} incidents)")
+
+        # A page re-fetched after new incidents shifted the pages can repeat incidents
+        incidents = [incident for incident in page.incidents if incident["id"] not in self._seen_ids]
+        self._seen_ids.update(incident["id"] for incident in incidents)
+        self._incidents.extend(incidents)
+        if DEDUP_ENABLED:
+            return []
+        self._pending.extend(incidents)
+        batches = []
+        while len(self._pending) >= self.batch_size:
+            batches.append(_Batch(self._next_batch, self._pending[:self.batch_size]))
+            self._pending = self._pending[self.batch_size:]
+            self._next_batch += 1
+        return batches
+
+    def _flush_batches(self) -> list[_Batch]:
+        # A partial batch is only final once every page is in; otherwise a resumed run would extend it
+        if DEDUP_ENABLED or not self._fetch_complete or not self._pending:
+            return []
+        batch = _Batch(self._next_batch, self._pending)
+        self._pending = []
+        self._next_batch += 1
+        return [batch]
+
+    def _truncate_spool(self, count: int) -> None:
+        kept = self._read_spool(count, raw=True)
+        with open(self.spool_path, "w", encoding="utf-8") as f:
+            f.writelines(kept)
+
+    def _read_spool(self, count: int, raw: bool = False) -> list:
+        if not os.path.exists(self.spool_path):
+            return []
+        lines = []
+        with open(self.spool_path, encoding="utf-8") as f:
+            for line in f:
+                if len(lines) == count:
+                    break
+                lines.append(line)
+        return lines if raw else [json.loads(line) for line in lines]
+
+    def embed(self, batch: _Batch) -> _Batch:
+        """
+        The embed stage: embed the new and changed incidents of a batch for every write-target
+        version, or load the batch from the spool if it already was.
+        """
+        if self.manifest.batch_done("write", batch.index):
+            return batch
+        if self.manifest.batch_done("embed", batch.index) and os.path.exists(self._batch_path(batch.index)):
+            with open(self._batch_path(batch.index), "rb") as f:
+                batch.embedded = pickle.load(f)
+        else:
+            embedded = [dict(incident) for incident in batch.incidents]
+            for version in self.versions:
+                self.embedding_model.for_version(version).add_embeddings_to_documents(
+                    embedded, self.storage_format, field=version.field,
+                    stored_hashes=self._stored_hashes.get(version.name))
+            with open(self._batch_path(batch.index), "wb") as f:
+                pickle.dump(embedded, f)
+            changed = sum(1 for incident in embedded if self._embedded_versions(incident))
+            self.manifest.complete_batch("embed", batch.index, items=changed)
+            batch.embedded = embedded
+        batch.changed_ids = {incident["id"] for incident in batch.embedded if self._embedded_versions(incident)}
+        return batch
+
+    def _embedded_versions(self, incident: dict) -> list[EmbeddingVersion]:
+        # Incidents come without embedding fields; versions whose content was unchanged were not embedded
+        return [version for version in self.versions if version.field in incident]
+
+    def write(self, batch: _Batch) -> _Batch:
+        """The write stage: upsert a batch's attributes and the embedding fields of the versions it was embedded for."""
+        if batch.embedded is None:
+            return batch
+        updates = []
+        for incident in batch.embedded:
+            update = self._embedding_update(incident)
+            update["$set"]["duplicate_ids"] = incident.get("duplicate_ids", [])
+            # A former near-duplicate that is now a representative is no longer one
+            update.setdefault("$unset", {})["duplicate_of"] = ""
+            updates.append(UpdateOne({"id": incident["id"]}, update, upsert=True))
+        if updates:
+            self.collection.bulk_write(updates, ordered=False)
+        self.manifest.complete_batch("write", batch.index)
+        if os.path.exists(self._batch_path(batch.index)):
+            os.remove(self._batch_path(batch.index))
+        logger.info(f"IngestionRunner: Wrote batch {batch.index} ({len(updates)} incidents)")
+        batch.embedded = None
+        return batch
+
+    def _embedding_update(self, incident: dict) -> dict:
+        from processors.quantization import embedding_update
+        # Only the versions embedded in this run; the stored fields of the others are left as they are
+        fields = tuple(name for version in self._embedded_versions(incident)
+                       for name in version.fields + (version.hash_field,))
+        update = embedding_update(incident, fields)
+        attributes = {key: value for key, value in incident.items() if key not in self.embedding_fields and key != "_id"}
+        update["$set"] = {**attributes, **update["$set"]}
+        return update
+
+    def write_chunks(self, batch: _Batch) -> None:
+        """
+        The chunks stage: chunk, embed and replace the chunk documents of a batch's new and changed
+        incidents (and of incidents without chunks yet); remove those of their duplicates.
+        """
+        if self.manifest.batch_done("chunks", batch.index):
+            return None
+        chunk_collection = self.database[CHUNK_COLLECTION_NAME]
+        incident_ids = [incident["id"] for incident in batch.incidents]
+        if batch.changed_ids is None:
+            rechunk_ids = set(incident_ids)
+        else:
+            chunked_ids = set(chunk_collection.distinct("incident_id", {"incident_id": {"$in": incident_ids}}))
+            rechunk_ids = batch.changed_ids | (set(incident_ids) - chunked_ids)
+        chunks = [chunk for incident in batch.incidents if incident["id"] in rechunk_ids
+                  for chunk in chunk_incident(incident)]
+        for version in self.versions:
+            self.embedding_model.for_version(version).add_embeddings_to_chunks(
+                chunks, self.storage_format, field=version.field)
+        # A re-chunked description can have fewer chunks, and duplicates have none
+        stale_ids = list(rechunk_ids) + [duplicate_id for incident in batch.incidents
+                                         for duplicate_id in incident.get("duplicate_ids", [])]
+        if stale_ids:
+            chunk_collection.delete_many({"incident_id": {"$in": stale_ids}})
+        if chunks:
+            chunk_collection.insert_many(chunks)
+        self.manifest.complete_batch("chunks", batch.index, items=len(chunks))
+        return None
+
+    def mark_duplicates(self, incidents: list[dict], duplicate_of: dict) -> None:
+        """Store near-duplicates for reference, without embeddings, pointing at their representative."""
+        if self.manifest.stage("duplicates")["done"]:
+            return
+        by_id = {incident["id"]: incident for incident in incidents}
+        updates = [
+            UpdateOne(
+                {"id": duplicate_id},
+                {"$set": {**{key: value for key, value in by_id[duplicate_id].items() if key != "_id"},
+                          "duplicate_of": representative_id},
+                 "$unset": {**{field: "" for field in self.embedding_fields}, "duplicate_ids": ""}},
+                upsert=True,
+            )
+            for duplicate_id, representative_id in duplicate_of.items()
+        ]
+        if updates:
+            self.collection.bulk_write(updates, ordered=False)
+            logger.info(f"IngestionRunner: Marked {len(updates)} near-duplicate incidents with duplicate_of")
+        self.manifest.update("duplicates", done=True)
@@ -0,0 +1,238 @@
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+from utils.admission import BusyError
+from utils.deadline import Deadline
+from utils.metrics import metrics, record_cache_lookup
+from utils.config import JOB_MAX_WORKERS, JOB_MAX_PENDING, JOB_RESULT_TTL_SECONDS, JOB_RESULT_MAX_ENTRIES, REQUEST_DEADLINE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+JOBS_PENDING = metrics.gauge("devops_gpt_jobs_pending", "Analysis jobs queued or running.")
+JOBS_FINISHED = metrics.counter("devops_gpt_jobs_finished_total", "Analysis jobs finished, by status.", ("status",))
+
+
+class JobStatus:
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    REJECTED = "rejected"
+
+
+class QueueFullError(BusyError):
+    """Raised when the job queue already holds its maximum number of pending jobs."""
+
+
+@dataclass
+class Job:
+    id: str
+    key: str
+    query: str
+    run_judge: bool
+    status: str = JobStatus.PENDING
+    stage: str = "queued"
+    progress: int = 0
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    # Starts at submission, so time spent queued counts against the request budget
+    deadline: Deadline = field(default_factory=lambda: Deadline(REQUEST_DEADLINE_SECONDS))
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JobStatus.DONE, JobStatus.FAILED, JobStatus.REJECTED)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            # Seconds until the job's deadline, negative once it has passed; pollers stop waiting after it
+            "deadline_in_s": self.deadline.expires_at - time.monotonic(),
+        }
+
+
+class ResultStore:
+    """
+    In-memory job store with a TTL for finished jobs and LRU eviction.
+
+    Only finished jobs expire or get evicted; in-flight jobs always stay
+    reachable so their callers can keep polling.
+    """
+
+    def __init__(self, ttl_seconds: float = JOB_RESULT_TTL_SECONDS, max_entries: int = JOB_RESULT_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._by_key: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def put(self, job: Job) -> None:
+        with self._lock:
+            self._jobs[job.id] = job
+            self._jobs.move_to_end(job.id)
+            self._by_key[job.key] = job.id
+            self._evict()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._evict()
+            job = self._jobs.get(job_id)
+            if job is not None:
+                self._jobs.move_to_end(job_id)
+            return job
+
+    def find_by_key(self, key: str) -> Optional[Job]:
+        """Return the most recent live job for a dedup key, if any."""
+        with self._lock:
+            self._evict()
+            job_id = self._by_key.get(key)
+            return self._jobs.get(job_id) if job_id else None
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def _expired(self, job: Job, now: float) -> bool:
+        return job.finished and job.finished_at is not None and now - job.finished_at > self.ttl_seconds
+
+    def _evict(self) -> None:
+        now = time.time()
+        for job_id in [job_id for job_id, job in self._jobs.items() if self._expired(job, now)]:
+            self._remove(job_id)
+
+        if len(self._jobs) > self.max_entries:
+            finished_ids = [job_id for job_id, job in self._jobs.items() if job.finished]
+            for job_id in finished_ids[:len(self._jobs) - self.max_entries]:
+                self._remove(job_id)
+
+    def _remove(self, job_id: str) -> None:
+        job = self._jobs.pop(job_id)
+        if self._by_key.get(job.key) == job_id:
+            del self._by_key[job.key]
+
+
+class AnalysisJobQueue:
+    """
+    Runs incident analyses on a bounded worker pool, decoupled from the UI request.
+
+    Callers submit a log, get a job id back immediately and poll for status,
+    progress and the result. Identical in-flight (or recently finished)
+    submissions share one job instead of paying for the pipeline twice.
+    """
+
+    def __init__(self, pipeline_factory: Optional[Callable[[], Any]] = None, max_workers: int = JOB_MAX_WORKERS,
+                 max_pending: int = JOB_MAX_PENDING, store: Optional[ResultStore] = None):
+        self._pipeline_factory = pipeline_factory or self._default_pipeline_factory
+        self._pipeline = None
+        self._pipeline_lock = threading.Lock()
+        self.max_pending = max_pending
+        self.store = store if store is not None else ResultStore()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis-worker")
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _default_pipeline_factory():
+        from processors.analysis_pipeline import AnalysisPipeline
+        return AnalysisPipeline()
+
+    @staticmethod
+    def job_key(query: str, run_judge: bool) -> str:
+        return hashlib.sha256(f"{run_judge}:{query.strip()}".encode("utf-8")).hexdigest()
+
+    def submit(self, query: str, run_judge: bool = True) -> str:
+        """
+        Queue an analysis and return its job id.
+
+        :raises QueueFullError: when max_pending jobs are already waiting or running.
+        """
+        key = self.job_key(query, run_judge)
+        with self._lock:
+            existing = self.store.find_by_key(key)
+            reused = existing is not None and existing.status not in (JobStatus.FAILED, JobStatus.REJECTED)
+            record_cache_lookup("job_queue", reused)
+            if reused:
+                logger.info(f"Job {existing.id} reused for identical submission ({existing.status})")
+                return existing.id
+
+            if self._pending >= self.max_pending:
+                raise QueueFullError(f"Analysis queue is full ({self.max_pending} jobs pending), retry shortly")
+
+            job = Job(id=uuid.uuid4().hex, key=key, query=query, run_judge=run_judge)
+            self.store.put(job)
+            self._pending += 1
+            JOBS_PENDING.set(self._pending)
+
+        self._executor.submit(self._run, job)
+        logger.info(f"Job {job.id} submitted ({self._pending} pending)")
+        return job.id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Return the job's status, stage, progress and (once finished) result, or None if unknown/expired."""
+        job = self.store.get(job_id)
+        return job.to_dict() if job else None
+
+    def wait(self, job_id: str, timeout: Optional[float] = None, poll_interval: float = 0.25) -> Optional[dict]:
+        """Block until the job finishes (or the timeout passes) and return its latest state."""
+        deadline = time.time() + timeout if timeout is not None else None
+        while True:
+            state = self.get(job_id)
+            if state is None or state["status"] in (JobStatus.DONE, JobStatus.FAILED, JobStatus.REJECTED):
+                return state
+            if deadline is not None and time.time() >= deadline:
+                return state
+            time.sleep(poll_interval)
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+    def _get_pipeline(self):
+        with self._pipeline_lock:
+            if self._pipeline is None:
+                self._pipeline = self._pipeline_factory()
+            return self._pipeline
+
+    def _run(self, job: Job) -> None:
+        def _progress(stage: str, percent: int):
+            job.stage = stage
+            job.progress = percent
+
+        job.status = JobStatus.RUNNING
+        job.started_at = time.time()
+        try:
+            job.result = self._get_pipeline().run(job.query, run_judge=job.run_judge, progress=_progress, deadline=job.deadline)
+            job.status = JobStatus.DONE
+        except BusyError as e:
+            logger.warning(f"Job {job.id} shed by admission control: {e}")
+            job.error = str(e)
+            job.status = JobStatus.REJECTED
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}", exc_info=True)
+            job.error = str(e)
+            job.status = JobStatus.FAILED
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._pending -= 1
+                JOBS_PENDING.set(self._pending)
+            JOBS_FINISHED.inc(status=job.status)
+            logger.info(f"Job {job.id} {job.status} in {job.finished_at - job.started_at:.2f} seconds")
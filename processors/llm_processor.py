@@ -1,43 +1,191 @@
 from processors.rc_prompt import ROOTCAUSE_PROMPT
+from processors.log_compression import compress_for_model
 import re
-from baml_client import b
-from baml_client.types import RootCauseAnalysis
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import TYPE_CHECKING, Callable, Optional
+from utils.admission import BusyError, admission
+from utils.config import (
+    CLUSTER_REFINE_DEADLINE_SECONDS, CLUSTER_REFINE_IN_BACKGROUND, CLUSTER_REFINE_MAX_PENDING, CLUSTER_REFINE_WORKERS,
+    LLM_MIN_BUDGET_SECONDS,
+)
+from utils.deadline import Deadline, await_with_deadline, call_with_deadline
+from utils.metrics import record_cache_lookup, track_stage
+
+if TYPE_CHECKING:
+    from baml_client.types import RootCauseAnalysis
+    from processors.clustering import IncidentClusters
+
+logger = logging.getLogger(__name__)
 
 class LLMProcessor:
-    def __init__(self):
+    def __init__(self, baml_client=None, baml_async_client=None, clusters: Optional["IncidentClusters"] = None,
+                 refine_in_background: bool = CLUSTER_REFINE_IN_BACKGROUND):
+        """
+        :param clusters: Incident clusters with precomputed analyses (processors.clustering); a query that lands
+                         confidently in one is answered with its cached analysis instead of an LLM call.
+        :param refine_in_background: After answering from a cluster, run the full analysis on a background
+                                     thread and hand it to the caller's on_refined callback. Refinements only
+                                     take a free LLM slot, never queue for one, and are dropped beyond
+                                     CLUSTER_REFINE_MAX_PENDING.
+        """
         # The BAML client is initialized automatically                                                     
         # and retrieves the API key from the environment.                                                  
-        pass
+        # A client built with b.with_options(...) can be injected to route calls elsewhere.
+        # baml_client parses every .baml file on import, so it is loaded here rather than at module import.
+        if baml_client is None:
+            from baml_client import b
+            baml_client = b
+        self.client = baml_client
+        # BamlAsyncClient for aget_llm_response, loaded on first async call
+        self.async_client = baml_async_client
+        self.clusters = clusters
+        self.refine_in_background = refine_in_background
+        # Background refinements of cached cluster analyses
+        self._refinements = (ThreadPoolExecutor(max_workers=CLUSTER_REFINE_WORKERS, thread_name_prefix="llm-refine")
+                             if refine_in_background else None)
+        self._refines_pending = 0
+        self._refines_lock = threading.Lock()
 
-    def get_llm_response(self, query: str, incident_texts: list[str]) -> str:
+    def get_llm_response(self, query: str, incident_texts: list[str], deadline: Optional[Deadline] = None,
+                         query_embedding=None, embedding_field: str = "embedding",
+                         on_refined: Optional[Callable[[str], None]] = None) -> str:
         """
         Generate a response from the LLM based on the new incident and similar past incidents.
 
-        :param query: The new incident description.
+        :param query: The new incident description; long pasted logs are sent as compressed templates.
         :param incident_texts: List of similar past incidents.
+        :param deadline: Optional request deadline; raises DeadlineExceeded rather than overrunning it.
+        :param query_embedding: The query's embedding in embedding_field, to look up a cached cluster analysis.
+        :param on_refined: Receives the full LLM response, computed in the background, when a cached cluster
+                           analysis was returned.
         :return: LLM's response containing root cause summary and troubleshooting steps.
         """
+        cached = self.cached_response(query, incident_texts, query_embedding, embedding_field, on_refined)
+        if cached is not None:
+            return cached
+        if deadline is not None:
+            deadline.check("llm", needed=LLM_MIN_BUDGET_SECONDS)
+        return self._build_response(self.analyze_incident(query, incident_texts, deadline), query)
+
+    def analyze_incident(self, query: str, incident_texts: list[str], deadline: Optional[Deadline] = None,
+                         queue_timeout: Optional[float] = None) -> "RootCauseAnalysis":
+        """
+        The AnalyzeIncident call behind get_llm_response(), returning BAML's RootCauseAnalysis.
+
+        :param queue_timeout: Longest wait for an LLM admission slot (default: the deadline's remaining budget).
+        """
+        similar_incidents_str = self._format_incidents(incident_texts)
+        prompt_query = compress_for_model(query)
+
+        if queue_timeout is None and deadline is not None:
+            queue_timeout = deadline.timeout()
+        with admission.limit("llm", timeout=queue_timeout), track_stage("llm"):
+            return call_with_deadline(
+                lambda: self.client.AnalyzeIncident(
+                    query=prompt_query,
+                    similar_incidents_str=similar_incidents_str
+                ),
+                deadline,
+                "llm",
+            )
+
+    def cached_response(self, query: str, incident_texts: list[str], query_embedding=None,
+                        embedding_field: str = "embedding",
+                        on_refined: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        """
+        The precomputed analysis of the cluster the query lands in, or None when it is not confidently in one.
+        With on_refined, the full analysis is then computed in the background and passed to it.
+        """
+        if self.clusters is None or query_embedding is None:
+            return None
+        match = self.clusters.match(query_embedding, embedding_field)
+        record_cache_lookup("cluster_analysis", match is not None)
+        if match is None:
+            return None
+        logger.info(f"LLMProcessor: Query matched cluster {match['cluster']} "
+                    f"({match['size']} incidents, similarity {match['similarity']:.3f}); serving its cached analysis")
+        if on_refined is not None and self._refinements is not None:
+            self._refine(query, incident_texts, on_refined)
+        analysis = match["analysis"]
+        response = self._render(analysis["root_cause_summary"], analysis["troubleshooting_steps"])
+        return (f"{response}\n\n_Precomputed analysis of a recurring failure mode seen in {match['size']} past "
+                f"incidents (similarity {match['similarity']:.2f})._")
+
+    def _refine(self, query: str, incident_texts: list[str], on_refined: Callable[[str], None]) -> None:
+        with self._refines_lock:
+            if self._refines_pending >= CLUSTER_REFINE_MAX_PENDING:
+                logger.info(f"LLMProcessor: {self._refines_pending} refinements pending, not refining this answer")
+                return
+            self._refines_pending += 1
+        # Starts at submission, so time spent queued counts against the refinement's budget
+        deadline = Deadline(CLUSTER_REFINE_DEADLINE_SECONDS)
+
+        def _run():
+            try:
+                deadline.check("llm", needed=LLM_MIN_BUDGET_SECONDS)
+                # Only a free slot: refinements must not queue ahead of (or shrink the limit for) live requests
+                on_refined(self._build_response(self.analyze_incident(query, incident_texts, deadline, queue_timeout=0), query))
+            except BusyError:
+                logger.info("LLMProcessor: No free LLM slot, background refinement skipped")
+            except Exception as e:
+                logger.warning(f"LLMProcessor: Background refinement failed: {e}")
+            finally:
+                with self._refines_lock:
+                    self._refines_pending -= 1
+
+        self._refinements.submit(_run)
+
+    async def aget_llm_response(self, query: str, incident_texts: list[str], deadline: Optional[Deadline] = None,
+                                query_embedding=None, embedding_field: str = "embedding",
+                                on_refined: Optional[Callable[[str], None]] = None) -> str:
+        """
+        Async get_llm_response() on BamlAsyncClient; the event loop is free while the LLM call is in flight.
+        Background refinements of cached cluster analyses run on a thread with the sync client.
+        """
+        cached = self.cached_response(query, incident_texts, query_embedding, embedding_field, on_refined)
+        if cached is not None:
+            return cached
+        if deadline is not None:
+            deadline.check("llm", needed=LLM_MIN_BUDGET_SECONDS)
+        if self.async_client is None:
+            from baml_client.async_client import b as async_b
+            self.async_client = async_b
+
+        similar_incidents_str = self._format_incidents(incident_texts)
+        prompt_query = compress_for_model(query)
+        queue_timeout = deadline.timeout() if deadline is not None else None
+        async with admission.alimit("llm", timeout=queue_timeout):
+            with track_stage("llm"):
+                baml_response = await await_with_deadline(
+                    self.async_client.AnalyzeIncident(query=prompt_query, similar_incidents_str=similar_incidents_str),
+                    deadline,
+                    "llm",
+                )
+        return self._build_response(baml_response, query)
+
+    @staticmethod
+    def _format_incidents(incident_texts: list[str]) -> str:
         # add <incident> tags to each incident text
-        similar_incidents_str = "\n\n".join(
+        return "\n\n".join(
             [f"<incident>{text}</incident>" for text in incident_texts]
         )
 
-        baml_response = b.AnalyzeIncident(
-            query=query,
-            similar_incidents_str=similar_incidents_str
-        )
-        
+    def _build_response(self, baml_response: "RootCauseAnalysis", query: str) -> str:
+        """Log the model's reasoning and turn the BAML object into the formatted markdown response."""
         # Log the reasoning using the BAML-specific function                                           
         self._log_reasoning_baml(baml_response, query)
-        
-        # Construct the response string from the BAML object                
+        return self._render(baml_response.root_cause_summary, baml_response.troubleshooting_steps)
+
+    def _render(self, root_cause_summary: str, troubleshooting_steps: list[str]) -> str:
+        """The formatted markdown response for a root cause summary and its troubleshooting steps."""
         # Join troubleshooting steps with newlines to preserve their original formatting
-        troubleshooting_steps_formatted = "\n".join(baml_response.troubleshooting_steps)
+        troubleshooting_steps_formatted = "\n".join(troubleshooting_steps)
         
         raw_response = f"""<root_cause_summary>
-{baml_response.root_cause_summary}
+{root_cause_summary}
 </root_cause_summary>
 
 <troubleshooting_steps>
@@ -46,7 +194,7 @@ class LLMProcessor:
         
         return self.format_llm_response(raw_response)
     
-    def _log_reasoning_baml(self, response: RootCauseAnalysis, query: str) -> None:                        
+    def _log_reasoning_baml(self, response: "RootCauseAnalysis", query: str) -> None:                        
         """Extract and log the reasoning from the BAML object for debugging purposes."""                   
         logging.basicConfig(                                                                               
             filename='llm_reasoning.log',                                                                  
@@ -0,0 +1,292 @@
+import logging
+import threading
+from typing import TYPE_CHECKING, Optional
+import numpy as np
+from processors.projection import EmbeddingProjection
+from processors.quantization import (
+    EMBEDDING_FIELDS, binary_quantize, decode_embedding, embedding_fields, hamming_distances, int8_quantize,
+)
+from utils.config import BINARY_RESCORE_CANDIDATES, LOCAL_INDEX_DTYPE, TWO_STAGE_CANDIDATES
+
+if TYPE_CHECKING:
+    from pymongo.collection import Collection
+    from processors.snapshot import CorpusSnapshot
+
+logger = logging.getLogger(__name__)
+
+# Fields kept per document; the same ones UserQueryProcessor projects from $vectorSearch
+DOCUMENT_FIELDS = ("id", "title", "description")
+INDEX_DTYPES = ("float32", "float16", "int8", "binary")
+# Rows converted to float32 at a time when scoring a compressed matrix
+_SCORE_CHUNK_ROWS = 8192
+
+
+class LocalVectorIndex:
+    """
+    In-memory exact cosine-similarity index over the incident embeddings.
+
+    Scores many queries at once with one matrix multiply, which is much
+    cheaper than one Atlas $vectorSearch round trip per query when a batch of
+    logs has to be matched against the same corpus.
+
+    Vectors can be held compressed: float16 (2x smaller), int8 with a
+    per-vector scale (4x), or binary (32x for the first pass, Hamming
+    distance) with an int8 copy used only to rescore the best candidates.
+
+    With a projection, search is two-stage: a matrix multiply over the reduced
+    vectors shortlists TWO_STAGE_CANDIDATES per query, which are then reranked
+    with the full-dimension vectors (held in dtype).
+
+    The index can be updated in place (see processors.index_sync): upsert()
+    appends rows and delete() only marks them as tombstones, which search
+    skips; compact() drops the tombstoned rows.
+
+    :param documents: Incident documents (only id, title and description are kept).
+    :param embeddings: One embedding per document, shape (n_documents, dim).
+    :param dtype: In-memory vector format, one of INDEX_DTYPES.
+    :param projection: Optional EmbeddingProjection for the first stage.
+    :param keys: Key of each document for upsert() and delete() (default: its row number).
+    :param field: Embedding field the vectors were loaded from (see processors.embedding_versions).
+    """
+
+    def __init__(self, documents: list[dict], embeddings: np.ndarray, dtype: str = LOCAL_INDEX_DTYPE,
+                 projection: Optional[EmbeddingProjection] = None, keys: Optional[list] = None,
+                 field: str = "embedding"):
+        if dtype not in INDEX_DTYPES:
+            raise ValueError(f"Unknown index dtype: {dtype} (expected one of {INDEX_DTYPES})")
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if len(documents) != len(embeddings):
+            raise ValueError(f"{len(documents)} documents but {len(embeddings)} embeddings")
+        self.documents = [{field: doc.get(field) for field in DOCUMENT_FIELDS} for doc in documents]
+        self.dtype = dtype
+        self.projection = projection
+        self.field = field
+        self._keys = list(keys) if keys is not None else list(range(len(self.documents)))
+        self._positions = {key: row for row, key in enumerate(self._keys)}
+        self._live = np.ones(len(self.documents), dtype=bool)
+        self._lock = threading.RLock()
+        self._vectors, self._scales, self._bits, self._reduced = self._encode(embeddings)
+
+    def _encode(self, embeddings: np.ndarray) -> tuple:
+        """(vectors, scales, bits, reduced) rows for float32 embeddings, in the index's dtype."""
+        normalized = self._normalize(np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1))
+        scales, bits = None, None
+        if self.dtype == "float32":
+            vectors = normalized
+        elif self.dtype == "float16":
+            vectors = normalized.astype(np.float16)
+        else:
+            vectors, scales = int8_quantize(normalized)
+            if self.dtype == "binary":
+                bits = binary_quantize(normalized)
+        reduced = self.projection.transform(normalized) if self.projection is not None else None
+        return vectors, scales, bits, reduced
+
+    @classmethod
+    def from_collection(cls, collection: "Collection", dtype: str = LOCAL_INDEX_DTYPE,
+                        projection: Optional[EmbeddingProjection] = None, field: str = "embedding") -> "LocalVectorIndex":
+        """
+        Load every embedded incident from the Atlas collection, whatever its storage format.
+
+        :param field: Embedding field to load, e.g. an EmbeddingVersion's field.
+        """
+        fields = {name: 1 for name in ("_id",) + embedding_fields(field) + DOCUMENT_FIELDS}
+        documents, embeddings = [], []
+        for doc in collection.find({field: {"$exists": True}}, fields):
+            embeddings.append(stored_embedding(doc, field))
+            documents.append(doc)
+        logger.info(f"LocalVectorIndex: Loaded {len(documents)} incidents")
+        # Keyed by _id, which is all a change stream's delete events carry
+        return cls(documents, np.array(embeddings, dtype=np.float32).reshape(len(documents), -1),
+                   dtype=dtype, projection=projection, keys=[doc["_id"] for doc in documents], field=field)
+
+    @classmethod
+    def from_snapshot(cls, snapshot: "CorpusSnapshot",
+                      projection: Optional[EmbeddingProjection] = None) -> "LocalVectorIndex":
+        """
+        An index over a memory-mapped CorpusSnapshot, without copying its vectors or texts: they
+        stay in the shared page cache. Only the reduced vectors of a projection are computed.
+        The first upsert() or compact() copies the index into process memory.
+        """
+        index = cls.__new__(cls)
+        index.documents = snapshot.documents
+        index.dtype = snapshot.dtype
+        index.projection = projection
+        index.field = snapshot.field
+        keys = snapshot.object_ids()
+        index._keys = keys if keys is not None else list(range(snapshot.count))
+        index._positions = {key: row for row, key in enumerate(index._keys)}
+        index._live = np.ones(snapshot.count, dtype=bool)
+        index._lock = threading.RLock()
+        index._vectors, index._scales, index._bits = snapshot.vectors, snapshot.scales, snapshot.bits
+        index._reduced = None
+        if projection is not None:
+            rows = np.arange(snapshot.count)
+            index._reduced = np.concatenate([projection.transform(index.vectors(rows[start:start + _SCORE_CHUNK_ROWS]))
+                                             for start in range(0, max(snapshot.count, 1), _SCORE_CHUNK_ROWS)])
+        logger.info(f"LocalVectorIndex: Mapped {snapshot.count} incidents from {snapshot.path}")
+        return index
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return matrix / np.where(norms == 0, 1.0, norms)
+
+    def __len__(self) -> int:
+        """Live documents (tombstoned rows are not counted)."""
+        return len(self._positions)
+
+    @property
+    def tombstones(self) -> int:
+        return len(self.documents) - len(self._positions)
+
+    def __contains__(self, key) -> bool:
+        return key in self._positions
+
+    def upsert(self, documents: list[dict], embeddings: np.ndarray, keys: list) -> None:
+        """Add documents, replacing (tombstoning) the current rows of keys already in the index."""
+        if len(documents) != len(embeddings) or len(documents) != len(keys):
+            raise ValueError(f"{len(documents)} documents, {len(embeddings)} embeddings and {len(keys)} keys")
+        if not documents:
+            return
+        vectors, scales, bits, reduced = self._encode(embeddings)
+        with self._lock:
+            self.delete(keys)
+            start = len(self.documents)
+            self._vectors = np.concatenate([self._vectors, vectors])
+            if scales is not None:
+                self._scales = np.concatenate([self._scales, scales])
+            if bits is not None:
+                self._bits = np.concatenate([self._bits, bits])
+            if reduced is not None:
+                self._reduced = np.concatenate([self._reduced, reduced])
+            if not isinstance(self.documents, list):
+                # Snapshot-backed documents are read-only
+                self.documents = list(self.documents)
+            self.documents.extend({field: doc.get(field) for field in DOCUMENT_FIELDS} for doc in documents)
+            self._keys.extend(keys)
+            self._live = np.concatenate([self._live, np.ones(len(documents), dtype=bool)])
+            # A key repeated within the batch keeps its last row
+            for offset, key in enumerate(keys):
+                if key in self._positions:
+                    self._live[self._positions[key]] = False
+                self._positions[key] = start + offset
+
+    def delete(self, keys: list) -> int:
+        """Tombstone the rows of keys; unknown keys are ignored. Returns the rows removed."""
+        with self._lock:
+            rows = [self._positions.pop(key) for key in keys if key in self._positions]
+            self._live[rows] = False
+            return len(rows)
+
+    def compact(self) -> int:
+        """Drop tombstoned rows. Returns the rows dropped."""
+        with self._lock:
+            dropped = self.tombstones
+            if not dropped:
+                return 0
+            keep = np.flatnonzero(self._live)
+            self._vectors = self._vectors[keep]
+            self._scales = self._scales[keep] if self._scales is not None else None
+            self._bits = self._bits[keep] if self._bits is not None else None
+            self._reduced = self._reduced[keep] if self._reduced is not None else None
+            self.documents = [self.documents[row] for row in keep]
+            self._keys = [self._keys[row] for row in keep]
+            self._positions = {key: row for row, key in enumerate(self._keys)}
+            self._live = np.ones(len(keep), dtype=bool)
+        logger.info(f"LocalVectorIndex: Compacted {dropped} tombstoned rows, {len(self)} live")
+        return dropped
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the vectors (first-stage and rescoring copies)."""
+        arrays = (self._vectors, self._scales, self._bits, self._reduced)
+        return sum(array.nbytes for array in arrays if array is not None)
+
+    def vectors(self, indices) -> np.ndarray:
+        """Rows decoded to float32 (approximately unit-length for the quantized dtypes)."""
+        rows = self._vectors[indices].astype(np.float32)
+        if self._scales is not None:
+            rows *= self._scales[indices][..., np.newaxis]
+        return rows
+
+    def _scores(self, queries: np.ndarray, rows=slice(None)) -> np.ndarray:
+        """Cosine scores of normalized queries against the given rows, decoding compressed rows in chunks."""
+        if self.dtype == "float32":
+            return queries @ self._vectors[rows].T
+        indices = np.arange(len(self.documents))[rows]
+        scores = np.empty((len(queries), len(indices)), dtype=np.float32)
+        for start in range(0, len(indices), _SCORE_CHUNK_ROWS):
+            chunk = indices[start:start + _SCORE_CHUNK_ROWS]
+            scores[:, start:start + len(chunk)] = queries @ self.vectors(chunk).T
+        return scores
+
+    def search(self, query_embeddings: np.ndarray, k: int = 5, return_embeddings: bool = False) -> list[list[dict]]:
+        """
+        Top-k most similar incidents for each query.
+
+        :param query_embeddings: Shape (n_queries, dim), or (dim,) for a single query.
+        :param k: Results per query.
+        :param return_embeddings: Include each document's (normalized) "embedding", e.g. for MMR.
+        :return: One list per query of documents with a "score" (cosine similarity), best first.
+        """
+        queries = self._normalize(np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)))
+        with self._lock:
+            return self._search(queries, k, return_embeddings)
+
+    def _search(self, queries: np.ndarray, k: int, return_embeddings: bool) -> list[list[dict]]:
+        if len(self) == 0:
+            return [[] for _ in range(len(queries))]
+        k = min(k, len(self))
+
+        results = []
+        if self._reduced is not None or self.dtype == "binary":
+            # Two stages: shortlist with the reduced vectors (or Hamming distance on the sign bits),
+            # then rerank the shortlist with the full-dimension vectors
+            for query, candidates in zip(queries, self._shortlist(queries, k)):
+                candidate_scores = self._scores(query[np.newaxis, :], candidates)[0]
+                best = np.argsort(-candidate_scores)[:k]
+                results.append(self._matches(candidates[best], candidate_scores[best], return_embeddings))
+            return results
+
+        scores = self._scores(queries)
+        if self.tombstones:
+            scores[:, ~self._live] = -np.inf
+        # argpartition finds the k best in O(n); only those k are sorted
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        for row, candidates in enumerate(top):
+            ranked = candidates[np.argsort(-scores[row, candidates])]
+            results.append(self._matches(ranked, scores[row, ranked], return_embeddings))
+        return results
+
+    def _shortlist(self, queries: np.ndarray, k: int) -> np.ndarray:
+        """First-stage candidate indices per query, shape (n_queries, n_candidates), unordered."""
+        if self._reduced is not None:
+            n_candidates = min(len(self), max(k, TWO_STAGE_CANDIDATES))
+            coarse_scores = self.projection.transform(queries) @ self._reduced.T
+            if self.tombstones:
+                coarse_scores[:, ~self._live] = -np.inf
+            return np.argpartition(-coarse_scores, n_candidates - 1, axis=1)[:, :n_candidates]
+        n_candidates = min(len(self), max(k, BINARY_RESCORE_CANDIDATES))
+        query_bits = binary_quantize(queries)
+        distances = np.array([hamming_distances(bits, self._bits) for bits in query_bits])
+        if self.tombstones:
+            distances[:, ~self._live] = np.iinfo(distances.dtype).max
+        return np.argpartition(distances, n_candidates - 1, axis=1)[:, :n_candidates]
+
+    def _matches(self, indices: np.ndarray, scores: np.ndarray, return_embeddings: bool) -> list[dict]:
+        matches = [dict(self.documents[index], score=float(score)) for index, score in zip(indices, scores)]
+        if return_embeddings:
+            for match, vector in zip(matches, self.vectors(indices)):
+                match["embedding"] = vector
+        return matches
+
+
+def stored_embedding(document: dict, field: str = "embedding") -> Optional[np.ndarray]:
+    """
+    Float32 embedding of a stored incident in a (versioned) embedding field; the stored fields are
+    removed from the document. None if the document has no embedding in that field.
+    """
+    stored = {name: document.pop(versioned) for name, versioned in zip(EMBEDDING_FIELDS, embedding_fields(field))
+              if versioned in document}
+    return decode_embedding(stored)
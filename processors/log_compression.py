@@ -0,0 +1,262 @@
+"""
+Compression of pasted logs before they are embedded and put into the prompt.
+
+Raw logs are mostly the same few lines repeated with different timestamps,
+ids and counters. A Drain-style template miner groups lines into templates
+in one streaming pass: variable tokens are masked (<TS>, <IP>, <NUM>, ...)
+or become <*> where lines of a template differ. The compressed log lists each
+template once with its count and a summary of its variable values. Rare lines
+and the first example of every error-like template are kept verbatim, since
+those are usually what the analysis needs.
+
+Drain: He et al., "Drain: An Online Log Parsing Approach with Fixed Depth Tree" (ICWS 2017).
+"""
+import logging
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable, Optional
+from utils.config import (
+    DRAIN_DEPTH, DRAIN_MAX_CHILDREN, DRAIN_SIMILARITY_THRESHOLD, LOG_COMPRESSION_ENABLED,
+    LOG_COMPRESSION_MAX_TEMPLATES, LOG_COMPRESSION_MAX_VERBATIM, LOG_COMPRESSION_MIN_LINES,
+)
+from utils.metrics import track_stage
+
+logger = logging.getLogger(__name__)
+
+WILDCARD = "<*>"
+# Applied to each token in order; every pattern needs a digit, so tokens without one skip masking
+_MASKS = [
+    ("TS", re.compile(r"\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?)?"
+                      r"|\d{2}:\d{2}:\d{2}(?:[.,]\d+)?")),
+    ("UUID", re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")),
+    ("IP", re.compile(r"\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?")),
+    ("HEX", re.compile(r"0x[0-9a-fA-F]+|(?<![0-9A-Za-z])(?=[0-9a-fA-F]*[a-fA-F])[0-9a-fA-F]{10,}(?![0-9A-Za-z])")),
+    ("NUM", re.compile(r"(?<![0-9A-Za-z<.])[-+]?\d+(?:\.\d+)?")),
+]
+_DIGIT = re.compile(r"\d")
+_ERROR_PATTERN = re.compile(
+    r"\b(?:error|err|exception|fail(?:ed|ure|s)?|fatal|panic|critical|crit|traceback|timeout|timed out|"
+    r"refused|denied|unavailable|unreachable|oom|killed|abort(?:ed)?|crash(?:ed)?)\b", re.IGNORECASE)
+# Lines seen at most this often are kept verbatim
+_RARE_COUNT = 1
+_MAX_LINE_CHARS = 500
+_MAX_SAMPLES = 3
+_MAX_DISTINCT = 256
+
+
+@lru_cache(maxsize=4096)
+def mask_token(token: str) -> str:
+    """The token with its variable parts (timestamps, ids, addresses, numbers) replaced by <NAME> placeholders."""
+    if not _DIGIT.search(token):
+        return token
+    for name, pattern in _MASKS:
+        token = pattern.sub(f"<{name}>", token)
+    return token
+
+
+def _is_variable(token: str) -> bool:
+    return "<" in token and (token == WILDCARD or any(f"<{name}>" in token for name, _ in _MASKS))
+
+
+class _VariableSummary:
+    """Bounded summary of the values one template position took: first/last, a few samples, distinct count."""
+
+    __slots__ = ("first", "last", "samples", "distinct")
+
+    def __init__(self, value: str):
+        self.first = self.last = value
+        self.samples = [value]
+        self.distinct = {value}
+
+    def add(self, value: str) -> None:
+        self.last = value
+        if len(self.distinct) < _MAX_DISTINCT:
+            self.distinct.add(value)
+        if len(self.samples) < _MAX_SAMPLES and value not in self.samples:
+            self.samples.append(value)
+
+    def render(self, is_timestamp: bool) -> str:
+        if len(self.distinct) == 1:
+            return self.first
+        if is_timestamp:
+            return f"{self.first} .. {self.last}"
+        more = len(self.distinct) - len(self.samples)
+        suffix = f" (+{more}{'+' if len(self.distinct) >= _MAX_DISTINCT else ''} more)" if more > 0 else ""
+        return ", ".join(self.samples) + suffix
+
+
+class LogCluster:
+    """One template: its tokens, line count, first example, and per-position variable summaries."""
+
+    __slots__ = ("template", "count", "first_index", "first_tokens", "error_line", "variables")
+
+    def __init__(self, masked: list[str], tokens: list[str], index: int, line: str):
+        self.template = list(masked)
+        self.count = 1
+        self.first_index = index
+        self.first_tokens = tokens
+        self.error_line = line if _ERROR_PATTERN.search(line) else None
+        self.variables: dict[int, _VariableSummary] = {
+            position: _VariableSummary(tokens[position]) for position, token in enumerate(masked) if _is_variable(token)
+        }
+
+    def similarity(self, masked: list[str]) -> float:
+        return sum(1 for a, b in zip(self.template, masked) if a == b and a != WILDCARD) / len(masked)
+
+    def add(self, masked: list[str], tokens: list[str], line: str) -> None:
+        self.count += 1
+        for position, (template_token, token) in enumerate(zip(self.template, masked)):
+            if template_token != token and template_token != WILDCARD:
+                self.template[position] = WILDCARD
+                if position not in self.variables:
+                    self.variables[position] = _VariableSummary(self.first_tokens[position])
+            if position in self.variables:
+                self.variables[position].add(tokens[position])
+        # The template's fixed tokens were checked with the first line; only <*> values can differ
+        if self.error_line is None and any(
+                _ERROR_PATTERN.search(tokens[position]) for position, token in enumerate(self.template) if token == WILDCARD):
+            self.error_line = line
+
+    def render(self) -> str:
+        summaries = [
+            self.variables[position].render(self.template[position] == "<TS>")
+            for position in sorted(self.variables)
+        ]
+        summary = "  {" + "; ".join(summaries) + "}" if summaries else ""
+        return _truncate(f"[x{self.count}] {' '.join(self.template)}{summary}")
+
+
+def _truncate(line: str) -> str:
+    return line if len(line) <= _MAX_LINE_CHARS else line[:_MAX_LINE_CHARS] + " ..."
+
+
+class LogTemplateMiner:
+    """
+    Streaming Drain parser: lines are routed through a fixed-depth tree (token count, then the
+    first depth - 2 tokens) to a short list of templates and merged into the most similar one.
+
+    :param depth: Tree depth; depth - 2 leading tokens are used to route a line.
+    :param similarity_threshold: Fraction of equal tokens needed to join an existing template.
+    :param max_children: Routing tokens per tree node before further tokens share a <*> branch.
+    """
+
+    def __init__(self, depth: int = DRAIN_DEPTH, similarity_threshold: float = DRAIN_SIMILARITY_THRESHOLD,
+                 max_children: int = DRAIN_MAX_CHILDREN):
+        self.depth = depth
+        self.similarity_threshold = similarity_threshold
+        self.max_children = max_children
+        self._root: dict = {}
+        self.clusters: list[LogCluster] = []
+        self.line_count = 0
+        self.char_count = 0
+
+    def add_line(self, line: str) -> Optional[LogCluster]:
+        """Parse one line into its template; blank lines are ignored."""
+        line = line.rstrip()
+        tokens = line.split()
+        if not tokens:
+            return None
+        self.line_count += 1
+        self.char_count += len(line) + 1
+        masked = [mask_token(token) for token in tokens]
+
+        leaf = self._leaf(masked)
+        best, best_similarity = None, -1.0
+        for cluster in leaf:
+            similarity = cluster.similarity(masked)
+            if similarity > best_similarity:
+                best, best_similarity = cluster, similarity
+        if best is not None and best_similarity >= self.similarity_threshold:
+            best.add(masked, tokens, line)
+            return best
+        cluster = LogCluster(masked, tokens, self.line_count - 1, line)
+        leaf.append(cluster)
+        self.clusters.append(cluster)
+        return cluster
+
+    def add_lines(self, lines: Iterable[str]) -> "LogTemplateMiner":
+        for line in lines:
+            self.add_line(line)
+        return self
+
+    def _leaf(self, masked: list[str]) -> list[LogCluster]:
+        node = self._root.setdefault(len(masked), {})
+        for token in masked[:max(0, self.depth - 2)]:
+            key = WILDCARD if _is_variable(token) else token
+            if key not in node and len(node) >= self.max_children:
+                key = WILDCARD
+            node = node.setdefault(key, {})
+        return node.setdefault(None, [])
+
+    def render(self, max_templates: int = LOG_COMPRESSION_MAX_TEMPLATES,
+               max_verbatim: int = LOG_COMPRESSION_MAX_VERBATIM) -> str:
+        """
+        The compressed log: templates in order of first appearance, with rare lines and the first
+        error-like line of each template verbatim. Over the limits, error-like templates are kept
+        first, then the rarest ones.
+        """
+        # Error templates first, then rare before frequent: the repeated noise is what gets dropped
+        ranked = sorted(self.clusters, key=lambda c: (c.error_line is None, c.count, c.first_index))
+        kept, verbatim_budget = OrderedDict(), max_verbatim
+        for cluster in ranked[:max_templates]:
+            lines = []
+            if cluster.count <= _RARE_COUNT and verbatim_budget > 0:
+                lines.append(_truncate(" ".join(cluster.first_tokens)))
+                verbatim_budget -= 1
+            else:
+                lines.append(cluster.render())
+                if cluster.error_line is not None and verbatim_budget > 0:
+                    lines.append("  e.g. " + _truncate(cluster.error_line))
+                    verbatim_budget -= 1
+            kept[cluster.first_index] = lines
+
+        header = (f"[Log compressed: {self.line_count} lines -> {len(self.clusters)} templates. "
+                  f"[xN] lines are templates seen N times, with <*>/<TS>/<NUM>/... placeholders and "
+                  f"their values in {{}}; other lines are verbatim.]")
+        body = [line for first_index in sorted(kept) for line in kept[first_index]]
+        dropped = len(self.clusters) - len(kept)
+        if dropped > 0:
+            dropped_lines = sum(c.count for c in ranked[max_templates:])
+            body.append(f"[... {dropped} more frequent templates ({dropped_lines} lines) omitted]")
+        return "\n".join([header, *body])
+
+
+@dataclass
+class CompressedLog:
+    text: str
+    input_lines: int
+    input_chars: int
+    templates: int
+
+    @property
+    def ratio(self) -> float:
+        """Input size over output size (>1 means smaller)."""
+        return self.input_chars / max(1, len(self.text))
+
+
+def compress_log(log: "str | Iterable[str]", **render_options) -> CompressedLog:
+    """Mine templates from a log (a string or an iterable of lines, e.g. an open file) and render it compressed."""
+    lines = log.splitlines() if isinstance(log, str) else log
+    miner = LogTemplateMiner().add_lines(lines)
+    return CompressedLog(miner.render(**render_options), miner.line_count, miner.char_count, len(miner.clusters))
+
+
+# Small: entries can be megabyte-sized pasted logs
+@lru_cache(maxsize=8)
+def compress_for_model(text: str) -> str:
+    """
+    The text to embed and prompt with: the compressed log when compression is enabled, the
+    input has at least LOG_COMPRESSION_MIN_LINES lines and compressing makes it smaller;
+    otherwise the text unchanged. Cached, since retrieval and the LLM call compress the same query.
+    """
+    if not LOG_COMPRESSION_ENABLED or text.count("\n") + 1 < LOG_COMPRESSION_MIN_LINES:
+        return text
+    with track_stage("log_compression"):
+        compressed = compress_log(text)
+    if len(compressed.text) >= len(text):
+        return text
+    logger.info(f"Compressed log from {compressed.input_lines} lines / {compressed.input_chars} chars to "
+                f"{compressed.templates} templates / {len(compressed.text)} chars ({compressed.ratio:.1f}x)")
+    return compressed.text
@@ -1,77 +1,61 @@
-from connectors.gitlab_connection import GitlabConnection
-import os
-import pickle
+import argparse
+import logging
+import sys
 from connectors.atlas_connection import AtlasConnection
 from processors.embeddings import EmbeddingModel
+from processors.ingestion import IngestionRunner
 from processors.user_query_processor import UserQueryProcessor
 from processors.llm_processor import LLMProcessor
-from utils.secrets_helper import get_secret
-from utils.config import DB_NAME, COLLECTION_NAME, INCIDENTS_PATH
-# Gitlab connectionp
-
-
-if not os.path.exists(INCIDENTS_PATH):
-    gl = GitlabConnection()
-    gl_project = gl.get_project()
-    incidents = gl.get_incidents(gl_project)
-    gl.save_incidents(incidents, INCIDENTS_PATH)
-
-
-with open(INCIDENTS_PATH, "rb") as f:
-    incidents = pickle.load(f)
-print(f"Total incidents loaded: {len(incidents)}")
-# print(incidents[0])
-
-
-# MongoDB Atlas connection
-
-atlas_client = AtlasConnection()
-atlas_client.ping()
-print("Connected to Atlas instance! We are good to go!")
-
-# convert each incident to dict
-# incidents is of gitlab.v4.objects.issues.ProjectIssue type 
-# use .attributes built-in property of the ProjectIssue to conver to dict
-# MongoDB expects Python dicts, not JSON strings so converting to JSON isn't helpful
-
-incidents_converted = [incident.attributes for incident in incidents]
-
-#insert into MongDB
-collection_name = COLLECTION_NAME
-if collection_name not in atlas_client.database.list_collection_names():
-    collection = atlas_client.get_collection(collection_name)
-    collection.create_index("id", unique=True)
-    collection.insert_many(incidents_converted)
-    print(f"Inserted {len(incidents_converted)} incidents into MongoDB.")
-
-
-# create embeddings
-embedding_model = EmbeddingModel()
-embedding_shape, embedded_incidents = embedding_model.add_embeddings_to_documents(incidents_converted)
-# print(embedded_incidents[0])
-
-
-# insert into MongoDB
-collection = atlas_client.get_collection(collection_name)
-
-for incident in embedded_incidents:
-    collection.update_one(
-        {'id': incident['id']},
-        {'$set': {'embedding': incident['embedding']}},
-        upsert=True
-    )
-
-
-print(f"Inserted/Updated {len(embedded_incidents)} incidents with embeddings into MongoDB.")
-
-# testing whether it works
-# query
-query = "pipeline failure and git errors"
-
-query_processor_object = UserQueryProcessor(user_query=query, embedding_model=embedding_model)
-incident_texts = query_processor_object.process_query(collection)
-
-llm_processor = LLMProcessor()
-response = llm_processor.get_llm_response(query, incident_texts)
-print("\n🧠 LLM Response:\n")
-print(response)
\ No newline at end of file
+from utils.config import INGEST_BATCH_SIZE
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load GitLab incidents into Atlas with embeddings; resumes an interrupted run.")
+    parser.add_argument("--restart", action="store_true", help="Ignore the manifest of an interrupted run and start over")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE, help="Incidents per embed/write checkpoint")
+    parser.add_argument("--reembed-all", action="store_true",
+                        help="Embed every incident, not only new or changed ones (e.g. after changing chunking settings)")
+    parser.add_argument("--skip-test-query", action="store_true", help="Do not run the retrieval + LLM check afterwards")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    # MongoDB Atlas connection
+    atlas_client = AtlasConnection()
+    atlas_client.ping()
+    print("Connected to Atlas instance! We are good to go!")
+
+    # fetch, embed and write incidents; each page and batch is checkpointed in the ingestion manifest
+    embedding_model = EmbeddingModel()
+    runner = IngestionRunner(atlas_client.database, embedding_model, batch_size=args.batch_size,
+                             reembed_all=args.reembed_all)
+    try:
+        summary = runner.run(restart=args.restart)
+    except KeyboardInterrupt:
+        print("Stopped after finishing the batches in flight; run again to resume.")
+        return 1
+    print(f"Inserted/Updated {summary['representatives']} incidents with embeddings into MongoDB "
+          f"({summary['embedded']} new or changed and embedded, {summary['duplicates']} near-duplicates marked, "
+          f"{summary['chunks']} chunks).")
+    for pipeline, stats in summary["stages"].items():
+        print(f"{pipeline}: {stats['wall_time_s']}s " + ", ".join(
+            f"{name} {stage['items']} items / {stage['busy_s']}s busy x{stage['workers']}"
+            for name, stage in stats["stages"].items()))
+
+    if args.skip_test_query:
+        return 0
+    # testing whether it works
+    # query
+    query = "pipeline failure and git errors"
+
+    query_processor_object = UserQueryProcessor(user_query=query, embedding_model=embedding_model)
+    incident_texts = query_processor_object.process_query(runner.collection)
+
+    llm_processor = LLMProcessor()
+    response = llm_processor.get_llm_response(query, incident_texts)
+    print("\n🧠 LLM Response:\n")
+    print(response)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,150 @@
+"""
+Dimensionality reduction of incident embeddings for a cheaper first search stage.
+
+An EmbeddingProjection maps the 384-dim bge-small vectors to a few dozen or
+hundred dimensions, either with PCA fitted on the stored embeddings or with
+Matryoshka-style prefix truncation. Truncation only preserves similarity for
+models trained with a Matryoshka loss; bge-small-en-v1.5 is not, so PCA is the
+default and benchmarks/recall.py compares both.
+
+The reduced vectors are only used to shortlist candidates ("embedding_reduced"
+in Atlas, or the coarse matrix of LocalVectorIndex); the shortlist is then
+reranked with the full-dimension vectors.
+
+Usage:
+    python -m processors.projection --dim 128 --output projection.npz                # fit PCA on the collection
+    python -m processors.projection --method truncate --dim 128 --output projection.npz
+    python -m processors.projection --embeddings corpus.npy --dim 96 --output projection.npz
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+from typing import Optional
+import numpy as np
+from utils.config import EMBEDDING_PROJECTION_PATH
+
+logger = logging.getLogger(__name__)
+
+PROJECTION_METHODS = ("pca", "truncate")
+REDUCED_INDEX_NAME = "embedding_reduced_vector_index"
+
+
+class EmbeddingProjection:
+    """
+    Linear projection (vector - mean) @ components.T, followed by L2 normalization.
+
+    :param method: "pca" or "truncate".
+    :param mean: Shape (input_dim,); zeros for truncation.
+    :param components: Shape (dim, input_dim); the leading rows of the identity for truncation.
+    :param explained_variance_ratio: Variance kept per component (PCA only), for reporting.
+    """
+
+    def __init__(self, method: str, mean: np.ndarray, components: np.ndarray,
+                 explained_variance_ratio: Optional[np.ndarray] = None):
+        if method not in PROJECTION_METHODS:
+            raise ValueError(f"Unknown projection method: {method} (expected one of {PROJECTION_METHODS})")
+        self.method = method
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float32)
+        self.explained_variance_ratio = explained_variance_ratio
+
+    @property
+    def dim(self) -> int:
+        return self.components.shape[0]
+
+    @property
+    def input_dim(self) -> int:
+        return self.components.shape[1]
+
+    @classmethod
+    def fit_pca(cls, embeddings: np.ndarray, dim: int) -> "EmbeddingProjection":
+        """Principal components of the (L2-normalized) embeddings."""
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if dim > min(vectors.shape):
+            raise ValueError(f"Cannot fit {dim} components on {vectors.shape[0]} vectors of {vectors.shape[1]} dims")
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        mean = vectors.mean(axis=0)
+        # Right singular vectors of the centred data are the principal axes, by decreasing variance
+        _, singular_values, axes = np.linalg.svd(vectors - mean, full_matrices=False)
+        variance = singular_values ** 2
+        return cls("pca", mean, axes[:dim], explained_variance_ratio=variance[:dim] / variance.sum())
+
+    @classmethod
+    def truncate(cls, input_dim: int, dim: int) -> "EmbeddingProjection":
+        """Keep the first dim coordinates (Matryoshka prefix)."""
+        if dim > input_dim:
+            raise ValueError(f"Cannot truncate {input_dim} dims to {dim}")
+        return cls("truncate", np.zeros(input_dim, dtype=np.float32), np.eye(dim, input_dim, dtype=np.float32))
+
+    def transform(self, vectors: np.ndarray) -> np.ndarray:
+        """Reduced, unit-length float32 vectors; (n, input_dim) -> (n, dim), (input_dim,) -> (dim,)."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape[-1] != self.input_dim:
+            raise ValueError(f"Projection expects {self.input_dim}-dim vectors, got {vectors.shape[-1]}")
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        reduced = (vectors / np.maximum(norms, 1e-12) - self.mean) @ self.components.T
+        return reduced / np.maximum(np.linalg.norm(reduced, axis=-1, keepdims=True), 1e-12)
+
+    def save(self, path: str) -> None:
+        arrays = {"method": np.array(self.method), "mean": self.mean, "components": self.components}
+        if self.explained_variance_ratio is not None:
+            arrays["explained_variance_ratio"] = self.explained_variance_ratio
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
+        logger.info(f"Saved {self.method} projection {self.input_dim} -> {self.dim} dims to {path}")
+
+    @classmethod
+    def load(cls, path: str) -> "EmbeddingProjection":
+        with np.load(path) as data:
+            return cls(str(data["method"]), data["mean"], data["components"],
+                       data["explained_variance_ratio"] if "explained_variance_ratio" in data else None)
+
+
+def load_projection(path: str = EMBEDDING_PROJECTION_PATH) -> Optional[EmbeddingProjection]:
+    """The configured projection, or None when two-stage search is disabled (no path set)."""
+    if not path:
+        return None
+    projection = EmbeddingProjection.load(path)
+    logger.info(f"Loaded {projection.method} projection {projection.input_dim} -> {projection.dim} dims from {path}")
+    return projection
+
+
+def _collection_embeddings() -> np.ndarray:
+    from processors.quantization import EMBEDDING_FIELDS, decode_embedding
+    from utils.registry import registry, register_default_components
+
+    register_default_components()
+    collection = registry.get("collection")
+    projection = {"_id": 0, **{field: 1 for field in EMBEDDING_FIELDS}}
+    return np.array([decode_embedding(doc) for doc in collection.find({"embedding": {"$exists": True}}, projection)],
+                    dtype=np.float32)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Fit the embedding projection used by the coarse search stage.")
+    parser.add_argument("--method", choices=PROJECTION_METHODS, default="pca")
+    parser.add_argument("--dim", type=int, required=True, help="Reduced dimension (see benchmarks/recall.py --dims)")
+    parser.add_argument("--output", required=True, help="Projection .npz; point EMBEDDING_PROJECTION_PATH at it")
+    parser.add_argument("--embeddings", help=".npy file of embeddings to fit on (default: the Atlas collection)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    embeddings = np.load(args.embeddings) if args.embeddings else _collection_embeddings()
+    if args.method == "pca":
+        projection = EmbeddingProjection.fit_pca(embeddings, args.dim)
+        print(f"PCA keeps {projection.explained_variance_ratio.sum():.1%} of the variance in {args.dim} dims")
+    else:
+        projection = EmbeddingProjection.truncate(embeddings.shape[1], args.dim)
+    projection.save(args.output)
+
+    from processors.quantization import vector_index_definition
+    print(f"Saved {os.path.abspath(args.output)}. Re-run populate_incidents with EMBEDDING_PROJECTION_PATH set, "
+          f"then create the Atlas index '{REDUCED_INDEX_NAME}':")
+    print(json.dumps(vector_index_definition("float32", args.dim, path="embedding_reduced"), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,184 @@
+"""
+Compact embedding formats for storage and in-memory search.
+
+Document storage (EMBEDDING_STORAGE_FORMAT), all usable by Atlas $vectorSearch:
+- "list":    384 BSON doubles (the original format, ~5 KB per vector with BSON overhead)
+- "float32": a BSON binData float32 vector (1.5 KB)
+- "int8":    a BSON binData int8 vector with a per-vector scale (384 B); cosine similarity
+             is unaffected by the scale, so Atlas can search it directly
+- "binary":  a packed-bit sign vector (48 B) for the first pass, plus an int8 copy in
+             "embedding_rescore" that is only read for the top candidates to rescore them
+
+float16 is not a BSON vector type Atlas can index, so it is only offered as an
+in-memory format for LocalVectorIndex.
+"""
+import struct
+from typing import Iterable, Iterator, Optional
+import numpy as np
+from bson.binary import VECTOR_SUBTYPE, Binary, BinaryVectorDtype
+from utils.config import EMBEDDING_STORAGE_FORMAT
+
+STORAGE_FORMATS = ("list", "float32", "int8", "binary")
+# Every embedding field an incident can carry ("embedding_reduced" is the projected vector, see
+# processors/projection.py); fields a write does not produce are unset
+EMBEDDING_FIELDS = ("embedding", "embedding_scale", "embedding_rescore", "embedding_reduced")
+
+
+def embedding_fields(field: str = "embedding") -> tuple[str, ...]:
+    """EMBEDDING_FIELDS for an embedding stored under another field name (a versioned field, see processors.embedding_versions)."""
+    return tuple(name.replace("embedding", field, 1) for name in EMBEDDING_FIELDS)
+
+
+def int8_quantize(vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Scalar int8 quantization with one scale per vector (max |value| maps to 127).
+
+    :return: (int8 codes, float32 scales) such that vectors ~= codes * scales[:, None].
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+    codes = np.clip(np.rint(vectors / scales[:, np.newaxis]), -127, 127).astype(np.int8)
+    return codes, scales
+
+
+def binary_quantize(vectors: np.ndarray) -> np.ndarray:
+    """Sign bits packed 8 per byte, shape (n, dim / 8)."""
+    return np.packbits(np.atleast_2d(np.asarray(vectors)) > 0, axis=1)
+
+
+def encode_embedding(vector: np.ndarray, storage_format: str = EMBEDDING_STORAGE_FORMAT, field: str = "embedding") -> dict:
+    """
+    Document fields holding one embedding in the given storage format.
+
+    :param field: Name of the vector field; its companions are named after it ("<field>_scale", ...).
+    :return: Fields to $set on the incident document ("embedding" and, for int8/binary, its companions).
+    """
+    return encode_embeddings(vector, storage_format, field)[0]
+
+
+def encode_embeddings(vectors: np.ndarray, storage_format: str = EMBEDDING_STORAGE_FORMAT,
+                      field: str = "embedding") -> list[dict]:
+    """
+    encode_embedding() for every row of a matrix. The matrix is quantized and serialized
+    once and each row's bytes are sliced out, instead of packing one vector at a time.
+    Lists keep the model's values as they are; the binData formats are float32-based.
+    """
+    return list(iter_encoded_embeddings(vectors, storage_format, field))
+
+
+def iter_encoded_embeddings(vectors: np.ndarray, storage_format: str = EMBEDDING_STORAGE_FORMAT,
+                            field: str = "embedding") -> Iterator[dict]:
+    """
+    encode_embeddings() row by row. "list" rows are converted as they are consumed, so a caller
+    storing each one before taking the next never holds every row's Python floats at once.
+    """
+    vectors = np.atleast_2d(np.asarray(vectors))
+    if storage_format != "list":
+        vectors = vectors.astype(np.float32, copy=False)
+    encoded = _encode(vectors, storage_format)
+    if field == "embedding":
+        return iter(encoded)
+    names = {name: name.replace("embedding", field, 1) for name in EMBEDDING_FIELDS}
+    return ({names[name]: value for name, value in fields.items()} for fields in encoded)
+
+
+def _vector_binaries(rows: np.ndarray, dtype: BinaryVectorDtype) -> list[Binary]:
+    """One BSON vector Binary per row, byte-identical to Binary.from_vector(row.tolist(), dtype)."""
+    metadata = struct.pack("<sB", dtype.value, 0)
+    return [Binary(metadata + row.tobytes(), subtype=VECTOR_SUBTYPE) for row in rows]
+
+
+def _encode(vectors: np.ndarray, storage_format: str) -> Iterable[dict]:
+    if storage_format == "list":
+        return ({"embedding": row.tolist()} for row in vectors)
+    if storage_format == "float32":
+        return [{"embedding": value} for value in _vector_binaries(vectors.astype("<f4"), BinaryVectorDtype.FLOAT32)]
+    if storage_format not in STORAGE_FORMATS:
+        raise ValueError(f"Unknown embedding storage format: {storage_format} (expected one of {STORAGE_FORMATS})")
+    codes, scales = int8_quantize(vectors)
+    int8_vectors = _vector_binaries(codes, BinaryVectorDtype.INT8)
+    scales = scales.tolist()
+    if storage_format == "int8":
+        return [{"embedding": value, "embedding_scale": scale} for value, scale in zip(int8_vectors, scales)]
+    bit_vectors = _vector_binaries(binary_quantize(vectors), BinaryVectorDtype.PACKED_BIT)
+    return [{"embedding": bits, "embedding_rescore": value, "embedding_scale": scale}
+            for bits, value, scale in zip(bit_vectors, int8_vectors, scales)]
+
+
+def embedding_update(document: dict, fields=EMBEDDING_FIELDS) -> dict:
+    """
+    Update operators storing a document's encoded embedding fields and removing stale ones from other formats.
+
+    :param fields: The embedding fields to write, e.g. those of every version being written.
+    """
+    update = {"$set": {field: document[field] for field in fields if field in document}}
+    stale = {field: "" for field in fields if field not in document}
+    if stale:
+        update["$unset"] = stale
+    return update
+
+
+def decode_embedding(document: dict) -> Optional[np.ndarray]:
+    """
+    Full-precision (float32) embedding of a stored document, whatever its storage format.
+
+    Binary documents are decoded from their int8 rescoring copy; None if the document has no embedding.
+    """
+    value = document.get("embedding_rescore", document.get("embedding"))
+    if value is None:
+        return None
+    if isinstance(value, np.ndarray):
+        return value.astype(np.float32, copy=False)
+    if isinstance(value, Binary):
+        binary_vector = value.as_vector()
+        data = np.asarray(binary_vector.data)
+        if binary_vector.dtype == BinaryVectorDtype.INT8:
+            return data.astype(np.float32) * np.float32(document.get("embedding_scale", 1.0))
+        if binary_vector.dtype == BinaryVectorDtype.PACKED_BIT:
+            # Only signs survive; map them to +-1
+            return np.unpackbits(data.astype(np.uint8)).astype(np.float32) * 2 - 1
+        return data.astype(np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+
+def query_vector(query_embedding: np.ndarray, storage_format: str = EMBEDDING_STORAGE_FORMAT):
+    """The $vectorSearch queryVector matching the stored format (binary indexes need a packed-bit query)."""
+    if storage_format == "binary":
+        return Binary.from_vector(binary_quantize(query_embedding)[0].tolist(), BinaryVectorDtype.PACKED_BIT)
+    return np.asarray(query_embedding, dtype=np.float32).tolist()
+
+
+def embedding_projection(storage_format: str = EMBEDDING_STORAGE_FORMAT, field: str = "embedding") -> dict:
+    """
+    $project fields needed to decode candidate vectors for rescoring / MMR.
+
+    A versioned field is projected under the default names, so decode_embedding() reads it unchanged.
+    """
+    if storage_format == "binary":
+        names = ("embedding_rescore", "embedding_scale")
+    elif storage_format == "int8":
+        names = ("embedding", "embedding_scale")
+    else:
+        names = ("embedding",)
+    if field == "embedding":
+        return {name: 1 for name in names}
+    return {name: f"${name.replace('embedding', field, 1)}" for name in names}
+
+
+def vector_index_definition(storage_format: str = EMBEDDING_STORAGE_FORMAT, dimensions: int = 384,
+                            path: str = "embedding") -> dict:
+    """
+    Atlas Vector Search index definition for the stored format (Atlas requires euclidean
+    similarity, i.e. Hamming distance, for packed-bit vectors).
+    """
+    similarity = "euclidean" if storage_format == "binary" else "cosine"
+    return {"fields": [{"type": "vector", "path": path, "numDimensions": dimensions, "similarity": similarity}]}
+
+
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def hamming_distances(query_bits: np.ndarray, bits: np.ndarray) -> np.ndarray:
+    """Hamming distance from one packed-bit query to every packed-bit row."""
+    return _POPCOUNT[np.bitwise_xor(bits, query_bits)].sum(axis=1, dtype=np.int32)
@@ -0,0 +1,260 @@
+"""
+Background re-embedding of the corpus into a new embedding version (see processors/embedding_versions.py).
+
+The job walks the incident and chunk collections in _id order and writes the
+new version's vectors next to the active ones, a batch at a time, throttled to
+REEMBED_MAX_DOCS_PER_SECOND so that live queries keep their share of the
+embedding API. Progress is checkpointed on the version document after every
+batch, so a stopped or crashed job resumes where it left off. Batches the API
+could not embed (fallback embeddings are in a different space) are retried
+with backoff rather than written. Queries keep reading the active version
+until the cutover.
+
+Usage:
+    python -m processors.reembed create v2 --model-id BAAI/bge-base-en-v1.5 --dimensions 768
+    python -m processors.reembed run v2 --max-docs-per-second 10
+    python -m processors.reembed status
+    python -m processors.reembed cutover v2
+"""
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from typing import Callable, Optional
+from pymongo import UpdateOne
+from processors.chunking import chunk_embedding_text
+from processors.embedding_versions import EmbeddingVersion, EmbeddingVersionStore, version_store
+from processors.quantization import encode_embeddings, vector_index_definition
+from utils.config import (
+    CHUNK_COLLECTION_NAME, COLLECTION_NAME, EMBEDDING_STORAGE_FORMAT, REEMBED_BATCH_SIZE, REEMBED_MAX_DOCS_PER_SECOND,
+)
+from utils.metrics import track_stage
+
+logger = logging.getLogger(__name__)
+
+MAX_BACKOFF_SECONDS = 60.0
+
+
+class ReembeddingJob:
+    """
+    Back-fill one embedding version across the incident and chunk collections.
+
+    :param version_name: A version created with EmbeddingVersionStore.create (or the create command).
+    :param database: PyMongo Database (default: the registry's Atlas connection).
+    :param embedding_model: Any EmbeddingModel; the version's own model is derived with for_version().
+    :param max_docs_per_second: Throughput cap; 0 disables throttling.
+    """
+
+    def __init__(self, version_name: str, database=None, embedding_model=None, batch_size: int = REEMBED_BATCH_SIZE,
+                 max_docs_per_second: float = REEMBED_MAX_DOCS_PER_SECOND,
+                 storage_format: str = EMBEDDING_STORAGE_FORMAT):
+        if database is None or embedding_model is None:
+            from utils.registry import registry, register_default_components
+            register_default_components()
+            database = database if database is not None else registry.get("atlas_client").database
+            embedding_model = embedding_model or registry.get("embedding_model")
+        self.database = database
+        self.store: EmbeddingVersionStore = version_store(database)
+        self.version: EmbeddingVersion = self.store.get(version_name)
+        if self.version.is_legacy:
+            raise ValueError("v1 is the original embedding field and cannot be re-embedded into")
+        self.embedding_model = embedding_model.for_version(self.version)
+        self.batch_size = batch_size
+        self.max_docs_per_second = max_docs_per_second
+        self.storage_format = storage_format
+        self._stop = threading.Event()
+
+    def _sources(self) -> list[tuple[str, dict, Callable[[dict], str]]]:
+        """(collection, fields to read, text to embed) for the incidents and their chunks, as ingestion embeds them."""
+        return [
+            (COLLECTION_NAME, {"title": 1, "description": 1},
+             lambda doc: f"{doc.get('title')} {doc.get('description')}"),
+            (CHUNK_COLLECTION_NAME, {"title": 1, "text": 1}, chunk_embedding_text),
+        ]
+
+    def _embed(self, texts: list[str]):
+        """Embeddings from the API for texts, retried with backoff while only fallback embeddings are available."""
+        backoff = 1.0
+        while True:
+            embeddings = self.embedding_model.get_embeddings(texts)
+            if self.embedding_model.last_path != "fallback":
+                break
+            logger.warning(f"ReembeddingJob: Embedding API unavailable, retrying batch in {backoff:.0f}s")
+            if self._stop.wait(backoff):
+                return None
+            backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+        if embeddings.shape[1] != self.version.dimensions:
+            raise ValueError(f"{self.version.model_id} returned {embeddings.shape[1]} dims, "
+                             f"version {self.version.name} expects {self.version.dimensions}")
+        return embeddings
+
+    def _updates(self, documents: list[dict], embeddings, hashes: Optional[list[str]] = None) -> list[UpdateOne]:
+        encoded = encode_embeddings(embeddings, self.storage_format, self.version.field)
+        reduced = self.embedding_model.reduce(embeddings)
+        if reduced is not None:
+            encoded_reduced = encode_embeddings(reduced, "list" if self.storage_format == "list" else "float32")
+        updates = []
+        for index, doc in enumerate(documents):
+            fields = encoded[index]
+            if reduced is not None:
+                fields[self.version.reduced_field] = encoded_reduced[index]["embedding"]
+            if hashes is not None:
+                fields[self.version.hash_field] = hashes[index]
+            updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": fields}))
+        return updates
+
+    def backfill(self, collection_name: str, fields: dict, text) -> int:
+        """
+        Re-embed the documents of one collection that the active version serves and this version
+        lacks, resuming after the checkpointed _id.
+
+        :return: Documents written.
+        """
+        collection = self.database[collection_name]
+        active = self.store.active(fresh=True)
+        checkpoint = self.version.checkpoints.get(collection_name, {})
+        query = {active.field: {"$exists": True}, self.version.field: {"$exists": False}}
+        if checkpoint.get("last_id") is not None:
+            query["_id"] = {"$gt": checkpoint["last_id"]}
+
+        written = 0
+        cursor = collection.find(query, {"_id": 1, **fields}).sort("_id", 1).batch_size(self.batch_size)
+        batch = []
+        for doc in cursor:
+            batch.append(doc)
+            if len(batch) == self.batch_size:
+                if not self._write_batch(collection, collection_name, batch, text):
+                    return written
+                written += len(batch)
+                batch = []
+        if batch and self._write_batch(collection, collection_name, batch, text):
+            written += len(batch)
+        return written
+
+    def _write_batch(self, collection, collection_name: str, batch: list[dict], text) -> bool:
+        """Embed and store one batch, checkpoint it, then sleep off the rate limit. False if stopped before writing."""
+        if self._stop.is_set():
+            return False
+        started = time.monotonic()
+        with track_stage("reembed_batch"):
+            texts = [text(doc) for doc in batch]
+            embeddings = self._embed(texts)
+            if embeddings is None:
+                return False
+            # Incidents carry the content hash ingestion compares against, so it does not embed them again
+            hashes = (self.embedding_model.content_hashes(texts, self.storage_format)
+                      if collection_name == COLLECTION_NAME else None)
+            collection.bulk_write(self._updates(batch, embeddings, hashes), ordered=False)
+        last_id = batch[-1]["_id"]
+        self.store.save_checkpoint(self.version.name, collection_name, last_id, len(batch))
+        self.version.checkpoints.setdefault(collection_name, {})["last_id"] = last_id
+        if self.max_docs_per_second > 0:
+            delay = len(batch) / self.max_docs_per_second - (time.monotonic() - started)
+            if delay > 0:
+                self._stop.wait(delay)
+        return True
+
+    def run(self, cutover: bool = False) -> dict:
+        """
+        Back-fill every collection, then sweep once more from the start for documents the first
+        pass could not see (written before the version existed, behind the checkpoint).
+
+        :param cutover: Switch the active version once coverage is complete.
+        :return: {"written": per collection, "coverage": per collection (covered, total), "active": version name}.
+        """
+        written = {}
+        for sweep in range(2):
+            for collection_name, fields, text in self._sources():
+                written[collection_name] = written.get(collection_name, 0) + self.backfill(collection_name, fields, text)
+            coverage = self.store.coverage(self.version)
+            if self._stop.is_set() or all(covered == total for covered, total in coverage.values()):
+                break
+            self.version.checkpoints = {}
+        logger.info(f"ReembeddingJob: {self.version.name} wrote {written}, coverage {coverage}")
+
+        active = self.store.active(fresh=True)
+        if cutover and not self._stop.is_set() and all(covered == total for covered, total in coverage.values()):
+            active = self.store.cutover(self.version.name)
+        return {"written": written, "coverage": coverage, "active": active.name}
+
+    def start(self, cutover: bool = False) -> threading.Thread:
+        """Run on a daemon thread (e.g. next to the app); stop() ends it after the current batch."""
+        thread = threading.Thread(target=self.run, kwargs={"cutover": cutover}, name="reembed", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def _index_definitions(version: EmbeddingVersion, storage_format: str) -> dict:
+    """The Atlas vector index definitions a version needs, by index name."""
+    definitions = {
+        version.index_name: vector_index_definition(storage_format, version.dimensions, path=version.field),
+        version.chunk_index_name: vector_index_definition(storage_format, version.dimensions, path=version.field),
+    }
+    if version.projection_path:
+        from processors.projection import load_projection
+        reduced_dim = load_projection(version.projection_path).dim
+        definitions[version.reduced_index_name] = vector_index_definition("float32", reduced_dim, path=version.reduced_field)
+    return definitions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Manage embedding versions and re-embed the corpus in the background.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="Register a new version; ingestion starts dual-writing it")
+    create.add_argument("name")
+    create.add_argument("--model-id", required=True)
+    create.add_argument("--dimensions", type=int, required=True)
+    create.add_argument("--projection", default="", help="Projection .npz for the version's two-stage search")
+    run = commands.add_parser("run", help="Back-fill a version (resumes from its checkpoint)")
+    run.add_argument("name")
+    run.add_argument("--batch-size", type=int, default=REEMBED_BATCH_SIZE)
+    run.add_argument("--max-docs-per-second", type=float, default=REEMBED_MAX_DOCS_PER_SECOND)
+    run.add_argument("--cutover", action="store_true", help="Activate the version when coverage reaches 100%%")
+    commands.add_parser("status", help="Versions, their coverage and the active one")
+    cutover = commands.add_parser("cutover", help="Activate a fully back-filled version")
+    cutover.add_argument("name")
+    cutover.add_argument("--skip-index-check", action="store_true", help="Do not require its vector index to be queryable")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from utils.registry import registry, register_default_components
+    register_default_components()
+    store = version_store(registry.get("atlas_client").database)
+
+    if args.command == "create":
+        version = store.create(args.name, args.model_id, args.dimensions, args.projection)
+        print(f"Created {version.name} in field '{version.field}'. Create these Atlas vector indexes, then run "
+              f"'python -m processors.reembed run {version.name}':")
+        for collection_name, (index_name, definition) in zip(
+                (COLLECTION_NAME, CHUNK_COLLECTION_NAME, COLLECTION_NAME),
+                _index_definitions(version, EMBEDDING_STORAGE_FORMAT).items()):
+            print(f"{collection_name} / {index_name}:\n{json.dumps(definition, indent=2)}")
+    elif args.command == "run":
+        job = ReembeddingJob(args.name, database=store.database, batch_size=args.batch_size,
+                             max_docs_per_second=args.max_docs_per_second)
+        try:
+            print(json.dumps(job.run(cutover=args.cutover), indent=2, default=str))
+        except KeyboardInterrupt:
+            job.stop()
+            print("Stopped; run the same command to resume from the checkpoint.")
+            return 1
+    elif args.command == "status":
+        active = store.active(fresh=True)
+        for version in store.list_versions():
+            coverage = store.coverage(version, active)
+            print(f"{version.name:<8}{version.status:<10}{version.model_id:<32}{version.dimensions:>6}  {version.field:<20}"
+                  + "  ".join(f"{name} {covered}/{total}" for name, (covered, total) in coverage.items())
+                  + ("  <- active" if version.name == active.name else ""))
+    else:
+        version = store.cutover(args.name, check_indexes=not args.skip_index_check)
+        print(f"{version.name} is now the active embedding version.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,205 @@
+"""
+Precomputed related-incident graph: the k most similar incidents of every incident.
+
+An offline job loads the active version's embeddings, normalizes them and
+computes all pairwise cosine similarities in blocks (block_rows x block_rows
+matrix multiplies), keeping a running top-k per row, so memory stays at one
+block of scores however large the corpus is. Each incident's neighbours and
+scores are written to a side collection keyed by the incident id; rows of the
+previous build that were not rewritten (deleted incidents) are removed at the
+end. Writing beside the incidents rather than on them keeps the change stream
+of the incident collection free of graph updates.
+
+SimilarityGraph.related() is then a single _id lookup instead of a
+$vectorSearch per incident. Incidents marked as near-duplicates have no
+embedding of their own and are not in the graph.
+
+Usage:
+    python -m processors.similarity_graph build
+    python -m processors.similarity_graph build --k 20 --block-rows 2048
+    python -m processors.similarity_graph related 1234
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+import uuid
+from typing import TYPE_CHECKING, Optional
+import numpy as np
+from pymongo import ReplaceOne
+from processors.local_index import stored_embedding
+from processors.quantization import embedding_fields
+from utils.config import (
+    SIMILARITY_GRAPH_BLOCK_ROWS, SIMILARITY_GRAPH_COLLECTION_NAME, SIMILARITY_GRAPH_K, SIMILARITY_GRAPH_MIN_SCORE,
+)
+from utils.metrics import track_stage
+
+if TYPE_CHECKING:
+    from pymongo.collection import Collection
+
+logger = logging.getLogger(__name__)
+
+WRITE_BATCH_SIZE = 500
+
+
+def knn_graph(embeddings: np.ndarray, k: int = SIMILARITY_GRAPH_K,
+              block_rows: int = SIMILARITY_GRAPH_BLOCK_ROWS) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Exact k nearest neighbours of every row by cosine similarity, excluding the row itself.
+
+    :param embeddings: (n, dim) vectors; they need not be normalized.
+    :param block_rows: Rows and columns per block; one block of scores is block_rows**2 float32s.
+    :return: (neighbours, scores), both (n, min(k, n - 1)), best first; neighbours are row numbers.
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1.0, norms)
+    count = len(vectors)
+    k = max(0, min(k, count - 1))
+    neighbours = np.empty((count, k), dtype=np.int64)
+    scores = np.empty((count, k), dtype=np.float32)
+    if k == 0:
+        return neighbours, scores
+
+    for row_start in range(0, count, block_rows):
+        rows = vectors[row_start:row_start + block_rows]
+        best_scores = np.full((len(rows), k), -np.inf, dtype=np.float32)
+        best_columns = np.full((len(rows), k), -1, dtype=np.int64)
+        for column_start in range(0, count, block_rows):
+            block = rows @ vectors[column_start:column_start + block_rows].T
+            # The row's own column, where the block crosses the diagonal
+            overlap = np.arange(max(row_start, column_start),
+                                min(row_start + len(rows), column_start + block.shape[1]))
+            block[overlap - row_start, overlap - column_start] = -np.inf
+            # The block's own top k, merged with the running top k
+            block_columns = np.arange(column_start, column_start + block.shape[1])[np.newaxis, :]
+            if block.shape[1] > k:
+                block_top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+                block, block_columns = np.take_along_axis(block, block_top, axis=1), column_start + block_top
+            candidate_scores = np.concatenate([best_scores, block], axis=1)
+            candidate_columns = np.concatenate([best_columns, np.broadcast_to(block_columns, block.shape)], axis=1)
+            top = np.argpartition(-candidate_scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(candidate_scores, top, axis=1)
+            best_columns = np.take_along_axis(candidate_columns, top, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        scores[row_start:row_start + len(rows)] = np.take_along_axis(best_scores, order, axis=1)
+        neighbours[row_start:row_start + len(rows)] = np.take_along_axis(best_columns, order, axis=1)
+    return neighbours, scores
+
+
+class SimilarityGraph:
+    """
+    Read and rebuild the related-incident graph stored in a side collection.
+
+    Each graph document is {"_id": incident id, "neighbours": [{"id", "score"}, ...] best first,
+    "field": embedding field it was built from, "build": build id, "built_at": epoch seconds}.
+
+    :param graph_collection: PyMongo Collection holding the graph.
+    """
+
+    def __init__(self, graph_collection: "Collection"):
+        self.collection = graph_collection
+
+    def related(self, incident_id: int, k: Optional[int] = None, min_score: float = 0.0) -> list[dict]:
+        """
+        The incidents most similar to incident_id, as [{"id", "score"}] best first; empty if it is not in the graph.
+
+        :param k: At most this many (default: as many as were stored).
+        """
+        return self.related_many([incident_id], k, min_score).get(incident_id, [])
+
+    def related_many(self, incident_ids: list[int], k: Optional[int] = None,
+                     min_score: float = 0.0) -> dict[int, list[dict]]:
+        """related() for several incidents in one read; incidents not in the graph are left out."""
+        related = {}
+        for document in self.collection.find({"_id": {"$in": list(incident_ids)}}, {"neighbours": 1}):
+            neighbours = [neighbour for neighbour in document["neighbours"] if neighbour["score"] >= min_score]
+            related[document["_id"]] = neighbours[:k] if k is not None else neighbours
+        return related
+
+    def related_incidents(self, incidents: "Collection", incident_id: int, k: Optional[int] = None,
+                          min_score: float = 0.0) -> list[dict]:
+        """related() joined with the neighbours' title and description (one more read)."""
+        neighbours = self.related(incident_id, k, min_score)
+        query = {"id": {"$in": [neighbour["id"] for neighbour in neighbours]}}
+        documents = {doc["id"]: doc for doc in incidents.find(query, {"_id": 0, "id": 1, "title": 1, "description": 1})}
+        return [{**documents[neighbour["id"]], "score": neighbour["score"]}
+                for neighbour in neighbours if neighbour["id"] in documents]
+
+    def build(self, incidents: "Collection", field: str = "embedding", k: int = SIMILARITY_GRAPH_K,
+              block_rows: int = SIMILARITY_GRAPH_BLOCK_ROWS, min_score: float = SIMILARITY_GRAPH_MIN_SCORE) -> dict:
+        """
+        Recompute the graph from the incidents embedded in field and replace the stored one.
+
+        :param min_score: Neighbours scoring below this are not stored.
+        :return: {"incidents", "edges", "k", "field", "build", "seconds"}.
+        """
+        started = time.monotonic()
+        fields = {name: 1 for name in ("id",) + embedding_fields(field)}
+        incident_ids, embeddings = [], []
+        for document in incidents.find({field: {"$exists": True}}, {"_id": 0, **fields}):
+            embedding = stored_embedding(document, field)
+            if embedding is not None and document.get("id") is not None:
+                incident_ids.append(document["id"])
+                embeddings.append(embedding)
+
+        matrix = (np.array(embeddings, dtype=np.float32).reshape(len(embeddings), -1) if embeddings
+                  else np.zeros((0, 0), dtype=np.float32))
+        with track_stage("similarity_graph"):
+            neighbours, scores = knn_graph(matrix, k=k, block_rows=block_rows)
+
+        build_id = uuid.uuid4().hex
+        built_at = time.time()
+        edges, batch = 0, []
+        for row, incident_id in enumerate(incident_ids):
+            keep = scores[row] >= min_score
+            edges += int(keep.sum())
+            batch.append(ReplaceOne({"_id": incident_id}, {
+                "neighbours": [{"id": incident_ids[column], "score": round(float(score), 6)}
+                               for column, score in zip(neighbours[row][keep], scores[row][keep])],
+                "field": field, "build": build_id, "built_at": built_at,
+            }, upsert=True))
+            if len(batch) == WRITE_BATCH_SIZE:
+                self.collection.bulk_write(batch, ordered=False)
+                batch = []
+        if batch:
+            self.collection.bulk_write(batch, ordered=False)
+        removed = self.collection.delete_many({"build": {"$ne": build_id}}).deleted_count
+
+        summary = {"incidents": len(incident_ids), "edges": edges, "k": neighbours.shape[1], "field": field,
+                   "build": build_id, "seconds": round(time.monotonic() - started, 2)}
+        logger.info(f"SimilarityGraph: Built {summary} ({removed} stale entries removed)")
+        return summary
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Build or query the precomputed related-incident graph.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Recompute the graph from the active version's embeddings")
+    build.add_argument("--k", type=int, default=SIMILARITY_GRAPH_K)
+    build.add_argument("--block-rows", type=int, default=SIMILARITY_GRAPH_BLOCK_ROWS)
+    build.add_argument("--min-score", type=float, default=SIMILARITY_GRAPH_MIN_SCORE)
+    related = commands.add_parser("related", help="Print the stored neighbours of an incident")
+    related.add_argument("incident_id", type=int)
+    related.add_argument("--k", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from utils.registry import registry, register_default_components
+    register_default_components()
+    graph = registry.get("similarity_graph")
+    incidents = registry.get("collection")
+
+    if args.command == "build":
+        from processors.embedding_versions import active_version
+        summary = graph.build(incidents, field=active_version(incidents).field, k=args.k,
+                              block_rows=args.block_rows, min_score=args.min_score)
+        print(json.dumps(summary, indent=2))
+    else:
+        print(json.dumps(graph.related_incidents(incidents, args.incident_id, k=args.k), indent=2, default=str))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
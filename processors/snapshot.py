@@ -0,0 +1,350 @@
+"""
+Memory-mapped corpus snapshot: the embedded incidents in one file that every process maps read-only.
+
+Layout (little-endian):
+    magic b"DGPTSNAP" | uint32 format | uint32 header length | header JSON | padding | sections
+
+Each section starts on a 64-byte boundary; the header lists its offset (from
+the start of the data), dtype and shape:
+    vectors       (n, dim)      unit-length embeddings in the snapshot dtype (float32, float16 or int8)
+    scales        (n,)          float32 per-row scales of int8 vectors (int8 and binary)
+    bits          (n, dim / 8)  packed sign bits for the binary first pass (binary)
+    ids           (n,)          int64 GitLab incident ids
+    object_ids    (n, 12)       MongoDB _id of each incident, the key change-stream events carry
+    text_offsets  (n + 1,)      uint64 offset of each record in text
+    text          (bytes,)      UTF-8 JSON {"title", "description"} records back to back
+
+The header also records the sha256 of the data, the embedding field and model
+it was built from, and a change-stream resume token taken before the export,
+from which LocalIndexSync catches up with later writes.
+
+Opening a snapshot maps its sections with np.memmap: nothing is read until it
+is searched, and every process on the host shares the same page-cache pages,
+so a Streamlit or gunicorn worker adds no RSS for the corpus. Build it before
+the image (it needs Atlas), e.g. in CI; the Dockerfile verifies it.
+
+Usage:
+    python -m processors.snapshot build                 # export to CORPUS_SNAPSHOT_PATH
+    python -m processors.snapshot build --dtype float16 --output data/corpus.snap
+    python -m processors.snapshot verify data/corpus.snap
+    python -m processors.snapshot info data/corpus.snap
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import struct
+import sys
+import time
+from collections.abc import Sequence
+from typing import TYPE_CHECKING, Optional
+import numpy as np
+from bson import ObjectId, json_util
+from processors.local_index import DOCUMENT_FIELDS, stored_embedding
+from processors.quantization import binary_quantize, embedding_fields, int8_quantize
+from utils.config import CORPUS_SNAPSHOT_PATH, LOCAL_INDEX_DTYPE
+
+if TYPE_CHECKING:
+    from pymongo.collection import Collection
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"DGPTSNAP"
+SNAPSHOT_FORMAT = 1
+ALIGNMENT = 64
+_PREAMBLE = struct.Struct("<8sII")
+# Read size when checksumming the data
+_HASH_BLOCK_BYTES = 1 << 20
+
+
+class SnapshotError(Exception):
+    """A snapshot file that is missing, of another format, truncated or corrupt."""
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_snapshot(path: str, documents: list[dict], embeddings: np.ndarray, dtype: str = LOCAL_INDEX_DTYPE,
+                   object_ids: Optional[list] = None, metadata: Optional[dict] = None) -> dict:
+    """
+    Write documents and their embeddings as a snapshot (to a temporary file, then renamed).
+
+    :param documents: Incidents with id, title and description.
+    :param dtype: Vector format, as LOCAL_INDEX_DTYPE (binary stores int8 vectors plus sign bits).
+    :param object_ids: MongoDB _id per document, so a LocalIndexSync can apply change events to the snapshot.
+    :param metadata: Extra header fields (field, model_id, resume_token, ...).
+    :return: The header.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if embeddings.ndim != 2:
+        embeddings = embeddings.reshape(len(documents), -1) if documents else np.zeros((0, 0), dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    normalized = embeddings / np.where(norms == 0, 1.0, norms)
+
+    sections = {}
+    if dtype == "float32":
+        sections["vectors"] = normalized
+    elif dtype == "float16":
+        sections["vectors"] = normalized.astype(np.float16)
+    elif dtype in ("int8", "binary"):
+        sections["vectors"], sections["scales"] = int8_quantize(normalized)
+        if dtype == "binary":
+            sections["bits"] = binary_quantize(normalized)
+    else:
+        raise ValueError(f"Unknown snapshot dtype: {dtype}")
+    sections["ids"] = np.array([doc.get("id") if doc.get("id") is not None else -1 for doc in documents], dtype=np.int64)
+    if object_ids is not None:
+        sections["object_ids"] = np.frombuffer(b"".join(ObjectId(key).binary for key in object_ids),
+                                               dtype=np.uint8).reshape(len(documents), 12)
+    records = [json.dumps({"title": doc.get("title"), "description": doc.get("description")}).encode("utf-8")
+               for doc in documents]
+    sections["text_offsets"] = np.concatenate([[0], np.cumsum([len(record) for record in records])]).astype(np.uint64)
+    sections["text"] = np.frombuffer(b"".join(records), dtype=np.uint8)
+
+    layout, offset = {}, 0
+    for name, array in sections.items():
+        offset = _align(offset)
+        layout[name] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+        offset += array.nbytes
+    data_size = offset
+
+    data = bytearray(data_size)
+    for name, array in sections.items():
+        start = layout[name]["offset"]
+        data[start:start + array.nbytes] = np.ascontiguousarray(array).tobytes()
+
+    header = {
+        **(metadata or {}), "format": SNAPSHOT_FORMAT, "created_at": time.time(), "count": len(documents),
+        "dim": int(embeddings.shape[1]) if len(documents) else 0, "dtype": dtype, "sections": layout,
+        "data_size": data_size, "sha256": hashlib.sha256(data).hexdigest(),
+    }
+    header_bytes = json_util.dumps(header).encode("utf-8")
+    data_start = _align(_PREAMBLE.size + len(header_bytes))
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, SNAPSHOT_FORMAT, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b"\0" * (data_start - _PREAMBLE.size - len(header_bytes)))
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+    logger.info(f"CorpusSnapshot: Wrote {len(documents)} incidents ({dtype}) to {path}")
+    return header
+
+
+def build_snapshot(collection: "Collection", path: str = CORPUS_SNAPSHOT_PATH, field: str = "embedding",
+                   dtype: str = LOCAL_INDEX_DTYPE, model_id: Optional[str] = None) -> dict:
+    """
+    Export every incident embedded in field to a snapshot.
+
+    The change-stream resume token is taken before the export, so replaying from it covers
+    every write the export may have missed.
+
+    :raises SnapshotError: No incident is embedded in field.
+    """
+    resume_token = None
+    try:
+        with collection.watch(max_await_time_ms=1) as stream:
+            resume_token = stream.resume_token
+    except Exception as e:
+        # e.g. a standalone server without change streams; LocalIndexSync then reloads from the collection
+        logger.warning(f"CorpusSnapshot: No change-stream resume token: {e}")
+
+    fields = {name: 1 for name in ("_id",) + embedding_fields(field) + DOCUMENT_FIELDS}
+    documents, embeddings, object_ids = [], [], []
+    for doc in collection.find({field: {"$exists": True}}, fields):
+        embeddings.append(stored_embedding(doc, field))
+        object_ids.append(doc.pop("_id"))
+        documents.append(doc)
+    if not documents:
+        raise SnapshotError(f"No incidents embedded in {field} to snapshot")
+    if not all(isinstance(key, ObjectId) for key in object_ids):
+        logger.warning("CorpusSnapshot: Incidents without ObjectId _ids; change events cannot be applied to the snapshot")
+        object_ids = None
+    return write_snapshot(path, documents, np.array(embeddings, dtype=np.float32),
+                          dtype=dtype, object_ids=object_ids,
+                          metadata={"collection": collection.name, "field": field, "model_id": model_id,
+                                    "resume_token": resume_token})
+
+
+class SnapshotDocuments(Sequence):
+    """Incident documents ({"id", "title", "description"}) decoded from a snapshot on access."""
+
+    def __init__(self, ids: np.ndarray, offsets: np.ndarray, text: np.ndarray):
+        self._ids = ids
+        self._offsets = offsets
+        self._text = text
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[index] for index in range(*row.indices(len(self)))]
+        row = int(row)
+        record = json.loads(self._text[int(self._offsets[row]):int(self._offsets[row + 1])].tobytes())
+        incident_id = int(self._ids[row])
+        return {"id": incident_id if incident_id >= 0 else None, **record}
+
+
+class CorpusSnapshot:
+    """
+    A snapshot file mapped read-only; open() it rather than constructing directly.
+
+    :param path: The snapshot file.
+    """
+
+    def __init__(self, path: str, header: dict, data_start: int):
+        self.path = path
+        self.header = header
+        self._sections = {
+            name: np.memmap(path, dtype=np.dtype(section["dtype"]), mode="r", offset=data_start + section["offset"],
+                            shape=tuple(section["shape"]))
+            if int(np.prod(section["shape"])) else np.empty(section["shape"], dtype=np.dtype(section["dtype"]))
+            for name, section in header["sections"].items()
+        }
+        self._data_start = data_start
+        self.documents = SnapshotDocuments(self._sections["ids"], self._sections["text_offsets"], self._sections["text"])
+
+    @classmethod
+    def open(cls, path: str = CORPUS_SNAPSHOT_PATH, verify: bool = False) -> "CorpusSnapshot":
+        """
+        Map a snapshot. Only the header is read; verify=True also checks the data's sha256 (reads the whole file).
+
+        :raises SnapshotError: Missing, unknown format, truncated, or (with verify) corrupt.
+        """
+        if not os.path.exists(path):
+            raise SnapshotError(f"No snapshot at {path}")
+        with open(path, "rb") as f:
+            preamble = f.read(_PREAMBLE.size)
+            if len(preamble) < _PREAMBLE.size:
+                raise SnapshotError(f"{path} is truncated")
+            magic, file_format, header_length = _PREAMBLE.unpack(preamble)
+            if magic != MAGIC:
+                raise SnapshotError(f"{path} is not a corpus snapshot")
+            if file_format != SNAPSHOT_FORMAT:
+                raise SnapshotError(f"{path} has snapshot format {file_format}, expected {SNAPSHOT_FORMAT}")
+            header = json_util.loads(f.read(header_length).decode("utf-8"))
+        data_start = _align(_PREAMBLE.size + header_length)
+        if os.path.getsize(path) != data_start + header["data_size"]:
+            raise SnapshotError(f"{path} is truncated ({os.path.getsize(path)} bytes, "
+                                f"expected {data_start + header['data_size']})")
+        snapshot = cls(path, header, data_start)
+        if verify:
+            snapshot.verify()
+        logger.info(f"CorpusSnapshot: Mapped {snapshot.count} incidents ({snapshot.dtype}) from {path}")
+        return snapshot
+
+    def verify(self) -> None:
+        """:raises SnapshotError: The data does not match the checksum in the header."""
+        digest = hashlib.sha256()
+        with open(self.path, "rb") as f:
+            f.seek(self._data_start)
+            while True:
+                block = f.read(_HASH_BLOCK_BYTES)
+                if not block:
+                    break
+                digest.update(block)
+        if digest.hexdigest() != self.header["sha256"]:
+            raise SnapshotError(f"{self.path} is corrupt (sha256 mismatch)")
+
+    @property
+    def count(self) -> int:
+        return self.header["count"]
+
+    @property
+    def dtype(self) -> str:
+        return self.header["dtype"]
+
+    @property
+    def field(self) -> str:
+        return self.header.get("field", "embedding")
+
+    @property
+    def resume_token(self) -> Optional[dict]:
+        return self.header.get("resume_token")
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._sections["vectors"]
+
+    @property
+    def scales(self) -> Optional[np.ndarray]:
+        return self._sections.get("scales")
+
+    @property
+    def bits(self) -> Optional[np.ndarray]:
+        return self._sections.get("bits")
+
+    @property
+    def has_object_ids(self) -> bool:
+        return "object_ids" in self._sections
+
+    def object_ids(self) -> Optional[list[ObjectId]]:
+        """The MongoDB _id of each incident, or None if the snapshot was built without them."""
+        if not self.has_object_ids:
+            return None
+        return [ObjectId(bytes(row)) for row in self._sections["object_ids"]]
+
+
+def load_snapshot(path: str = CORPUS_SNAPSHOT_PATH, field: Optional[str] = None,
+                  verify: bool = False) -> Optional[CorpusSnapshot]:
+    """The snapshot at path if it exists, is readable and (when given) holds field; None otherwise."""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        snapshot = CorpusSnapshot.open(path, verify=verify)
+    except SnapshotError as e:
+        logger.error(f"CorpusSnapshot: Ignoring {path}: {e}")
+        return None
+    if field is not None and snapshot.field != field:
+        logger.warning(f"CorpusSnapshot: {path} holds {snapshot.field}, not {field}; ignoring it")
+        return None
+    return snapshot
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Build, verify or describe the memory-mapped corpus snapshot.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Export the active version's embedded incidents")
+    build.add_argument("--output", default=CORPUS_SNAPSHOT_PATH)
+    build.add_argument("--dtype", default=LOCAL_INDEX_DTYPE, choices=("float32", "float16", "int8", "binary"))
+    for name in ("verify", "info"):
+        command = commands.add_parser(name, help="Check the checksum" if name == "verify" else "Print the header")
+        command.add_argument("path", nargs="?", default=CORPUS_SNAPSHOT_PATH)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "build":
+        from processors.embedding_versions import active_version
+        from utils.registry import registry, register_default_components
+        register_default_components()
+        collection = registry.get("collection")
+        version = active_version(collection)
+        try:
+            header = build_snapshot(collection, args.output, field=version.field, dtype=args.dtype,
+                                    model_id=version.model_id)
+        except SnapshotError as e:
+            print(e)
+            return 1
+        print(f"Wrote {header['count']} incidents ({version.name}, {args.dtype}) to {args.output}")
+        return 0
+    try:
+        snapshot = CorpusSnapshot.open(args.path, verify=args.command == "verify")
+    except SnapshotError as e:
+        print(e)
+        return 1
+    if args.command == "verify":
+        print(f"{args.path}: OK ({snapshot.count} incidents, sha256 {snapshot.header['sha256'][:12]})")
+    else:
+        print(json_util.dumps({key: value for key, value in snapshot.header.items() if key != "sections"}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
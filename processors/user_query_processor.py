@@ -1,23 +1,220 @@
 from processors.embeddings import EmbeddingModel 
-from pymongo.collection import Collection
+from typing import TYPE_CHECKING, Callable, Optional
+import numpy as np
+from processors.chunking import pool_chunk_hits
+from processors.diversification import diversify
+from processors.embedding_versions import LEGACY_VERSION, EmbeddingVersion, aactive_version, active_version
+from processors.log_compression import compress_for_model
+from processors.quantization import EMBEDDING_FIELDS, decode_embedding, embedding_projection, query_vector
+from utils.config import (
+    BINARY_RESCORE_CANDIDATES, CHUNK_CANDIDATES, CHUNK_COLLECTION_NAME, CHUNK_RETRIEVAL_ENABLED,
+    EMBEDDING_STORAGE_FORMAT, MMR_ENABLED, RETRIEVAL_CANDIDATES, RETRIEVAL_TOP_K, TWO_STAGE_CANDIDATES,
+)
+from utils.deadline import Deadline
+from utils.admission import admission
+from utils.metrics import track_stage
+
+if TYPE_CHECKING:
+    from pymongo.asynchronous.collection import AsyncCollection
+    from pymongo.collection import Collection
+    from processors.local_index import LocalVectorIndex
 
 class UserQueryProcessor:
-    def __init__(self, user_query: str ,embedding_model: EmbeddingModel):
+    def __init__(self, user_query: str ,embedding_model: EmbeddingModel, local_index: Optional["LocalVectorIndex"] = None):
+        """
+        :param local_index: Search this in-memory index (e.g. kept in sync by processors.index_sync) instead of
+                            Atlas, when it holds the active version's field.
+        """
         self.user_query = user_query
         self.embedding_model = embedding_model
+        self.local_index = local_index
+        # Set by process_query: the query's embedding (unless a fallback one) and the version it was embedded for
+        self.query_embedding = None
+        self.version: Optional[EmbeddingVersion] = None
+
+    def process_query(self,collection: "Collection", deadline: Optional[Deadline] = None) -> list[str]:
+        """
+        Find the incidents most similar to the user query.
+
+        :param deadline: Optional request deadline; bounds the embedding call and is passed to Atlas as maxTimeMS.
+        """
+        with track_stage("retrieval"):
+            return self._process_query(collection, deadline)
+
+    def _process_query(self, collection: "Collection", deadline: Optional[Deadline] = None) -> list[str]:
+        # Pasted logs are embedded as their compressed templates rather than thousands of raw lines
+        query_text = compress_for_model(self.user_query)
+        # The query is embedded with the model of the version the collection is served from
+        version = active_version(collection)
+        embedding_model = self.embedding_model.for_version(version)
+        query_embedding = embedding_model.get_embeddings([query_text], deadline=deadline)[0]  # shape: (384,)
+        self._record_query_embedding(query_embedding, version, embedding_model)
+        if self._uses_local_index(version):
+            return [f"{r['title']}\n{r['description']}" for r in self.search_local(query_embedding)]
+        collection, pipeline, finish = self._search_plan(query_embedding, collection, version, embedding_model)
+
+        # .aggregate() method in MongoDB is used to process data records through a pipeline of operations like vector search
+        aggregate_options = {}
+        if deadline is not None:
+            deadline.check("atlas_search")
+            aggregate_options["maxTimeMS"] = max(1, deadline.remaining_ms())
+
+        queue_timeout = deadline.timeout() if deadline is not None else None
+        with admission.limit("atlas_search", timeout=queue_timeout), track_stage("atlas_search"):
+            if deadline is not None:
+                # Re-read the budget after any admission queueing
+                aggregate_options["maxTimeMS"] = max(1, deadline.remaining_ms())
+            results = list(collection.aggregate(pipeline, **aggregate_options))
+        results = finish(results)
+
+        # Combine incident descriptions for LLM input
+        incident_texts = [f"{r['title']}\n{r['description']}" for r in results]
+
+        return incident_texts
+
+    async def aprocess_query(self, collection: "AsyncCollection", deadline: Optional[Deadline] = None) -> list[str]:
+        """
+        Async process_query() for a PyMongo AsyncCollection, embedding through EmbeddingModel.aget_embeddings.
+        """
+        with track_stage("retrieval"):
+            query_text = compress_for_model(self.user_query)
+            version = await aactive_version(collection)
+            embedding_model = self.embedding_model.for_version(version)
+            query_embedding = (await embedding_model.aget_embeddings([query_text], deadline=deadline))[0]
+            self._record_query_embedding(query_embedding, version, embedding_model)
+            if self._uses_local_index(version):
+                return [f"{r['title']}\n{r['description']}" for r in self.search_local(query_embedding)]
+            collection, pipeline, finish = self._search_plan(query_embedding, collection, version, embedding_model)
+
+            aggregate_options = {}
+            if deadline is not None:
+                deadline.check("atlas_search")
+            queue_timeout = deadline.timeout() if deadline is not None else None
+            async with admission.alimit("atlas_search", timeout=queue_timeout):
+                with track_stage("atlas_search"):
+                    if deadline is not None:
+                        aggregate_options["maxTimeMS"] = max(1, deadline.remaining_ms())
+                    cursor = await collection.aggregate(pipeline, **aggregate_options)
+                    results = await cursor.to_list()
+            results = finish(results)
+
+            return [f"{r['title']}\n{r['description']}" for r in results]
+
+    def _record_query_embedding(self, query_embedding, version: EmbeddingVersion, embedding_model) -> None:
+        # Fallback embeddings are not in the model's space; nothing may compare them with stored vectors
+        if embedding_model.last_path != "fallback":
+            self.query_embedding, self.version = query_embedding, version
+
+    def _uses_local_index(self, version: EmbeddingVersion) -> bool:
+        return self.local_index is not None and self.local_index.field == version.field
+
+    def search_local(self, query_embedding) -> list[dict]:
+        """
+        The k incidents from the local index, selected as for Atlas results. The index ranks by
+        full-precision similarity, so nothing is rescored; it holds incidents, not chunks.
+        """
+        with track_stage("local_search"):
+            candidates = RETRIEVAL_CANDIDATES if MMR_ENABLED else RETRIEVAL_TOP_K
+            matches = self.local_index.search(query_embedding, k=candidates, return_embeddings=MMR_ENABLED)[0]
+            return self.select_results(query_embedding, matches, rescore=False)
 
-    def process_query(self,collection: Collection) -> list[str]:
-        query_embedding = self.embedding_model.get_embeddings([self.user_query])[0]  # shape: (384,)
+    def _search_plan(self, query_embedding, collection, version: EmbeddingVersion,
+                     embedding_model: EmbeddingModel) -> tuple[object, list[dict], Callable[[list[dict]], list[dict]]]:
+        """
+        The collection to search, its $vectorSearch pipeline, and the function turning the hits into
+        the k incidents: chunk search pooled per incident when CHUNK_RETRIEVAL_ENABLED, otherwise
+        incident search (two-stage when the version's model has a projection).
+        """
+        if CHUNK_RETRIEVAL_ENABLED:
+            rescore = EMBEDDING_STORAGE_FORMAT == "binary"
 
+            def _finish_chunks(hits: list[dict]) -> list[dict]:
+                incidents = pool_chunk_hits(self.decode_candidates(query_embedding, hits, rescore))
+                return self.select_results(query_embedding, incidents, rescore=False)
+
+            chunk_collection = collection.database[CHUNK_COLLECTION_NAME]
+            pipeline = self.build_chunk_search_pipeline(query_embedding, version=version)
+            return chunk_collection, pipeline, _finish_chunks
+
+        coarse_embedding = embedding_model.reduce(query_embedding)
+        rescore = self.needs_rescore(coarse_embedding)
+        pipeline = self.build_search_pipeline(query_embedding, coarse_embedding=coarse_embedding, version=version)
+        return collection, pipeline, lambda results: self.select_results(query_embedding, results, rescore=rescore)
+
+    @staticmethod
+    def select_results(query_embedding, results: list[dict], k: int = RETRIEVAL_TOP_K,
+                       rescore: bool = EMBEDDING_STORAGE_FORMAT == "binary") -> list[dict]:
+        """
+        Reduce over-fetched candidates to the k incidents passed to the LLM: MMR with
+        near-duplicate suppression when enabled, otherwise the top k by score.
+
+        :param rescore: Re-rank by full-precision similarity first, for candidates from a coarse
+                        (binary or reduced-dimension) search; see needs_rescore().
+        """
+        candidates = max(k, RETRIEVAL_CANDIDATES)
+        # Without a rescore the order is final, so only the candidates that are kept are decoded
+        if not rescore:
+            results = results[:candidates]
+        results = UserQueryProcessor.decode_candidates(query_embedding, results, rescore)[:candidates]
+        if MMR_ENABLED:
+            return diversify(query_embedding, results, k)
+        return [{key: value for key, value in r.items() if key != "embedding"} for r in results[:k]]
+
+    @staticmethod
+    def needs_rescore(coarse_embedding=None) -> bool:
+        """Whether Atlas scores are coarse: binary storage, or a search over the reduced vectors."""
+        return coarse_embedding is not None or EMBEDDING_STORAGE_FORMAT == "binary"
+
+    @staticmethod
+    def decode_candidates(query_embedding, results: list[dict], rescore: bool = EMBEDDING_STORAGE_FORMAT == "binary") -> list[dict]:
+        """
+        Replace stored (possibly quantized) embedding fields with a float32 "embedding";
+        with rescore, re-rank by exact cosine similarity against the float query.
+        """
+        decoded = []
+        for r in results:
+            embedding = decode_embedding(r)
+            candidate = {key: value for key, value in r.items() if key not in EMBEDDING_FIELDS}
+            if embedding is not None:
+                candidate["embedding"] = embedding
+            decoded.append(candidate)
+        if rescore and decoded and all("embedding" in r for r in decoded):
+            matrix = np.array([r["embedding"] for r in decoded], dtype=np.float32)
+            query = np.asarray(query_embedding, dtype=np.float32)
+            scores = matrix @ query / np.maximum(np.linalg.norm(matrix, axis=1) * np.linalg.norm(query), 1e-12)
+            for r, score in zip(decoded, scores):
+                r["score"] = float(score)
+            decoded.sort(key=lambda r: -r["score"])
+        return decoded
+
+    @staticmethod
+    def build_search_pipeline(query_embedding, limit: Optional[int] = None, coarse_embedding=None,
+                              version: EmbeddingVersion = LEGACY_VERSION) -> list[dict]:
+        """
+        The $vectorSearch aggregation for one query embedding.
+
+        :param limit: Results to fetch (default: RETRIEVAL_CANDIDATES when MMR is enabled, else RETRIEVAL_TOP_K).
+                      Candidates carry their embeddings so select_results can diversify them.
+        :param coarse_embedding: The query's reduced vector (EmbeddingModel.reduce); when given, the search
+                                 runs over "embedding_reduced" and the candidates are reranked at full dimension.
+        :param version: Embedding version whose field and vector indexes are searched (see processors.embedding_versions).
+        """
+        limit = limit or (RETRIEVAL_CANDIDATES if MMR_ENABLED else RETRIEVAL_TOP_K)
+        rescore = UserQueryProcessor.needs_rescore(coarse_embedding)
+        if coarse_embedding is not None:
+            limit = max(limit, TWO_STAGE_CANDIDATES)
+        elif rescore:
+            # The binary first pass is coarse; fetch more candidates for the full-precision rescore
+            limit = max(limit, BINARY_RESCORE_CANDIDATES)
         # Perform vector search in MongoDB Atlas
         pipeline = [
             {
                 "$vectorSearch": {
-                    "queryVector": query_embedding.tolist(), # embedding of your query
-                    "path": "embedding", # field in MongoDB that holds the embeddings
-                    "numCandidates": 100, # How many documents MongoDB considers before picking top limit results
-                    "limit": 5, #How many top similar results you want
-                    "index": "embedding_vector_index"  # name of the index you created
+                    "queryVector": query_vector(query_embedding), # embedding of your query, in the stored format
+                    "path": version.field, # field in MongoDB that holds the embeddings
+                    "numCandidates": max(100, limit * 10), # How many documents MongoDB considers before picking top limit results
+                    "limit": limit, #How many top similar results you want
+                    "index": version.index_name  # name of the index you created
                 }
             },
             {
@@ -31,11 +228,41 @@ class UserQueryProcessor:
                 }
             }
         ]
+        if coarse_embedding is not None:
+            pipeline[0]["$vectorSearch"].update({
+                "queryVector": np.asarray(coarse_embedding, dtype=np.float32).tolist(),
+                "path": version.reduced_field,
+                "index": version.reduced_index_name,
+            })
+        if MMR_ENABLED or rescore:
+            # Candidate vectors for rescoring and MMR diversification (stripped again by select_results)
+            pipeline[1]["$project"].update(embedding_projection(field=version.field))
+        return pipeline
 
-        # .aggregate() method in MongoDB is used to process data records through a pipeline of operations like vector search
-        results = list(collection.aggregate(pipeline))
+    @staticmethod
+    def build_chunk_search_pipeline(query_embedding, limit: int = CHUNK_CANDIDATES,
+                                    version: EmbeddingVersion = LEGACY_VERSION) -> list[dict]:
+        """
+        The $vectorSearch aggregation over the chunk collection (see processors.chunking).
 
-        # Combine incident descriptions for LLM input
-        incident_texts = [f"{r['title']}\n{r['description']}" for r in results]
-
-        return incident_texts
\ No newline at end of file
+        Several chunks of one incident can match, so more hits than incidents are fetched
+        and pooled per incident afterwards.
+        """
+        if EMBEDDING_STORAGE_FORMAT == "binary":
+            limit = max(limit, BINARY_RESCORE_CANDIDATES)
+        project = {"_id": 0, "incident_id": 1, "chunk_index": 1, "title": 1, "text": 1,
+                   "score": {"$meta": "vectorSearchScore"}}
+        if MMR_ENABLED or EMBEDDING_STORAGE_FORMAT == "binary":
+            project.update(embedding_projection(field=version.field))
+        return [
+            {
+                "$vectorSearch": {
+                    "queryVector": query_vector(query_embedding),
+                    "path": version.field,
+                    "numCandidates": max(100, limit * 10),
+                    "limit": limit,
+                    "index": version.chunk_index_name,
+                }
+            },
+            {"$project": project},
+        ]
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules import each other as top-level packages (processors, utils), as when run from the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
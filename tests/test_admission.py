@@ -0,0 +1,58 @@
+import threading
+import pytest
+from utils.admission import AdmissionController, BusyError, is_overload_error
+from utils.deadline import Deadline, DeadlineExceeded, call_with_deadline
+
+
+@pytest.fixture
+def controller():
+    return AdmissionController(limits={"llm": {"initial_limit": 2, "max_queue": 1, "queue_timeout_s": 0.05}},
+                               enabled=True)
+
+
+def test_deadline_expiry_is_not_an_overload_signal():
+    assert not is_overload_error(DeadlineExceeded("budget spent"))
+    assert is_overload_error(TimeoutError("read timed out"))
+
+
+def test_expired_budget_does_not_shrink_the_limit(controller):
+    limiter = controller.limiter("llm")
+    with pytest.raises(DeadlineExceeded):
+        with controller.limit("llm"):
+            Deadline(0).check("llm")
+    assert limiter.limit == 2
+    assert limiter.in_flight == 0
+
+
+def test_abandoned_call_keeps_its_slot_until_it_finishes(controller):
+    limiter = controller.limiter("llm")
+    release = threading.Event()
+    finished = threading.Event()
+
+    def _slow():
+        release.wait(5)
+        finished.set()
+
+    with pytest.raises(DeadlineExceeded):
+        with controller.limit("llm"):
+            call_with_deadline(_slow, Deadline(0.05), "llm")
+    assert limiter.in_flight == 1
+    assert limiter.limit == 2
+
+    release.set()
+    finished.wait(5)
+    for _ in range(100):
+        if limiter.in_flight == 0:
+            break
+        threading.Event().wait(0.01)
+    assert limiter.in_flight == 0
+
+
+def test_full_queue_is_shed(controller):
+    limiter = controller.limiter("llm")
+    limiter.acquire()
+    limiter.acquire()
+    with pytest.raises(BusyError):
+        limiter.acquire(timeout=0)
+    limiter.release()
+    limiter.release()
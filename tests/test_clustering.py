@@ -0,0 +1,64 @@
+import numpy as np
+from processors.clustering import IncidentClusters, spherical_kmeans
+
+
+def _modes(count: int = 4, per_mode: int = 30, dim: int = 32, noise: float = 0.05, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    modes = rng.standard_normal((count, dim))
+    embeddings = np.repeat(modes, per_mode, axis=0) + noise * rng.standard_normal((count * per_mode, dim))
+    return modes, embeddings, np.repeat(np.arange(count), per_mode)
+
+
+def test_kmeans_recovers_well_separated_modes():
+    _, embeddings, truth = _modes()
+    centroids, labels, similarities = spherical_kmeans(embeddings, k=4, seed=1)
+
+    assert centroids.shape == (4, 32)
+    np.testing.assert_allclose(np.linalg.norm(centroids, axis=1), 1.0, atol=1e-5)
+    # Same partition up to relabelling
+    for mode in range(4):
+        assert len(set(labels[truth == mode])) == 1
+    assert len(set(labels)) == 4
+    assert similarities.min() > 0.9
+
+
+def test_kmeans_caps_k_and_handles_an_empty_input():
+    centroids, labels, _ = spherical_kmeans(np.eye(3), k=10)
+    assert len(centroids) == 3 and sorted(labels) == [0, 1, 2]
+    centroids, labels, similarities = spherical_kmeans(np.zeros((0, 8)), k=3)
+    assert centroids.shape == (0, 8) and len(labels) == len(similarities) == 0
+
+
+def _clusters(modes, analysed=(True, True, True, False)):
+    return IncidentClusters([
+        {"cluster": index, "centroid": mode.tolist(), "threshold": 0.9, "size": 30, "label": f"mode {index}",
+         "analysis": {"root_cause_summary": f"cause {index}", "troubleshooting_steps": []} if analysed[index] else None,
+         "incident_ids": [index]}
+        for index, mode in enumerate(modes)], min_similarity=0.85, min_margin=0.03)
+
+
+def test_query_inside_an_analysed_cluster_matches_it():
+    modes, _, _ = _modes()
+    match = _clusters(modes).match(modes[1] + 0.01)
+    assert match["cluster"] == 1
+    assert match["analysis"]["root_cause_summary"] == "cause 1"
+
+
+def test_no_match_outside_clusters_for_unanalysed_ones_or_another_field():
+    modes, _, _ = _modes()
+    clusters = _clusters(modes)
+    assert clusters.match(np.random.default_rng(5).standard_normal(32)) is None
+    assert clusters.match(modes[3]) is None
+    assert clusters.match(modes[1], field="embedding_v2") is None
+    assert clusters.match(modes[1][:10]) is None
+
+
+def test_query_between_two_clusters_does_not_match():
+    modes, _, _ = _modes()
+    close_pair = np.stack([modes[0], modes[0] + 0.02 * modes[1]])
+    clusters = _clusters(close_pair, analysed=(True, True))
+    assert clusters.match(modes[0] + 0.01 * modes[1]) is None
+
+
+def test_no_clusters_never_match():
+    assert IncidentClusters([]).match(np.ones(32)) is None
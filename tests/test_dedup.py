@@ -0,0 +1,47 @@
+from processors.dedup import LSHIndex, MinHasher, deduplicate, find_duplicate_groups
+
+BASE = ("Sidekiq queue saturation on the catchall shard caused job latency above ten minutes; "
+        "the apdex for background processing dropped below the alert threshold in production")
+
+
+def _incident(incident_id, description, title="Sidekiq latency alert"):
+    return {"id": incident_id, "title": title, "description": description}
+
+
+def test_signature_agreement_estimates_jaccard_similarity():
+    hasher = MinHasher()
+    same = hasher.signatures([BASE, BASE])
+    assert (same[0] == same[1]).all()
+    near = hasher.signatures([BASE, BASE + " again"])
+    assert (near[0] == near[1]).mean() > 0.8
+    unrelated = hasher.signatures([BASE, "Certificate for registry.gitlab.com expired and pulls failed"])
+    assert (unrelated[0] == unrelated[1]).mean() < 0.2
+
+
+def test_identical_signatures_share_an_lsh_bucket():
+    hasher = MinHasher()
+    index = LSHIndex()
+    for key, text in enumerate([BASE, BASE, "Certificate for registry.gitlab.com expired"]):
+        index.add(key, hasher.signature(text))
+    assert [0, 1] in index.candidate_buckets()
+
+
+def test_near_duplicates_are_grouped_and_distinct_incidents_are_not():
+    documents = [
+        _incident(1, BASE),
+        _incident(2, "Certificate for registry.gitlab.com expired and image pulls failed", "Registry TLS"),
+        _incident(3, BASE + " (second occurrence)"),
+        _incident(4, BASE),
+    ]
+    assert find_duplicate_groups(documents) == [[0, 2, 3], [1]]
+
+
+def test_representative_is_the_longest_member_and_lists_the_others():
+    documents = [_incident(1, BASE), _incident(2, BASE + " (second occurrence)"), _incident(3, "Disk full on gitaly")]
+    representatives, duplicate_of = deduplicate(documents)
+
+    assert [doc["id"] for doc in representatives] == [2, 3]
+    assert representatives[0]["duplicate_ids"] == [1]
+    assert representatives[1]["duplicate_ids"] == []
+    assert duplicate_of == {1: 2}
+    assert "duplicate_ids" not in documents[1]
@@ -0,0 +1,38 @@
+import numpy as np
+from processors.diversification import diversify, mmr_select
+
+QUERY = np.array([1.0, 0.0, 0.0])
+
+
+def test_first_pick_is_the_most_relevant_candidate():
+    candidates = np.array([[0.5, 0.5, 0.0], [1.0, 0.1, 0.0], [0.0, 1.0, 0.0]])
+    assert mmr_select(QUERY, candidates, k=1)[0] == 1
+
+
+# The second candidate is more relevant than the third but almost a copy of the first
+RANKED = np.array([[1.0, 0.9, 0.0], [1.0, 0.8, 0.0], [0.6, 1.0, 0.5]])
+
+
+def test_diverse_candidate_beats_a_close_copy_of_the_first_pick():
+    assert mmr_select([1.0, 1.0, 0.0], RANKED, k=2, lambda_mult=0.5, duplicate_threshold=1.0) == [0, 2]
+
+
+def test_relevance_only_keeps_retrieval_ranking():
+    assert mmr_select([1.0, 1.0, 0.0], RANKED, k=3, lambda_mult=1.0, duplicate_threshold=1.0) == [0, 1, 2]
+
+
+def test_near_duplicates_of_a_selected_candidate_are_dropped():
+    candidates = np.array([[1.0, 0.0, 0.0], [1.0, 0.001, 0.0], [0.0, 1.0, 0.0]])
+    assert mmr_select(QUERY, candidates, k=3, duplicate_threshold=0.99) == [0, 2]
+
+
+def test_empty_candidates_or_k():
+    assert mmr_select(QUERY, np.zeros((0, 3)), k=3) == []
+    assert mmr_select(QUERY, np.eye(3), k=0) == []
+
+
+def test_diversify_drops_embeddings_and_fills_up_with_unembedded_results():
+    results = [{"id": 1, "embedding": [1.0, 0.0, 0.0]}, {"id": 2}, {"id": 3, "embedding": [0.0, 1.0, 0.0]}, {"id": 4}]
+    chosen = diversify(QUERY, results, k=3)
+    assert [doc["id"] for doc in chosen] == [1, 3, 2]
+    assert all("embedding" not in doc for doc in chosen)
@@ -0,0 +1,108 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from utils.config import EMBEDDING_VERSIONS_COLLECTION
+from processors.embedding_versions import (
+    ACTIVE, ACTIVE_POINTER_ID, LEGACY_VERSION, RETIRED, CutoverError, EmbeddingVersion, EmbeddingVersionStore,
+)
+
+V2 = EmbeddingVersion(name="v2", model_id="BAAI/bge-base-en-v1.5", dimensions=768, field="embedding_v2",
+                      index_name="embedding_v2_vector_index", chunk_index_name="chunk_embedding_v2_vector_index")
+
+
+class _VersionsCollection:
+    """The version documents, with update_one matching every filter key by equality (enough for the CAS)."""
+
+    def __init__(self, documents: list[dict]):
+        self.documents = {document["_id"]: dict(document) for document in documents}
+        # Runs just before each update, to interleave a concurrent writer
+        self.before_update = None
+
+    def find_one(self, query: dict):
+        document = self.documents.get(query["_id"])
+        return dict(document) if document else None
+
+    def update_one(self, query: dict, update: dict):
+        if self.before_update is not None:
+            self.before_update()
+        document = self.documents.get(query["_id"])
+        if document is None or any(document.get(key) != value for key, value in query.items()):
+            return SimpleNamespace(modified_count=0)
+        document.update(update["$set"])
+        return SimpleNamespace(modified_count=1)
+
+
+class _AsyncVersionsCollection:
+    """The awaitable find_one of an AsyncCollection over the same documents."""
+
+    def __init__(self, collection: _VersionsCollection):
+        self.collection = collection
+
+    async def find_one(self, query: dict):
+        return self.collection.find_one(query)
+
+
+@pytest.fixture
+def store():
+    versions = _VersionsCollection([
+        {"_id": ACTIVE_POINTER_ID, "version": LEGACY_VERSION.name},
+        LEGACY_VERSION.to_document(),
+        V2.to_document(),
+    ])
+    store = EmbeddingVersionStore({EMBEDDING_VERSIONS_COLLECTION: versions}, cache_seconds=60)
+    # Fully back-filled: every document the active version serves has the new field
+    store.coverage = lambda version, active=None: {"incidents": (10, 10), "incident_chunks": (4, 4)}
+    return store
+
+
+def test_cutover_switches_the_pointer_and_statuses(store):
+    version = store.cutover("v2", check_indexes=False)
+
+    assert version.name == "v2" and version.status == ACTIVE
+    assert store.versions.documents[ACTIVE_POINTER_ID]["version"] == "v2"
+    assert store.versions.documents["v2"]["status"] == ACTIVE
+    assert store.versions.documents["v1"]["status"] == RETIRED
+    assert store.active().name == "v2"
+
+
+def test_cutover_loses_to_a_concurrent_one(store):
+    def _other_cutover():
+        store.versions.documents[ACTIVE_POINTER_ID]["version"] = "v3"
+        store.versions.before_update = None
+
+    store.versions.before_update = _other_cutover
+    with pytest.raises(CutoverError, match="changed from v1"):
+        store.cutover("v2", check_indexes=False)
+    assert store.versions.documents[ACTIVE_POINTER_ID]["version"] == "v3"
+    assert store.versions.documents["v2"]["status"] != ACTIVE
+
+
+def test_cutover_requires_full_coverage(store):
+    store.coverage = lambda version, active=None: {"incidents": (9, 10), "incident_chunks": (4, 4)}
+    with pytest.raises(CutoverError, match="9/10"):
+        store.cutover("v2", check_indexes=False)
+    assert store.versions.documents[ACTIVE_POINTER_ID]["version"] == "v1"
+
+
+def test_cutover_to_the_active_version_is_a_no_op(store):
+    assert store.cutover("v1", check_indexes=False).name == "v1"
+    assert store.versions.documents[ACTIVE_POINTER_ID]["version"] == "v1"
+
+
+@pytest.mark.parametrize("pointer", ["v1", "v2"])
+def test_async_active_matches_the_sync_lookup(store, pointer):
+    store.versions.documents[ACTIVE_POINTER_ID]["version"] = pointer
+    store.versions.documents["v1"]["status"] = RETIRED
+    async_store = EmbeddingVersionStore({EMBEDDING_VERSIONS_COLLECTION: _AsyncVersionsCollection(store.versions)})
+
+    assert asyncio.run(async_store.aactive()) == store.active(fresh=True)
+
+
+def test_async_active_pointing_at_a_missing_version(store):
+    store.versions.documents[ACTIVE_POINTER_ID]["version"] = "v3"
+    async_store = EmbeddingVersionStore({EMBEDDING_VERSIONS_COLLECTION: _AsyncVersionsCollection(store.versions)})
+
+    with pytest.raises(KeyError, match="Unknown embedding version: v3"):
+        asyncio.run(async_store.aactive())
+    with pytest.raises(KeyError, match="Unknown embedding version: v3"):
+        store.active(fresh=True)
@@ -0,0 +1,86 @@
+import json
+import pytest
+from processors import ingestion
+from processors.ingestion import IngestionManifest, IngestionRunner
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = IngestionManifest(str(tmp_path / "manifest.json"), {"batch_size": 10})
+    manifest.reset()
+    return manifest
+
+
+def test_batches_finished_out_of_order_advance_last_batch_once_contiguous(manifest):
+    manifest.complete_batch("embed", 2, items=5)
+    manifest.complete_batch("embed", 0, items=5)
+    assert manifest.stage("embed")["last_batch"] == 0
+    assert manifest.stage("embed")["completed"] == [2]
+    assert manifest.batch_done("embed", 0) and manifest.batch_done("embed", 2)
+    assert not manifest.batch_done("embed", 1)
+
+    manifest.complete_batch("embed", 1, items=5)
+    assert manifest.stage("embed")["last_batch"] == 2
+    assert manifest.stage("embed")["completed"] == []
+    assert manifest.stage("embed")["count"] == 15
+    assert all(manifest.batch_done("embed", index) for index in range(3))
+    assert not manifest.batch_done("embed", 3)
+
+
+def test_stages_track_batches_independently(manifest):
+    manifest.complete_batch("embed", 0)
+    assert manifest.batch_done("embed", 0)
+    assert not manifest.batch_done("write", 0)
+
+
+def test_progress_survives_a_reload(manifest):
+    manifest.complete_batch("write", 1)
+    manifest.complete_batch("write", 0)
+    reloaded = IngestionManifest(manifest.path, {"batch_size": 10})
+    assert reloaded.load()
+    assert reloaded.stage("write")["last_batch"] == 1
+    assert reloaded.batch_done("write", 1)
+
+
+def test_changed_settings_or_finished_run_are_not_resumed(manifest):
+    manifest.complete_batch("embed", 0)
+    assert not IngestionManifest(manifest.path, {"batch_size": 20}).load()
+    manifest.complete()
+    assert not IngestionManifest(manifest.path, {"batch_size": 10}).load()
+
+
+def _resuming_runner(tmp_path, manifest, monkeypatch) -> IngestionRunner:
+    # Only what the fetch source touches; a full runner needs a database
+    monkeypatch.setattr(ingestion, "INCIDENTS_PATH", str(tmp_path / "no_export.pkl"))
+    runner = object.__new__(IngestionRunner)
+    runner.work_dir = str(tmp_path)
+    runner.manifest = manifest
+    runner.gitlab = None
+    return runner
+
+
+def test_resume_truncates_spool_lines_of_an_uncheckpointed_page(tmp_path, manifest, monkeypatch):
+    runner = _resuming_runner(tmp_path, manifest, monkeypatch)
+    with open(runner.spool_path, "w", encoding="utf-8") as spool:
+        for incident_id in range(5):
+            spool.write(json.dumps({"id": incident_id}) + "\n")
+    # Pages of 3 and 2 incidents were spooled, but only the first was checkpointed before the crash
+    manifest.update("fetch", last_page=1, count=3, done=True)
+
+    pages = list(runner._pages())
+
+    assert [incident["id"] for incident in pages[0].incidents] == [0, 1, 2]
+    assert pages[0].spooled and pages[0].number == 1
+    assert pages[-1] is ingestion._FETCH_DONE
+    with open(runner.spool_path, encoding="utf-8") as spool:
+        assert [json.loads(line)["id"] for line in spool] == [0, 1, 2]
+
+
+def test_resume_without_checkpointed_pages_empties_the_spool(tmp_path, manifest, monkeypatch):
+    runner = _resuming_runner(tmp_path, manifest, monkeypatch)
+    with open(runner.spool_path, "w", encoding="utf-8") as spool:
+        spool.write(json.dumps({"id": 1}) + "\n")
+    manifest.update("fetch", done=True)
+
+    assert list(runner._pages()) == [ingestion._FETCH_DONE]
+    assert open(runner.spool_path, encoding="utf-8").read() == ""
@@ -0,0 +1,38 @@
+from processors.log_compression import LogTemplateMiner, compress_log
+
+
+def test_lines_differing_only_in_variables_share_a_template():
+    miner = LogTemplateMiner().add_lines([
+        "2024-05-01T10:00:01Z INFO worker-3 heartbeat ok latency=12ms",
+        "2024-05-01T10:00:02Z INFO worker-17 heartbeat ok latency=80ms",
+        "2024-05-01T10:00:03Z INFO worker-5 heartbeat ok latency=3ms",
+        "2024-05-01T10:00:04Z ERROR db-primary connection refused after 3 retries",
+    ])
+    assert miner.line_count == 4
+    assert len(miner.clusters) == 2
+    assert [cluster.count for cluster in miner.clusters] == [3, 1]
+
+
+def test_blank_lines_are_ignored():
+    miner = LogTemplateMiner().add_lines(["", "   ", "service started"])
+    assert miner.line_count == 1
+    assert len(miner.clusters) == 1
+
+
+def test_compressed_log_keeps_rare_and_error_lines_and_is_smaller():
+    lines = [f"2024-05-01T10:{index // 60:02d}:{index % 60:02d}Z INFO worker-{index % 7} heartbeat ok latency={index}ms"
+             for index in range(500)]
+    lines.insert(250, "2024-05-01T10:04:10Z ERROR gitaly connection refused after 5 retries")
+    compressed = compress_log("\n".join(lines))
+
+    assert compressed.input_lines == 501
+    assert compressed.templates == 2
+    assert compressed.ratio > 10
+    assert "[Log compressed: 501 lines -> 2 templates." in compressed.text
+    assert "ERROR gitaly connection refused after 5 retries" in compressed.text
+
+
+def test_templates_over_the_limit_are_summarized():
+    lines = [f"event{index} happened" for index in range(10) for _ in range(5)]
+    compressed = compress_log(lines, max_templates=3)
+    assert compressed.text.endswith("more frequent templates (35 lines) omitted]")
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from bson.binary import Binary, BinaryVectorDtype
+from processors.quantization import (
+    STORAGE_FORMATS, binary_quantize, decode_embedding, encode_embedding, encode_embeddings, int8_quantize,
+)
+
+VECTORS = np.random.default_rng(0).standard_normal((5, 384)).astype(np.float32)
+
+
+def _encode_one(vector: np.ndarray, storage_format: str) -> dict:
+    """The per-vector encoding through Binary.from_vector that encode_embeddings must reproduce."""
+    if storage_format == "list":
+        return {"embedding": vector.tolist()}
+    if storage_format == "float32":
+        return {"embedding": Binary.from_vector(vector.tolist(), BinaryVectorDtype.FLOAT32)}
+    codes, scales = int8_quantize(vector)
+    int8_vector = Binary.from_vector(codes[0].tolist(), BinaryVectorDtype.INT8)
+    if storage_format == "int8":
+        return {"embedding": int8_vector, "embedding_scale": float(scales[0])}
+    return {"embedding": Binary.from_vector(binary_quantize(vector)[0].tolist(), BinaryVectorDtype.PACKED_BIT),
+            "embedding_rescore": int8_vector, "embedding_scale": float(scales[0])}
+
+
+@pytest.mark.parametrize("storage_format", STORAGE_FORMATS)
+def test_matrix_encoding_matches_per_vector_encoding(storage_format):
+    encoded = encode_embeddings(VECTORS, storage_format)
+    expected = [_encode_one(vector, storage_format) for vector in VECTORS]
+    assert encoded == expected
+    for fields, expected_fields in zip(encoded, expected):
+        for name, value in fields.items():
+            assert type(value) is type(expected_fields[name])
+            if isinstance(value, Binary):
+                assert value.subtype == expected_fields[name].subtype
+
+
+@pytest.mark.parametrize("storage_format", STORAGE_FORMATS)
+def test_versioned_field_names(storage_format):
+    fields = encode_embedding(VECTORS[0], storage_format, field="embedding_v2")
+    assert set(fields) == {name.replace("embedding", "embedding_v2", 1) for name in _encode_one(VECTORS[0], storage_format)}
+
+
+@pytest.mark.parametrize("storage_format", ["list", "float32", "int8", "binary"])
+def test_decoded_embedding_points_the_same_way(storage_format):
+    decoded = decode_embedding(encode_embedding(VECTORS[0], storage_format))
+    cosine = decoded @ VECTORS[0] / (np.linalg.norm(decoded) * np.linalg.norm(VECTORS[0]))
+    assert cosine > 0.99
+
+
+def test_empty_matrix_and_unknown_format():
+    assert encode_embeddings(np.zeros((0, 384)), "int8") == []
+    with pytest.raises(ValueError, match="Unknown embedding storage format"):
+        encode_embedding(VECTORS[0], "float16")
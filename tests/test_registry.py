@@ -0,0 +1,34 @@
+from utils.registry import ComponentRegistry
+
+
+def _failing():
+    raise RuntimeError("optional backend down")
+
+
+def test_readiness_of_named_components_ignores_failing_optional_ones():
+    registry = ComponentRegistry()
+    registry.register("collection", object)
+    registry.register("similarity_graph", _failing)
+    registry.warmup(background=False)
+
+    assert registry.is_ready(["collection"])
+    assert not registry.is_ready()
+    assert registry.status()["similarity_graph"]["error"] == "optional backend down"
+
+
+def test_later_background_warmup_builds_only_the_new_names():
+    registry = ComponentRegistry()
+    built = []
+    for name in ("a", "b"):
+        registry.register(name, lambda name=name: built.append(name) or name)
+
+    first = registry.warmup(["a"])
+    first.join()
+    assert registry.warmup(["a"]) is first
+
+    second = registry.warmup(["a", "b"])
+    assert second is not first
+    second.join()
+    assert built == ["a", "b"]
+    # Every registered name has been warmed, so the default call starts nothing new
+    assert registry.warmup() is second
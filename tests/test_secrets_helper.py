@@ -0,0 +1,39 @@
+import time
+import pytest
+from utils.secrets_helper import SecretProvider
+
+
+class _FlakyBackend:
+    """Returns "v1" once, then fails every call."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def fetch(self, secret_name):
+        self.calls += 1
+        if self.calls > 1:
+            raise ConnectionError("backend down")
+        return "v1"
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    monkeypatch.delenv("TEST_SECRET", raising=False)
+    return SecretProvider(_FlakyBackend(), ttl_seconds=0.05, refresh_ahead_seconds=0.0, negative_ttl_seconds=60)
+
+
+def test_stale_value_is_recached_when_the_backend_fails(provider):
+    assert provider.get("test-secret") == "v1"
+    time.sleep(0.06)
+
+    assert provider.get("test-secret") == "v1"
+    assert provider.get("test-secret") == "v1"
+    # The failed refresh re-cached the last good value, so the second lookup did not retry the backend
+    assert provider.backend.calls == 2
+
+
+def test_failed_first_lookup_is_negatively_cached(provider):
+    provider.backend.calls = 1
+    assert provider.get("test-secret") is None
+    assert provider.get("test-secret") is None
+    assert provider.backend.calls == 2
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from processors.similarity_graph import knn_graph
+
+
+def _brute_force(embeddings: np.ndarray, k: int) -> np.ndarray:
+    vectors = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    scores = vectors @ vectors.T
+    np.fill_diagonal(scores, -np.inf)
+    return np.sort(scores, axis=1)[:, ::-1][:, :k]
+
+
+@pytest.mark.parametrize("block_rows", [1, 7, 64, 1024])
+def test_blocked_top_k_matches_brute_force(block_rows):
+    embeddings = np.random.default_rng(0).standard_normal((50, 16)).astype(np.float32)
+    neighbours, scores = knn_graph(embeddings, k=5, block_rows=block_rows)
+
+    assert neighbours.shape == scores.shape == (50, 5)
+    np.testing.assert_allclose(scores, _brute_force(embeddings, 5), atol=1e-5)
+    assert (neighbours != np.arange(50)[:, np.newaxis]).all()
+    assert (np.diff(scores, axis=1) <= 0).all()
+
+
+def test_neighbours_are_the_closest_rows():
+    embeddings = np.array([[1.0, 0.0], [0.9, 0.1], [0.0, 1.0], [0.1, 0.9]], dtype=np.float32)
+    neighbours, _ = knn_graph(embeddings, k=1, block_rows=2)
+    assert neighbours[:, 0].tolist() == [1, 0, 3, 2]
+
+
+def test_k_is_capped_by_the_other_rows():
+    neighbours, scores = knn_graph(np.eye(3, dtype=np.float32), k=10)
+    assert neighbours.shape == (3, 2)
+    assert knn_graph(np.ones((1, 4), dtype=np.float32), k=10)[0].shape == (1, 0)
@@ -0,0 +1,116 @@
+import threading
+import pytest
+from utils.stage_pipeline import Stage, StagePipeline
+
+
+def test_items_flow_through_every_stage():
+    collected = []
+    lock = threading.Lock()
+
+    def _collect(item):
+        with lock:
+            collected.append(item)
+
+    stats = StagePipeline("test", [
+        Stage("double", lambda item: item * 2, workers=3),
+        Stage("split", lambda item: [item, item + 1], fan_out=True),
+        Stage("collect", _collect, workers=2),
+    ]).run(range(10))
+
+    assert sorted(collected) == sorted(value for item in range(10) for value in (item * 2, item * 2 + 1))
+    assert stats["stages"]["double"]["items"] == 10
+    assert stats["stages"]["collect"]["items"] == 20
+
+
+def test_flush_passes_on_what_is_left_after_the_last_item():
+    pending, batches = [], []
+
+    def _batch(item):
+        pending.append(item)
+        if len(pending) == 3:
+            batch = list(pending)
+            pending.clear()
+            return [batch]
+        return []
+
+    def _flush():
+        return [list(pending)] if pending else []
+
+    StagePipeline("test", [Stage("batch", _batch, fan_out=True, flush=_flush),
+                           Stage("collect", batches.append)]).run(range(7))
+
+    assert batches == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_stage_error_is_reraised_and_stops_the_source():
+    fed = []
+
+    def _source():
+        for item in range(10_000):
+            fed.append(item)
+            yield item
+
+    def _fail_on_five(item):
+        if item == 5:
+            raise ValueError("bad item")
+        return item
+
+    # Queues of one item: upstream workers blocked on put() must still drain for run() to return
+    pipeline = StagePipeline("test", [Stage("check", _fail_on_five, queue_size=1),
+                                      Stage("slow", lambda item: item, queue_size=1)])
+    with pytest.raises(ValueError, match="bad item"):
+        pipeline.run(_source())
+    assert pipeline.failed
+    assert len(fed) < 10_000
+
+
+def test_source_error_is_reraised():
+    def _source():
+        yield 1
+        raise RuntimeError("source broke")
+
+    with pytest.raises(RuntimeError, match="source broke"):
+        StagePipeline("test", [Stage("pass", lambda item: item)]).run(_source())
+
+
+def test_flush_is_skipped_after_an_error():
+    flushed = []
+
+    def _fail(item):
+        raise ValueError("bad")
+
+    with pytest.raises(ValueError):
+        StagePipeline("test", [Stage("fail", _fail, flush=lambda: flushed.append(True) or [])]).run([1])
+    assert flushed == []
+
+
+def test_stop_finishes_items_already_in_the_pipeline():
+    started = threading.Event()
+    release = threading.Event()
+    finished = []
+    fed = []
+
+    def _source():
+        for item in range(1_000):
+            fed.append(item)
+            yield item
+
+    def _slow(item):
+        started.set()
+        release.wait(5)
+        return item
+
+    pipeline = StagePipeline("test", [Stage("slow", _slow, queue_size=2), Stage("done", finished.append)])
+    runner = threading.Thread(target=pipeline.run, args=(_source(),))
+    runner.start()
+    started.wait(5)
+    pipeline.stop()
+    release.set()
+    runner.join(5)
+
+    assert not runner.is_alive()
+    assert not pipeline.failed
+    # Everything taken from the source made it to the end; the rest of the source was never read
+    assert sorted(finished) == list(range(len(finished)))
+    assert len(fed) - len(finished) <= 1
+    assert len(fed) < 1_000
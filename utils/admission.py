@@ -0,0 +1,296 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Iterator, Optional
+from utils.config import ADMISSION_CONTROL_ENABLED, ADMISSION_LIMITS
+from utils.deadline import DeadlineExceeded
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+LIMIT_GAUGE = metrics.gauge(
+    "devops_gpt_admission_limit", "Current concurrency limit per stage.", ("stage",))
+QUEUED_GAUGE = metrics.gauge(
+    "devops_gpt_admission_queued", "Calls waiting for a concurrency slot per stage.", ("stage",))
+SHED_COUNTER = metrics.counter(
+    "devops_gpt_admission_shed_total", "Calls rejected by admission control, by stage and reason.", ("stage", "reason"))
+QUEUE_WAIT = metrics.histogram(
+    "devops_gpt_admission_wait_seconds", "Time spent waiting for a concurrency slot per stage.", ("stage",))
+
+
+# The slots held by the running block, innermost last; hold_until() keeps them past the block's end
+_held_slots: ContextVar[tuple] = ContextVar("admission_held_slots", default=())
+
+
+class BusyError(Exception):
+    """
+    Raised when work cannot be admitted right now; the caller should retry later.
+
+    :param retry_after: Suggested number of seconds to wait before retrying.
+    """
+
+    def __init__(self, message: str, retry_after: float = 5.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limiter for one pipeline stage with a bounded wait queue.
+
+    The limit adapts to observed latency so throughput stays at the knee of the
+    latency curve:
+    - "aimd": +1 per limit's worth of fast successes, x backoff on a slow or overloaded call.
+    - "vegas": estimate the queue as limit * (1 - min_rtt / rtt) and keep it between alpha and beta.
+    - "fixed": never adapt.
+    """
+
+    def __init__(self, stage: str, initial_limit: int = 4, min_limit: int = 1, max_limit: int = 32,
+                 max_queue: int = 16, queue_timeout_s: float = 10.0, algorithm: str = "aimd",
+                 target_latency_s: Optional[float] = None, backoff: float = 0.75, alpha: int = 2, beta: int = 4):
+        if algorithm not in ("aimd", "vegas", "fixed"):
+            raise ValueError(f"Unknown limiter algorithm: {algorithm}")
+        self.stage = stage
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.queue_timeout_s = queue_timeout_s
+        self.algorithm = algorithm
+        self.target_latency_s = target_latency_s
+        self.backoff = backoff
+        self.alpha = alpha
+        self.beta = beta
+
+        self._limit = float(initial_limit)
+        self._in_flight = 0
+        self._waiting = 0
+        self._min_rtt: Optional[float] = None
+        self._condition = threading.Condition()
+        LIMIT_GAUGE.set(self.limit, stage=stage)
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_limit, int(self._limit))
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    def acquire(self, timeout: Optional[float] = None) -> None:
+        """
+        Take a concurrency slot, waiting in the bounded queue if necessary.
+
+        :param timeout: Queue-time budget (e.g. from a request deadline), capped at queue_timeout_s.
+        :raises BusyError: when the queue is full or the budget runs out.
+        """
+        timeout = self.queue_timeout_s if timeout is None else min(timeout, self.queue_timeout_s)
+        with self._condition:
+            if self._in_flight < self.limit:
+                self._in_flight += 1
+                return
+
+            if self._waiting >= self.max_queue:
+                SHED_COUNTER.inc(stage=self.stage, reason="queue_full")
+                raise BusyError(f"{self.stage} is at capacity ({self._in_flight} running, {self._waiting} queued), retry shortly")
+
+            self._waiting += 1
+            QUEUED_GAUGE.set(self._waiting, stage=self.stage)
+            start_time = time.monotonic()
+            try:
+                while self._in_flight >= self.limit:
+                    remaining = timeout - (time.monotonic() - start_time)
+                    if remaining <= 0:
+                        SHED_COUNTER.inc(stage=self.stage, reason="queue_timeout")
+                        raise BusyError(f"{self.stage} queue wait exceeded {timeout:.1f}s, retry shortly")
+                    self._condition.wait(remaining)
+                self._in_flight += 1
+            finally:
+                self._waiting -= 1
+                QUEUED_GAUGE.set(self._waiting, stage=self.stage)
+                QUEUE_WAIT.observe(time.monotonic() - start_time, stage=self.stage)
+
+    def try_acquire(self) -> bool:
+        """Take a slot only if one is free right now, without queueing."""
+        with self._condition:
+            if self._in_flight < self.limit:
+                self._in_flight += 1
+                return True
+            return False
+
+    def release(self, latency_s: Optional[float] = None, overloaded: bool = False) -> None:
+        """
+        Return a slot and feed the call's outcome into the limit.
+
+        :param latency_s: Service time of the call (None skips adaptation, e.g. for non-overload errors).
+        :param overloaded: The call failed in a way that signals overload (429, timeout, 503).
+        """
+        with self._condition:
+            self._in_flight -= 1
+            if overloaded or latency_s is not None:
+                self._adapt(latency_s, overloaded)
+            self._condition.notify_all()
+
+    def _adapt(self, latency_s: Optional[float], overloaded: bool) -> None:
+        previous_limit = self.limit
+        if self.algorithm == "aimd":
+            slow = latency_s is not None and self.target_latency_s is not None and latency_s > self.target_latency_s
+            if overloaded or slow:
+                self._limit = max(self.min_limit, self._limit * self.backoff)
+            else:
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+        elif self.algorithm == "vegas":
+            if overloaded:
+                self._limit = max(self.min_limit, self._limit * self.backoff)
+            elif latency_s is not None and latency_s > 0:
+                self._min_rtt = latency_s if self._min_rtt is None else min(self._min_rtt, latency_s)
+                queue = self._limit * (1 - self._min_rtt / latency_s)
+                if queue < self.alpha:
+                    self._limit = min(self.max_limit, self._limit + 1)
+                elif queue > self.beta:
+                    self._limit = max(self.min_limit, self._limit - 1)
+
+        if self.limit != previous_limit:
+            LIMIT_GAUGE.set(self.limit, stage=self.stage)
+            logger.info(f"Admission limit for {self.stage}: {previous_limit} -> {self.limit}")
+
+    @contextmanager
+    def slot(self, timeout: Optional[float] = None) -> Iterator[None]:
+        """
+        Hold a slot for the duration of the block, recording latency and overload signals.
+
+        If the block hands its work to a future that outlives it (see hold_until), the slot is
+        only returned once that future finishes, with the future's outcome.
+        """
+        self.acquire(timeout)
+        start_time = time.perf_counter()
+        latency_s, overloaded = None, False
+        hold: dict = {}
+        token = _held_slots.set(_held_slots.get() + (hold,))
+        try:
+            yield
+            latency_s = time.perf_counter() - start_time
+        except BusyError:
+            overloaded = True
+            raise
+        except Exception as e:
+            overloaded = is_overload_error(e)
+            raise
+        finally:
+            _held_slots.reset(token)
+            if "future" in hold:
+                hold["future"].add_done_callback(lambda future: self._release_after(future, start_time))
+            else:
+                self.release(latency_s, overloaded)
+
+    def _release_after(self, future: Future, start_time: float) -> None:
+        """Return the slot of a block whose work outlived it, once that work (the future) is done."""
+        error = None if future.cancelled() else future.exception()
+        if error is None:
+            self.release(None if future.cancelled() else time.perf_counter() - start_time)
+        else:
+            self.release(None, is_overload_error(error))
+
+    @asynccontextmanager
+    async def aslot(self, timeout: Optional[float] = None) -> AsyncIterator[None]:
+        """
+        Async slot(): free slots are taken without leaving the event loop; only
+        a call that has to queue waits on a helper thread.
+        """
+        if not self.try_acquire():
+            waiter = asyncio.ensure_future(asyncio.to_thread(self.acquire, timeout))
+            try:
+                await asyncio.shield(waiter)
+            except asyncio.CancelledError:
+                # The helper thread may still get the slot after we stop waiting; hand it straight back
+                waiter.add_done_callback(lambda done: done.cancelled() or done.exception() or self.release())
+                raise
+        start_time = time.perf_counter()
+        latency_s, overloaded = None, False
+        try:
+            yield
+            latency_s = time.perf_counter() - start_time
+        except BusyError:
+            overloaded = True
+            raise
+        except Exception as e:
+            overloaded = is_overload_error(e)
+            raise
+        finally:
+            self.release(latency_s, overloaded)
+
+
+def hold_until(future: Future) -> None:
+    """
+    Keep the slots of the running limit() blocks taken until future finishes, for a call that
+    is abandoned (e.g. at its deadline) but keeps running on another thread.
+    """
+    for hold in _held_slots.get():
+        hold.setdefault("future", future)
+
+
+def is_overload_error(error: Exception) -> bool:
+    """
+    Heuristic: does this exception mean the downstream service is saturated?
+
+    Running out of a request's own budget (DeadlineExceeded) is not: it says nothing about the service.
+    """
+    if isinstance(error, DeadlineExceeded):
+        return False
+    if isinstance(error, TimeoutError):
+        return True
+    status = getattr(getattr(error, "response", None), "status_code", None) or getattr(error, "status_code", None)
+    if status in (429, 503):
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in ("timeout", "timed out", "429", "rate limit", "ratelimit", "too many requests"))
+
+
+class AdmissionController:
+    """Per-stage limiters configured from ADMISSION_LIMITS, created on first use."""
+
+    def __init__(self, limits: Optional[dict] = None, enabled: bool = ADMISSION_CONTROL_ENABLED):
+        self.limits = limits if limits is not None else ADMISSION_LIMITS
+        self.enabled = enabled
+        self._limiters: dict[str, AdaptiveLimiter] = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, stage: str) -> AdaptiveLimiter:
+        with self._lock:
+            if stage not in self._limiters:
+                self._limiters[stage] = AdaptiveLimiter(stage, **self.limits.get(stage, {}))
+            return self._limiters[stage]
+
+    @contextmanager
+    def limit(self, stage: str, timeout: Optional[float] = None) -> Iterator[None]:
+        """Run the block under the stage's concurrency limit (a no-op when admission control is disabled)."""
+        if not self.enabled:
+            yield
+            return
+        with self.limiter(stage).slot(timeout):
+            yield
+
+    @asynccontextmanager
+    async def alimit(self, stage: str, timeout: Optional[float] = None) -> AsyncIterator[None]:
+        """Async limit(), sharing the same per-stage limiters as the threaded pipeline."""
+        if not self.enabled:
+            yield
+            return
+        async with self.limiter(stage).aslot(timeout):
+            yield
+
+    def status(self) -> dict:
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {stage: {"limit": limiter.limit, "in_flight": limiter.in_flight, "waiting": limiter.waiting}
+                for stage, limiter in limiters.items()}
+
+
+admission = AdmissionController()
@@ -1,5 +1,177 @@
+import os
+
 DB_NAME='gitlab'
 COLLECTION_NAME='incidents'
 GITLAB_URL='https://gitlab.com'
 GITLAB_PROJECT_URL='gitlab-com/gl-infra/production'
-INCIDENTS_PATH='data/incidents.pkl'
\ No newline at end of file
+INCIDENTS_PATH='data/incidents.pkl'
+GITLAB_PAGE_SIZE=100
+
+# Analysis job queue
+JOB_MAX_WORKERS=4
+JOB_MAX_PENDING=32
+JOB_RESULT_TTL_SECONDS=900
+JOB_RESULT_MAX_ENTRIES=256
+
+# Secrets: cached lookups in utils.secrets_helper.SecretProvider
+GOOGLE_CLOUD_PROJECT=os.getenv('GOOGLE_CLOUD_PROJECT', 'devpost-ai-in-action')
+SECRETS_FILE=os.getenv('SECRETS_FILE')  # JSON file or directory of secrets used instead of Secret Manager (tests, offline)
+SECRET_CACHE_TTL_SECONDS=3600
+SECRET_REFRESH_AHEAD_SECONDS=300
+SECRET_NEGATIVE_TTL_SECONDS=60
+# Secrets the app needs at startup: secret name -> env var checked first
+REQUIRED_SECRETS={
+    'atlas-uri': 'ATLAS_URI',
+    'huggingface-api-token': 'HUGGINGFACE_API_TOKEN',
+}
+
+# Embeddings
+# Model of the original ("v1", field "embedding") vectors; newer models are added as versions (processors/embedding_versions.py)
+EMBEDDING_MODEL_ID='BAAI/bge-small-en-v1.5'
+EMBEDDING_CACHE_SIZE=256
+# How embeddings are stored on incident documents: list | float32 | int8 | binary (see processors/quantization.py).
+# The quantized formats are opt-in: switching rewrites every "embedding" field on the next populate_incidents run
+# and needs the Atlas vector index rebuilt for the new type (see vector_index_definition)
+EMBEDDING_STORAGE_FORMAT=os.getenv('EMBEDDING_STORAGE_FORMAT', 'list')
+# Binary first-pass candidates fetched for full-precision rescoring
+BINARY_RESCORE_CANDIDATES=100
+# In-memory vector format for LocalVectorIndex: float32 | float16 | int8 | binary
+LOCAL_INDEX_DTYPE=os.getenv('LOCAL_INDEX_DTYPE', 'float32')
+# Projection (.npz from processors/projection.py) for the reduced-dimension first search stage; empty disables it
+EMBEDDING_PROJECTION_PATH=os.getenv('EMBEDDING_PROJECTION_PATH', '')
+# Reduced-dimension candidates reranked with the full embeddings
+TWO_STAGE_CANDIDATES=100
+# How EmbeddingModel probes the HF API at startup: "background" (don't block init), "sync" or "off"
+EMBEDDING_PROBE_MODE=os.getenv('EMBEDDING_PROBE_MODE', 'background')
+HF_INFERENCE_BASE_URL=os.getenv('HF_INFERENCE_BASE_URL', 'https://api-inference.huggingface.co/models')
+
+# Ingestion near-duplicate detection (processors/dedup.py); 16 bands x 8 rows put the LSH knee near Jaccard 0.7
+DEDUP_ENABLED=os.getenv('DEDUP_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+DEDUP_JACCARD_THRESHOLD=float(os.getenv('DEDUP_JACCARD_THRESHOLD', '0.8'))
+MINHASH_NUM_PERM=128
+LSH_BANDS=16
+SHINGLE_SIZE=3
+
+# Retrieval: over-fetch candidates with their vectors, then diversify with MMR (processors/diversification.py)
+RETRIEVAL_TOP_K=5
+RETRIEVAL_CANDIDATES=int(os.getenv('RETRIEVAL_CANDIDATES', '20'))
+MMR_ENABLED=os.getenv('MMR_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+MMR_LAMBDA=float(os.getenv('MMR_LAMBDA', '0.7'))
+DUPLICATE_SIMILARITY_THRESHOLD=float(os.getenv('DUPLICATE_SIMILARITY_THRESHOLD', '0.95'))
+
+# Pasted-log compression before embedding and prompting (processors/log_compression.py)
+LOG_COMPRESSION_ENABLED=os.getenv('LOG_COMPRESSION_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Shorter inputs are passed through unchanged
+LOG_COMPRESSION_MIN_LINES=int(os.getenv('LOG_COMPRESSION_MIN_LINES', '20'))
+DRAIN_DEPTH=4
+DRAIN_SIMILARITY_THRESHOLD=0.5
+DRAIN_MAX_CHILDREN=100
+LOG_COMPRESSION_MAX_TEMPLATES=80
+LOG_COMPRESSION_MAX_VERBATIM=40
+
+# Long-description chunking (processors/chunking.py); bge-small reads at most 512 word pieces, so
+# windows are sized in words with headroom. Chunks live in their own collection and vector index.
+CHUNK_COLLECTION_NAME=os.getenv('CHUNK_COLLECTION_NAME', 'incident_chunks')
+# Search chunks instead of whole incidents at query time (needs the chunk collection and its vector index)
+CHUNK_RETRIEVAL_ENABLED=os.getenv('CHUNK_RETRIEVAL_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+# Build chunks at ingestion; defaults to CHUNK_RETRIEVAL_ENABLED so nothing embeds chunks no query searches.
+# Set it on its own to populate the chunk collection ahead of switching retrieval over
+CHUNKING_ENABLED=os.getenv('CHUNKING_ENABLED', str(CHUNK_RETRIEVAL_ENABLED)).lower() in ('1', 'true', 'yes')
+CHUNK_MAX_WORDS=256
+CHUNK_OVERLAP_WORDS=32
+CHUNK_CANDIDATES=int(os.getenv('CHUNK_CANDIDATES', '50'))
+# How chunk scores roll up to their incident: max | mean
+CHUNK_POOLING=os.getenv('CHUNK_POOLING', 'max')
+# Best-matching chunks per incident sent to the LLM instead of the whole description
+CHUNK_CONTEXT_SPANS=2
+
+# Versioned embeddings and background re-embedding (processors/embedding_versions.py, processors/reembed.py)
+EMBEDDING_VERSIONS_COLLECTION='embedding_versions'
+# How long a process keeps using the active version it looked up; a cutover reaches all replicas within this
+EMBEDDING_VERSION_CACHE_SECONDS=30
+REEMBED_BATCH_SIZE=32
+# Throttle so re-embedding leaves embedding API capacity for live queries
+REEMBED_MAX_DOCS_PER_SECOND=float(os.getenv('REEMBED_MAX_DOCS_PER_SECOND', '20'))
+
+# Checkpointed ingestion runs (processors/ingestion.py)
+INGEST_MANIFEST_PATH=os.getenv('INGEST_MANIFEST_PATH', 'data/ingest_manifest.json')
+# Fetched pages and embedded batches are spooled here until the run completes
+INGEST_WORK_DIR=os.getenv('INGEST_WORK_DIR', 'data/ingest')
+INGEST_BATCH_SIZE=64
+# Pipelined ingestion (utils/stage_pipeline.py): workers per stage, and batches queued in front of each stage
+INGEST_EMBED_WORKERS=int(os.getenv('INGEST_EMBED_WORKERS', '4'))
+INGEST_WRITE_WORKERS=int(os.getenv('INGEST_WRITE_WORKERS', '2'))
+INGEST_CHUNK_WORKERS=int(os.getenv('INGEST_CHUNK_WORKERS', '2'))
+INGEST_QUEUE_SIZE=4
+
+# Batch analysis (processors/batch_analysis.py)
+BATCH_EMBED_SIZE=32
+BATCH_SEARCH_CONCURRENCY=8
+BATCH_LLM_CONCURRENCY=8
+
+# Admission control: per-stage concurrency limits (see utils.admission.AdaptiveLimiter)
+ADMISSION_CONTROL_ENABLED=os.getenv('ADMISSION_CONTROL_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+ADMISSION_LIMITS={
+    'embedding': {'initial_limit': 8, 'max_limit': 32, 'max_queue': 32, 'queue_timeout_s': 10.0, 'target_latency_s': 5.0},
+    'atlas_search': {'initial_limit': 16, 'max_limit': 64, 'max_queue': 64, 'queue_timeout_s': 5.0, 'target_latency_s': 1.0},
+    'llm': {'initial_limit': 4, 'max_limit': 16, 'max_queue': 32, 'queue_timeout_s': 30.0, 'target_latency_s': 20.0},
+}
+
+# Request deadlines (seconds); the whole analysis must finish well inside Cloud Run's 300s timeoutSeconds
+REQUEST_DEADLINE_SECONDS=float(os.getenv('REQUEST_DEADLINE_SECONDS', '240'))
+LLM_MIN_BUDGET_SECONDS=10.0
+JUDGE_MIN_BUDGET_SECONDS=8.0
+RETRIEVAL_MIN_BUDGET_SECONDS=2.0
+
+# Cold start: budget for importing the app modules and building components (probe off), see benchmarks/cold_start.py
+COLD_START_BUDGET_MS=float(os.getenv('COLD_START_BUDGET_MS', '3000'))
+
+# Local vector index kept in step with the incident collection by a change stream (processors/index_sync.py)
+LOCAL_INDEX_SYNC_ENABLED=os.getenv('LOCAL_INDEX_SYNC_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+LOCAL_INDEX_RESUME_TOKEN_PATH=os.getenv('LOCAL_INDEX_RESUME_TOKEN_PATH', 'data/local_index_resume_token.json')
+# Changes applied to the index at a time
+LOCAL_INDEX_SYNC_BATCH=256
+# Compact when this fraction of the rows are tombstones, or when any are and the interval has passed
+LOCAL_INDEX_COMPACT_FRACTION=0.2
+LOCAL_INDEX_COMPACT_INTERVAL_SECONDS=600
+
+# Memory-mapped corpus snapshot baked into the image (processors/snapshot.py); a missing file is ignored
+CORPUS_SNAPSHOT_PATH=os.getenv('CORPUS_SNAPSHOT_PATH', 'data/corpus.snap')
+# Check the snapshot's sha256 when loading it (reads the whole file); the image build always verifies it
+CORPUS_SNAPSHOT_VERIFY=os.getenv('CORPUS_SNAPSHOT_VERIFY', 'false').lower() in ('1', 'true', 'yes')
+
+# Related-incident graph precomputed offline (processors/similarity_graph.py)
+SIMILARITY_GRAPH_COLLECTION_NAME=os.getenv('SIMILARITY_GRAPH_COLLECTION_NAME', 'incident_neighbours')
+SIMILARITY_GRAPH_K=int(os.getenv('SIMILARITY_GRAPH_K', '10'))
+# Neighbours scoring below this cosine similarity are not stored
+SIMILARITY_GRAPH_MIN_SCORE=float(os.getenv('SIMILARITY_GRAPH_MIN_SCORE', '0.0'))
+# Rows and columns per matrix-multiply block; one block of scores is BLOCK_ROWS**2 float32s (4 MB at 1024)
+SIMILARITY_GRAPH_BLOCK_ROWS=1024
+
+# Incident clusters with a precomputed analysis each (processors/clustering.py); LLMProcessor answers
+# queries that land confidently inside an analysed cluster from the cache
+CLUSTER_CACHE_ENABLED=os.getenv('CLUSTER_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+CLUSTER_COLLECTION_NAME=os.getenv('CLUSTER_COLLECTION_NAME', 'incident_clusters')
+# k of k-means; 0 picks sqrt(incidents / 2)
+CLUSTER_COUNT=int(os.getenv('CLUSTER_COUNT', '0'))
+CLUSTER_KMEANS_ITERATIONS=50
+CLUSTER_KMEANS_RESTARTS=4
+# Only clusters of at least this many incidents (recurring failure modes) get an analysis
+CLUSTER_MIN_SIZE=int(os.getenv('CLUSTER_MIN_SIZE', '5'))
+# Members sent to AnalyzeIncident: the most central one as the query, the rest as similar incidents
+CLUSTER_ANALYSIS_INCIDENTS=6
+CLUSTER_ANALYSIS_CONCURRENCY=4
+# A query matches a cluster when its cosine similarity to the centroid is at least the minimum, at least that of
+# CLUSTER_MATCH_PERCENTILE percent of the members, and CLUSTER_MATCH_MIN_MARGIN above the next centroid
+CLUSTER_MATCH_MIN_SIMILARITY=float(os.getenv('CLUSTER_MATCH_MIN_SIMILARITY', '0.85'))
+CLUSTER_MATCH_PERCENTILE=50
+CLUSTER_MATCH_MIN_MARGIN=0.03
+# After a cached answer, also run the full analysis in the background (AnalysisPipeline stores it as
+# refined_response for API callers; the Streamlit app does not show it). Off by default: it spends the LLM
+# call the cache saves
+CLUSTER_REFINE_IN_BACKGROUND=os.getenv('CLUSTER_REFINE_IN_BACKGROUND', 'false').lower() in ('1', 'true', 'yes')
+CLUSTER_REFINE_WORKERS=2
+# Refinements waiting or running; more are dropped rather than queued
+CLUSTER_REFINE_MAX_PENDING=4
+# Budget of one refinement, from when it is submitted
+CLUSTER_REFINE_DEADLINE_SECONDS=float(os.getenv('CLUSTER_REFINE_DEADLINE_SECONDS', '120'))
@@ -0,0 +1,115 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Awaitable, Callable, Optional
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a stage cannot run (or finish) within the request's remaining budget."""
+
+
+class Deadline:
+    """
+    Absolute end-to-end deadline for one request, shared by every pipeline stage.
+
+    Stages size their own timeouts and retries from remaining() instead of
+    using independent, additive timeouts, and skip optional work once the
+    budget is too small.
+    """
+
+    def __init__(self, budget_s: float, expires_at: Optional[float] = None):
+        self.budget_s = budget_s
+        self.expires_at = expires_at if expires_at is not None else time.monotonic() + budget_s
+
+    def remaining(self) -> float:
+        """Seconds left (never negative)."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def remaining_ms(self) -> int:
+        return int(self.remaining() * 1000)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def allows(self, seconds: float) -> bool:
+        """True if at least `seconds` of budget remain."""
+        return self.remaining() >= seconds
+
+    def timeout(self, cap: Optional[float] = None, reserve: float = 0.0) -> float:
+        """
+        Timeout for one call: the remaining budget minus `reserve`, capped at `cap`.
+
+        :param cap: The stage's own maximum timeout.
+        :param reserve: Budget to keep back for later stages.
+        """
+        timeout = max(0.0, self.remaining() - reserve)
+        return min(timeout, cap) if cap is not None else timeout
+
+    def child(self, reserve: float = 0.0, cap: Optional[float] = None) -> "Deadline":
+        """
+        A tighter deadline for a sub-stage that must leave `reserve` seconds for what follows.
+        """
+        budget = self.timeout(cap=cap, reserve=reserve)
+        return Deadline(budget, expires_at=time.monotonic() + budget)
+
+    def check(self, stage: str, needed: float = 0.0) -> None:
+        """Raise DeadlineExceeded unless at least `needed` seconds remain for `stage`."""
+        if self.expired or not self.allows(needed):
+            raise DeadlineExceeded(f"Not enough time left for {stage}: {self.remaining():.1f}s remaining, {needed:.1f}s needed")
+
+    def __repr__(self) -> str:
+        return f"Deadline(remaining={self.remaining():.2f}s of {self.budget_s:.2f}s)"
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="deadline-call")
+        return _executor
+
+
+def call_with_deadline(func: Callable[[], Any], deadline: Optional[Deadline], stage: str) -> Any:
+    """
+    Run a blocking call that has no timeout of its own (e.g. a BAML function) within the deadline.
+
+    The call runs on a helper thread; if the budget runs out first the caller
+    gets DeadlineExceeded immediately and the abandoned call finishes in the
+    background, still holding the admission slots it runs under (see
+    utils.admission.hold_until). Without a deadline the call runs inline.
+    """
+    if deadline is None:
+        return func()
+    deadline.check(stage)
+    future = _get_executor().submit(func)
+    try:
+        return future.result(timeout=deadline.remaining())
+    except FutureTimeoutError:
+        if not future.cancel():
+            from utils.admission import hold_until
+            hold_until(future)
+        raise DeadlineExceeded(f"{stage} did not finish within the request deadline") from None
+
+
+async def await_with_deadline(awaitable: Awaitable[Any], deadline: Optional[Deadline], stage: str) -> Any:
+    """
+    Async call_with_deadline(): await within the remaining budget, cancelling the awaitable when it runs out.
+    """
+    if deadline is None:
+        return await awaitable
+    try:
+        deadline.check(stage)
+    except DeadlineExceeded:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise
+    try:
+        return await asyncio.wait_for(awaitable, timeout=deadline.remaining())
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"{stage} did not finish within the request deadline") from None
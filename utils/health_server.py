@@ -0,0 +1,66 @@
+import logging
+import os
+import threading
+from flask import Flask, Response, jsonify
+from utils.admission import admission
+from utils.metrics import metrics
+from utils.registry import REQUIRED_COMPONENTS, registry
+from utils.startup import timeline
+
+logger = logging.getLogger(__name__)
+
+# Flask app for health check
+health_app = Flask(__name__)
+
+_health_thread = None
+_health_thread_lock = threading.Lock()
+
+
+@health_app.route('/_stcore/health')
+def health_check():
+    return "OK", 200
+
+
+@health_app.route('/readyz')
+def readiness_check():
+    """Report whether the components the app needs are built, with every component's init timings."""
+    status_code = 200 if registry.is_ready(REQUIRED_COMPONENTS) else 503
+    return jsonify({"components": registry.status(), "admission": admission.status()}), status_code
+
+
+@health_app.route('/startupz')
+def startup_timeline():
+    """Per-phase and per-component startup timings for this process."""
+    return jsonify(timeline.report()), 200
+
+
+@health_app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint: per-stage latency histograms, errors, in-flight and cache counters."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+def run_health_check_server():
+    # Its own port: Streamlit already listens on 8080 in the container
+    port = int(os.getenv("HEALTH_PORT", "8081"))
+    try:
+        health_app.run(host='0.0.0.0', port=port)
+    except (OSError, SystemExit) as e:
+        # Werkzeug exits on "address in use"; in a daemon thread that would otherwise go unnoticed
+        logger.error(f"Health check server could not listen on port {port}: {e!r}")
+
+
+def start_health_server() -> threading.Thread:
+    """
+    Start the health check server in a daemon thread, once per process.
+
+    app.py is re-executed on every Streamlit rerun, so the guard has to live
+    in an imported module rather than in the script itself.
+    """
+    global _health_thread
+    with _health_thread_lock:
+        if _health_thread is None:
+            _health_thread = threading.Thread(target=run_health_check_server, name="health-server", daemon=True)
+            _health_thread.start()
+            logger.info("Health check server started")
+        return _health_thread
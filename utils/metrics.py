@@ -0,0 +1,261 @@
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets (seconds) spanning cache hits up to the Cloud Run request timeout
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_names: tuple, label_values: tuple, extra: Optional[dict] = None) -> str:
+    pairs = list(zip(label_names, label_values)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self._values[key] = state
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    state["buckets"][index] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            items = [(key, {"buckets": list(s["buckets"]), "sum": s["sum"], "count": s["count"]})
+                     for key, s in self._values.items()]
+        for key, state in items:
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets, state["buckets"]):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, {"le": _format_value(upper_bound)})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """Minimal Prometheus registry rendering the text exposition format."""
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, label_names: tuple = ()) -> Counter:
+        return self._register(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+STAGE_LATENCY = metrics.histogram(
+    "devops_gpt_stage_duration_seconds", "Latency of each analysis pipeline stage.", ("stage",))
+STAGE_ERRORS = metrics.counter(
+    "devops_gpt_stage_errors_total", "Exceptions raised by each analysis pipeline stage.", ("stage",))
+STAGE_IN_FLIGHT = metrics.gauge(
+    "devops_gpt_stage_in_flight", "Calls currently executing in each analysis pipeline stage.", ("stage",))
+EMBEDDING_PATH = metrics.counter(
+    "devops_gpt_embedding_requests_total", "Embedding requests by the path that served them (api, fallback, cache).", ("path",))
+CACHE_REQUESTS = metrics.counter(
+    "devops_gpt_cache_requests_total", "Cache lookups by cache and result (hit, miss).", ("cache", "result"))
+
+
+_stage_listeners: list[Callable[[str, float, bool], None]] = []
+
+
+def add_stage_listener(listener: Callable[[str, float, bool], None]) -> None:
+    """Receive (stage, seconds, failed) for every tracked stage, e.g. to collect raw samples in benchmarks."""
+    _stage_listeners.append(listener)
+
+
+def remove_stage_listener(listener: Callable[[str, float, bool], None]) -> None:
+    if listener in _stage_listeners:
+        _stage_listeners.remove(listener)
+
+
+class _NoopSpan:
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+
+_tracer = None
+_tracer_initialized = False
+_tracer_lock = threading.Lock()
+
+
+def _get_tracer():
+    """
+    Return an OpenTelemetry tracer when OTEL_TRACES_ENABLED is set and the SDK is installed.
+
+    OpenTelemetry is optional: without it (or with tracing disabled) spans are no-ops
+    and only the Prometheus metrics are recorded.
+    """
+    global _tracer, _tracer_initialized
+    if _tracer_initialized:
+        return _tracer
+
+    with _tracer_lock:
+        if _tracer_initialized:
+            return _tracer
+        _tracer_initialized = True
+        if os.getenv("OTEL_TRACES_ENABLED", "false").lower() not in ("1", "true", "yes"):
+            return None
+        try:
+            from opentelemetry import trace
+            if os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+                from opentelemetry.sdk.resources import Resource
+                from opentelemetry.sdk.trace import TracerProvider
+                from opentelemetry.sdk.trace.export import BatchSpanProcessor
+                from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+                provider = TracerProvider(resource=Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", "devops-gpt")}))
+                provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+                trace.set_tracer_provider(provider)
+            _tracer = trace.get_tracer("devops_gpt")
+            logger.info("OpenTelemetry tracing enabled")
+        except ImportError as e:
+            logger.warning(f"OTEL_TRACES_ENABLED is set but OpenTelemetry is not installed: {e}")
+        return _tracer
+
+
+@contextmanager
+def track_stage(stage: str) -> Iterator:
+    """
+    Time a pipeline stage: records its latency histogram, error counter and
+    in-flight gauge, and wraps it in an OpenTelemetry span when tracing is enabled.
+
+    Yields the span (or a no-op stand-in) so callers can attach attributes.
+    """
+    tracer = _get_tracer()
+    STAGE_IN_FLIGHT.inc(stage=stage)
+    start_time = time.perf_counter()
+    failed = False
+    try:
+        if tracer is not None:
+            with tracer.start_as_current_span(f"devops_gpt.{stage}") as span:
+                yield span
+        else:
+            yield _NoopSpan()
+    except Exception:
+        failed = True
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start_time
+        STAGE_LATENCY.observe(elapsed, stage=stage)
+        STAGE_IN_FLIGHT.dec(stage=stage)
+        for listener in list(_stage_listeners):
+            listener(stage, elapsed, failed)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
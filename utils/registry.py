@@ -0,0 +1,230 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ComponentRegistry:
+    """
+    Process-wide registry of shared components (embedding model, Atlas client, ...).
+
+    Each component is built once, on first use, and then reused by every
+    Streamlit rerun and session in the process. Failed builds are not cached,
+    so the next caller retries instead of inheriting a stale error.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._factories: dict[str, Callable[[], Any]] = {}
+        self._instances: dict[str, Any] = {}
+        self._build_locks: dict[str, threading.Lock] = {}
+        self._timings: dict[str, float] = {}
+        self._errors: dict[str, str] = {}
+        self._warmup_thread: Optional[threading.Thread] = None
+        self._warmup_names: set[str] = set()
+
+    def register(self, name: str, factory: Callable[[], Any]) -> None:
+        """
+        Register a zero-argument factory for a component.
+
+        Registering an already known name is a no-op, which keeps repeated
+        calls from Streamlit reruns cheap and safe.
+        """
+        with self._lock:
+            if name in self._factories:
+                return
+            self._factories[name] = factory
+            self._build_locks[name] = threading.Lock()
+
+    def get(self, name: str) -> Any:
+        """
+        Return the component, building it on first use.
+
+        Concurrent callers wait for the in-progress build instead of starting
+        their own, so connection pools are never duplicated.
+        """
+        if name in self._instances:
+            return self._instances[name]
+
+        with self._lock:
+            if name not in self._factories:
+                raise KeyError(f"Unknown component: {name}")
+            build_lock = self._build_locks[name]
+
+        with build_lock:
+            if name in self._instances:
+                return self._instances[name]
+
+            logger.info(f"ComponentRegistry: Building '{name}'...")
+            start_time = time.perf_counter()
+            try:
+                instance = self._factories[name]()
+            except Exception as e:
+                self._errors[name] = str(e)
+                logger.error(f"ComponentRegistry: Failed to build '{name}': {e}")
+                raise
+            elapsed_ms = (time.perf_counter() - start_time) * 1000
+
+            self._instances[name] = instance
+            self._timings[name] = elapsed_ms
+            self._errors.pop(name, None)
+            logger.info(f"ComponentRegistry: Built '{name}' in {elapsed_ms:.1f} ms")
+            return instance
+
+    def warmup(self, names: Optional[list[str]] = None, background: bool = True) -> Optional[threading.Thread]:
+        """
+        Build components ahead of first use.
+
+        :param names: Components to build (default: all registered, in registration order).
+        :param background: Build in a daemon thread instead of blocking the caller. Each component is warmed
+                           in the background once per registry: app.py calls this on every Streamlit rerun,
+                           and a later call only starts a thread for the names no earlier warmup covered,
+                           returning the latest warmup thread, finished or not, when there are none.
+        :return: The warmup thread when running in the background, otherwise None.
+        """
+        with self._lock:
+            names = names or list(self._factories)
+
+        def _build_all(names=names):
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception:
+                    # Already logged and recorded in get(); keep warming the rest
+                    pass
+
+        if not background:
+            _build_all()
+            return None
+
+        with self._lock:
+            pending = [name for name in names if name not in self._warmup_names]
+            if not pending:
+                return self._warmup_thread
+            self._warmup_names.update(pending)
+            self._warmup_thread = threading.Thread(target=_build_all, args=(pending,), name="component-warmup",
+                                                   daemon=True)
+            self._warmup_thread.start()
+            return self._warmup_thread
+
+    def is_ready(self, names: Optional[Iterable[str]] = None) -> bool:
+        """
+        Return True once every requested component has been built.
+
+        :param names: Components to check (default: all registered, including optional ones; pass
+                      REQUIRED_COMPONENTS to ask whether the app can serve).
+        """
+        names = names or list(self._factories)
+        return all(name in self._instances for name in names)
+
+    def status(self) -> dict:
+        """Readiness state, init timings (ms) and last errors per component."""
+        return {
+            name: {
+                "ready": name in self._instances,
+                "init_ms": round(self._timings[name], 1) if name in self._timings else None,
+                "error": self._errors.get(name),
+            }
+            for name in self._factories
+        }
+
+    def reset(self, name: Optional[str] = None) -> None:
+        """Drop a built component (or all of them) so it is rebuilt on next use."""
+        with self._lock:
+            names = [name] if name else list(self._instances)
+            for component in names:
+                self._instances.pop(component, None)
+                self._timings.pop(component, None)
+                self._errors.pop(component, None)
+
+
+registry = ComponentRegistry()
+
+# Components the app cannot serve without; the others (similarity graph, clusters, job queue, local index
+# sync) are optional or built on demand, so readiness does not wait for them
+REQUIRED_COMPONENTS = ("embedding_model", "llm_processor", "atlas_client", "collection")
+
+
+def register_default_components(target: ComponentRegistry = registry) -> ComponentRegistry:
+    """
+    Register the components shared by the app and the processors.
+
+    Imports happen inside the factories so that registering is free and
+    nothing heavy is loaded until a component is actually needed.
+    """
+    from utils.config import (
+        CLUSTER_CACHE_ENABLED, CLUSTER_COLLECTION_NAME, COLLECTION_NAME, LOCAL_INDEX_SYNC_ENABLED,
+        SIMILARITY_GRAPH_COLLECTION_NAME,
+    )
+
+    def _secrets():
+        # Registered first so warmup resolves every startup secret in parallel before the components need them
+        from utils.config import REQUIRED_SECRETS
+        from utils.secrets_helper import secret_provider
+        resolved = secret_provider.prefetch(REQUIRED_SECRETS)
+        missing = [name for name, ok in resolved.items() if not ok]
+        if missing:
+            logger.warning(f"ComponentRegistry: Secrets not resolved at startup: {', '.join(missing)}")
+        return secret_provider
+
+    def _embedding_model():
+        from processors.embeddings import EmbeddingModel
+        return EmbeddingModel()
+
+    def _llm_processor():
+        from processors.llm_processor import LLMProcessor
+        clusters = None
+        if CLUSTER_CACHE_ENABLED:
+            try:
+                clusters = target.get("incident_clusters")
+            except Exception as e:
+                # Without the clusters every query goes to the LLM
+                logger.warning(f"ComponentRegistry: Incident clusters unavailable, cluster cache disabled: {e}")
+        return LLMProcessor(clusters=clusters)
+
+    def _atlas_client():
+        from connectors.atlas_connection import AtlasConnection
+        atlas_client = AtlasConnection()
+        atlas_client.ping()
+        return atlas_client
+
+    def _collection():
+        return target.get("atlas_client").get_collection(COLLECTION_NAME)
+
+    def _local_index_sync():
+        # Follows the version that is active at startup; after a cutover queries fall back to Atlas until restart
+        from processors.embedding_versions import active_version
+        from processors.index_sync import LocalIndexSync
+        collection = target.get("collection")
+        version = active_version(collection)
+        projection = target.get("embedding_model").for_version(version).projection
+        sync = LocalIndexSync(collection, field=version.field, projection=projection)
+        sync.start()
+        return sync
+
+    def _similarity_graph():
+        from processors.similarity_graph import SimilarityGraph
+        return SimilarityGraph(target.get("atlas_client").get_collection(SIMILARITY_GRAPH_COLLECTION_NAME))
+
+    def _incident_clusters():
+        from processors.clustering import IncidentClusters
+        return IncidentClusters.load(target.get("atlas_client").get_collection(CLUSTER_COLLECTION_NAME))
+
+    def _job_queue():
+        from processors.job_queue import AnalysisJobQueue
+        return AnalysisJobQueue()
+
+    target.register("secrets", _secrets)
+    target.register("embedding_model", _embedding_model)
+    target.register("llm_processor", _llm_processor)
+    target.register("atlas_client", _atlas_client)
+    target.register("collection", _collection)
+    if LOCAL_INDEX_SYNC_ENABLED:
+        target.register("local_index_sync", _local_index_sync)
+    target.register("similarity_graph", _similarity_graph)
+    if CLUSTER_CACHE_ENABLED:
+        target.register("incident_clusters", _incident_clusters)
+    target.register("job_queue", _job_queue)
+    return target
@@ -1,25 +1,211 @@
+import json
+import logging
 import os
-from google.cloud import secretmanager
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
 from dotenv import load_dotenv
+from utils.config import (
+    GOOGLE_CLOUD_PROJECT, SECRET_CACHE_TTL_SECONDS, SECRET_NEGATIVE_TTL_SECONDS,
+    SECRET_REFRESH_AHEAD_SECONDS, SECRETS_FILE,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class SecretManagerBackend:
+    """
+    Reads the latest version of a secret from Google Secret Manager.
+
+    One client (and gRPC channel) is created on first use and reused for every
+    lookup; the client library is imported lazily because it is slow to load
+    and unused when secrets come from the environment.
+    """
+
+    def __init__(self, project_id: str = GOOGLE_CLOUD_PROJECT):
+        self.project_id = project_id
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def _get_client(self):
+        with self._client_lock:
+            if self._client is None:
+                from google.cloud import secretmanager
+                self._client = secretmanager.SecretManagerServiceClient()
+            return self._client
+
+    def fetch(self, secret_name: str) -> str:
+        secret_path = f"projects/{self.project_id}/secrets/{secret_name}/versions/latest"
+        response = self._get_client().access_secret_version(request={"name": secret_path})
+        return response.payload.data.decode("UTF-8")
+
+
+class FileSecretBackend:
+    """
+    Local stand-in for Secret Manager, for tests and offline runs.
+
+    :param path: A JSON file mapping secret name -> value, or a directory with
+                 one file per secret (the layout of mounted Kubernetes/Cloud Run secrets).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def fetch(self, secret_name: str) -> str:
+        if os.path.isdir(self.path):
+            with open(os.path.join(self.path, secret_name), encoding="utf-8") as f:
+                return f.read().strip()
+        with open(self.path, encoding="utf-8") as f:
+            values = json.load(f)
+        if secret_name not in values:
+            raise KeyError(f"Secret {secret_name} not found in {self.path}")
+        return values[secret_name]
+
+
+@dataclass
+class _CachedSecret:
+    value: Optional[str]
+    fetched_at: float
+    expires_at: float
+    # A last good value re-served after a failed refresh; it is retried on expiry, not refreshed ahead
+    stale: bool = False
+
+
+class SecretProvider:
+    """
+    Process-wide secret cache in front of a backend.
+
+    Lookups check the environment (and .env) first, then the cache. Cached
+    values are served until they expire; within refresh_ahead_seconds of
+    expiry the cached value is still returned while a background refresh
+    fetches the new one, so callers never wait on the backend after the first
+    lookup. Failed lookups are cached briefly to avoid hammering the quota;
+    if a refresh fails the last good value is re-cached for the same short
+    window, so callers keep getting it without each retrying the backend.
+
+    :param backend: Object with fetch(secret_name) -> str (default: Secret Manager,
+                    or a FileSecretBackend when SECRETS_FILE is set).
+    :param ttl_seconds: How long a fetched value is served.
+    :param refresh_ahead_seconds: Window before expiry in which a background refresh starts.
+    :param negative_ttl_seconds: How long a failed lookup (or a stale value after a failed refresh) is remembered.
+    """
+
+    def __init__(self, backend=None, ttl_seconds: float = SECRET_CACHE_TTL_SECONDS,
+                 refresh_ahead_seconds: float = SECRET_REFRESH_AHEAD_SECONDS,
+                 negative_ttl_seconds: float = SECRET_NEGATIVE_TTL_SECONDS):
+        if backend is None:
+            backend = FileSecretBackend(SECRETS_FILE) if SECRETS_FILE else SecretManagerBackend()
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.refresh_ahead_seconds = refresh_ahead_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+
+        self._cache: dict[str, _CachedSecret] = {}
+        self._fetch_locks: dict[str, threading.Lock] = {}
+        self._refreshing: set[str] = set()
+        self._lock = threading.Lock()
+        self._dotenv_loaded = False
+
+    def _load_dotenv_once(self) -> None:
+        if not self._dotenv_loaded:
+            load_dotenv()
+            self._dotenv_loaded = True
+
+    def get(self, secret_name: str, env_var_name: Optional[str] = None) -> Optional[str]:
+        """
+        Get a secret from the environment (local) or the cached backend (cloud).
+
+        :param secret_name: Backend secret name, e.g. "atlas-uri".
+        :param env_var_name: Environment variable to check first (default: secret_name upper-cased, - -> _).
+        :return: The secret value, or None if it could not be resolved.
+        """
+        self._load_dotenv_once()
+        value = os.getenv(env_var_name or secret_name.upper().replace('-', '_'))
+        if value:
+            return value
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(secret_name)
+        if entry is not None and now < entry.expires_at:
+            if entry.value is not None and not entry.stale and entry.expires_at - now <= self.refresh_ahead_seconds:
+                self._refresh_in_background(secret_name)
+            return entry.value
+        return self._fetch(secret_name)
+
+    def _fetch(self, secret_name: str) -> Optional[str]:
+        """Fetch and cache a secret; concurrent callers for the same secret share one backend call."""
+        with self._lock:
+            fetch_lock = self._fetch_locks.setdefault(secret_name, threading.Lock())
+        with fetch_lock:
+            now = time.monotonic()
+            with self._lock:
+                entry = self._cache.get(secret_name)
+            if entry is not None and now < entry.expires_at and now - entry.fetched_at < self.ttl_seconds - self.refresh_ahead_seconds:
+                # Another thread fetched it while we waited
+                return entry.value
+
+            stale = False
+            try:
+                value = self.backend.fetch(secret_name)
+                ttl = self.ttl_seconds
+            except Exception as e:
+                print(f"Could not load secret {secret_name}: {e}")
+                logger.error(f"Could not load secret {secret_name}: {e}")
+                # Keep serving the last good value rather than failing a caller mid-rotation,
+                # but only for the negative TTL so the backend is retried soon
+                value = entry.value if entry is not None else None
+                ttl, stale = self.negative_ttl_seconds, value is not None
+
+            now = time.monotonic()
+            with self._lock:
+                self._cache[secret_name] = _CachedSecret(value, now, now + ttl, stale)
+            return value
+
+    def _refresh_in_background(self, secret_name: str) -> None:
+        with self._lock:
+            if secret_name in self._refreshing:
+                return
+            self._refreshing.add(secret_name)
+
+        def _refresh():
+            try:
+                self._fetch(secret_name)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(secret_name)
+
+        threading.Thread(target=_refresh, name=f"secret-refresh-{secret_name}", daemon=True).start()
+
+    def prefetch(self, secrets: dict[str, Optional[str]], max_workers: int = 8) -> dict[str, bool]:
+        """
+        Resolve several secrets in parallel, e.g. everything the app needs at startup.
+
+        :param secrets: Mapping of secret name -> env var name (None for the default).
+        :return: Mapping of secret name -> whether it resolved.
+        """
+        if not secrets:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(secrets)), thread_name_prefix="secret-prefetch") as executor:
+            futures = {name: executor.submit(self.get, name, env_var_name) for name, env_var_name in secrets.items()}
+            return {name: future.result() is not None for name, future in futures.items()}
+
+    def invalidate(self, secret_name: Optional[str] = None) -> None:
+        """Drop a cached secret (or all of them) so the next lookup goes to the backend."""
+        with self._lock:
+            if secret_name is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(secret_name, None)
+
+
+secret_provider = SecretProvider()
+
 
 def get_secret(secret_name, env_var_name=None):
     """
     Get secret from environment variable (local) or Secret Manager (cloud)
     """
-    # Try environment variable first
-    load_dotenv()
-    value = os.getenv(env_var_name or secret_name.upper().replace('-', '_'))
-    
-    if value:
-        return value
-    
-    # Try Secret Manager
-    try:
-        client = secretmanager.SecretManagerServiceClient()
-        project_id = os.getenv("GOOGLE_CLOUD_PROJECT", "devpost-ai-in-action")
-        secret_path = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
-        response = client.access_secret_version(request={"name": secret_path})
-        return response.payload.data.decode("UTF-8")
-    except Exception as e:
-        print(f"Could not load secret {secret_name}: {e}")
-        return None
\ No newline at end of file
+    return secret_provider.get(secret_name, env_var_name)
@@ -0,0 +1,191 @@
+"""
+Concurrent stages connected by bounded queues.
+
+Each stage has its own worker threads and an input queue of at most
+queue_size items, so a slow stage blocks the stages feeding it (backpressure)
+instead of letting work pile up in memory, and the pipeline's throughput
+approaches that of its slowest stage rather than the sum of all stages.
+Per-stage item counts, busy time and queue depth are exported as metrics
+and returned by run().
+
+stop() shuts down gracefully: no new items are taken from the source, and
+items already inside the pipeline are finished. A stage error stops the
+source the same way, discards what is left, and is re-raised by run().
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from queue import Queue
+from typing import Any, Callable, Iterable, Optional
+from utils.config import INGEST_QUEUE_SIZE
+from utils.metrics import metrics, track_stage
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_ITEMS = metrics.counter(
+    "devops_gpt_pipeline_items_total", "Items processed by each pipeline stage.", ("pipeline", "stage"))
+PIPELINE_QUEUE_DEPTH = metrics.gauge(
+    "devops_gpt_pipeline_queue_depth", "Items waiting in front of each pipeline stage.", ("pipeline", "stage"))
+
+_END = object()
+
+
+@dataclass
+class Stage:
+    """
+    One step of a StagePipeline.
+
+    :param fn: Called with each input item; returns the item for the next stage, or None to pass nothing on.
+    :param workers: Threads running fn concurrently; use 1 where the order of items matters.
+    :param queue_size: Capacity of the stage's input queue.
+    :param fan_out: fn returns an iterable of items for the next stage instead of one item.
+    :param flush: Called once after the last input item; returns items still to pass on (e.g. a partial batch).
+    """
+    name: str
+    fn: Callable[[Any], Any]
+    workers: int = 1
+    queue_size: int = INGEST_QUEUE_SIZE
+    fan_out: bool = False
+    flush: Optional[Callable[[], Iterable]] = None
+    items: int = field(default=0, init=False)
+    busy_seconds: float = field(default=0.0, init=False)
+    max_queue_depth: int = field(default=0, init=False)
+
+
+class StagePipeline:
+    """
+    Run items from a source through stages, each on its own worker threads.
+
+    :param name: Label of the pipeline's metrics and stage spans ("<name>_<stage>").
+    """
+
+    def __init__(self, name: str, stages: list[Stage]):
+        self.name = name
+        self.stages = stages
+        self._queues = [Queue(maxsize=max(1, stage.queue_size)) for stage in stages]
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._error: Optional[BaseException] = None
+        self._active_workers: list[int] = []
+
+    def stop(self) -> None:
+        """Stop taking items from the source; items already in the pipeline are finished."""
+        self._stopping.set()
+
+    @property
+    def failed(self) -> bool:
+        return self._error is not None
+
+    def _put(self, index: int, item) -> None:
+        queue = self._queues[index]
+        queue.put(item)
+        depth = queue.qsize()
+        stage = self.stages[index]
+        PIPELINE_QUEUE_DEPTH.set(depth, pipeline=self.name, stage=stage.name)
+        if depth > stage.max_queue_depth:
+            stage.max_queue_depth = depth
+
+    def _emit(self, index: int, result, fan_out: bool) -> None:
+        """Pass a stage's result on to stage index + 1 (results of the last stage are dropped)."""
+        if result is None or index + 1 >= len(self.stages):
+            return
+        for item in (result if fan_out else (result,)):
+            if item is not None:
+                self._put(index + 1, item)
+
+    def _fail(self, stage: Stage, error: BaseException) -> None:
+        with self._lock:
+            if self._error is None:
+                self._error = error
+                logger.error(f"StagePipeline {self.name}: Stage {stage.name} failed, stopping: {error}")
+        self._stopping.set()
+
+    def _feed(self, source: Iterable) -> None:
+        try:
+            for item in source:
+                if self._stopping.is_set():
+                    break
+                self._put(0, item)
+        except BaseException as e:
+            self._fail(Stage("source", fn=None), e)
+        finally:
+            for _ in range(self.stages[0].workers):
+                self._queues[0].put(_END)
+
+    def _work(self, index: int) -> None:
+        stage = self.stages[index]
+        queue = self._queues[index]
+        while True:
+            item = queue.get()
+            PIPELINE_QUEUE_DEPTH.set(queue.qsize(), pipeline=self.name, stage=stage.name)
+            if item is _END:
+                break
+            if self.failed:
+                continue  # drain, so upstream workers blocked on put() can finish
+            started = time.perf_counter()
+            try:
+                with track_stage(f"{self.name}_{stage.name}"):
+                    result = stage.fn(item)
+            except BaseException as e:
+                self._fail(stage, e)
+                continue
+            finally:
+                with self._lock:
+                    stage.items += 1
+                    stage.busy_seconds += time.perf_counter() - started
+                PIPELINE_ITEMS.inc(pipeline=self.name, stage=stage.name)
+            # Outside the busy time: blocking here is backpressure from the next stage
+            self._emit(index, result, stage.fan_out)
+
+        with self._lock:
+            self._active_workers[index] -= 1
+            last_worker = self._active_workers[index] == 0
+        if not last_worker:
+            return
+        # The last worker of a stage flushes it and ends the next one
+        if stage.flush is not None and not self.failed:
+            try:
+                self._emit(index, stage.flush(), True)
+            except BaseException as e:
+                self._fail(stage, e)
+        if index + 1 < len(self.stages):
+            for _ in range(self.stages[index + 1].workers):
+                self._queues[index + 1].put(_END)
+
+    def run(self, source: Iterable) -> dict:
+        """
+        Feed every source item through the stages and wait for them to finish.
+
+        :return: {"wall_time_s", "stages": {name: {"items", "busy_s", "items_per_s", "workers", "max_queue_depth"}}}.
+        :raises: The first exception raised by the source or a stage.
+        """
+        self._active_workers = [stage.workers for stage in self.stages]
+        start_time = time.perf_counter()
+        threads = [threading.Thread(target=self._feed, args=(source,), name=f"{self.name}-source", daemon=True)]
+        for index, stage in enumerate(self.stages):
+            threads += [threading.Thread(target=self._work, args=(index,), name=f"{self.name}-{stage.name}-{worker}",
+                                         daemon=True)
+                        for worker in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            logger.warning(f"StagePipeline {self.name}: Interrupted, finishing the items already in the pipeline")
+            self.stop()
+            for thread in threads:
+                thread.join()
+            raise
+
+        wall_time = time.perf_counter() - start_time
+        stats = {"wall_time_s": round(wall_time, 3), "stages": {
+            stage.name: {"items": stage.items, "busy_s": round(stage.busy_seconds, 3),
+                         "items_per_s": round(stage.items / wall_time, 2) if wall_time > 0 else 0.0,
+                         "workers": stage.workers, "max_queue_depth": stage.max_queue_depth}
+            for stage in self.stages}}
+        logger.info(f"StagePipeline {self.name}: {stats}")
+        if self._error is not None:
+            raise self._error
+        return stats
@@ -0,0 +1,75 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimeline:
+    """
+    Records how long each startup phase (imports, component inits, probes) takes.
+
+    Phases are recorded once per process; the report is served on /startupz and
+    logged when the app finishes its first render.
+    """
+
+    def __init__(self):
+        self.process_start = time.perf_counter()
+        self._phases: list[dict] = []
+        self._recorded: set[str] = set()
+        self._logged = False
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time a startup phase; repeated phases (e.g. on Streamlit reruns) are only recorded the first time."""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start_time) * 1000, start_time)
+
+    def record(self, name: str, duration_ms: float, started_at: float = None) -> None:
+        with self._lock:
+            if name in self._recorded:
+                return
+            self._recorded.add(name)
+            started_at = started_at if started_at is not None else time.perf_counter() - duration_ms / 1000
+            self._phases.append({
+                "phase": name,
+                "start_ms": round((started_at - self.process_start) * 1000, 1),
+                "duration_ms": round(duration_ms, 1),
+            })
+
+    def report(self) -> dict:
+        """Phases in start order, plus the registry's per-component init timings."""
+        from utils.registry import registry
+        with self._lock:
+            phases = sorted(self._phases, key=lambda phase: phase["start_ms"])
+        return {
+            "uptime_ms": round((time.perf_counter() - self.process_start) * 1000, 1),
+            "phases": phases,
+            "components": {name: state["init_ms"] for name, state in registry.status().items()},
+        }
+
+    def format_report(self) -> str:
+        report = self.report()
+        lines = [f"Startup timeline (uptime {report['uptime_ms']:.0f} ms):"]
+        for phase in report["phases"]:
+            lines.append(f"  +{phase['start_ms']:>8.1f} ms  {phase['duration_ms']:>8.1f} ms  {phase['phase']}")
+        for name, init_ms in report["components"].items():
+            lines.append(f"  component {name}: {'pending' if init_ms is None else f'{init_ms:.1f} ms'}")
+        return "\n".join(lines)
+
+    def log_once(self) -> None:
+        """Log the report the first time the app is ready; later Streamlit reruns are no-ops."""
+        with self._lock:
+            if self._logged:
+                return
+            self._logged = True
+        logger.info(self.format_report())
+
+
+timeline = StartupTimeline()